@@ -8,14 +8,34 @@ from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 import logging
 
+from services.menu_matcher import MenuMatcher, tokenize
+from services import intent_router
+
 logger = logging.getLogger(__name__)
 
+NUMBER_WORDS = {
+    'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5,
+    'six': 6, 'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10,
+    'ek': 1, 'teen': 3, 'char': 4, 'paanch': 5, 'couple': 2
+}
+
+# Words that end one item and start the next in "2 butter chicken and 3 naan"
+ITEM_SEPARATORS = {'and', 'aur', 'plus', 'then', ',', '&', '+', ';'}
+
+SPICE_WORDS = {'mild', 'medium', 'spicy', 'hot'}
+
+# Modifier prefixes that take the following word: "no onion", "extra cheese", "less oil"
+MODIFIER_PREFIXES = {'no', 'without', 'less', 'extra', 'little', 'jain'}
+
+_UTTERANCE_TOKEN_RE = re.compile(r"\d+|[a-z]+(?:'[a-z]+)?|[,&+;]")
+
 class ChatbotNLPService:
     """Simple NLP service for processing restaurant orders"""
     
     def __init__(self, db):
         self.db = db
         self.menu_cache = {}
+        self.matcher = MenuMatcher([])
         
     async def refresh_menu_cache(self):
         """Cache menu items for faster lookup"""
@@ -25,22 +45,12 @@ class ChatbotNLPService:
             for item in menu_items
         }
         
-        # Also create partial match dictionary
-        self.partial_matches = {}
-        for name, item in self.menu_cache.items():
-            words = name.split()
-            for word in words:
-                if word not in self.partial_matches:
-                    self.partial_matches[word] = []
-                self.partial_matches[word].append(item)
+        # Token + trigram index for ranked fuzzy lookups
+        self.matcher = MenuMatcher(menu_items)
     
     def extract_quantity(self, text: str) -> Tuple[int, str]:
         """Extract quantity from text like '2 paneer tikka' or 'two butter naan'"""
-        # Number words mapping
-        number_words = {
-            'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5,
-            'six': 6, 'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10
-        }
+        number_words = NUMBER_WORDS
         
         # Try to find numeric quantity
         numeric_match = re.match(r'^(\d+)\s+(.+)$', text.strip())
@@ -63,18 +73,8 @@ class ChatbotNLPService:
         if item_lower in self.menu_cache:
             return self.menu_cache[item_lower]
         
-        # Partial match
-        words = item_lower.split()
-        matches = []
-        for word in words:
-            if word in self.partial_matches:
-                matches.extend(self.partial_matches[word])
-        
-        if matches:
-            # Return first match (can be improved with scoring)
-            return matches[0]
-        
-        return None
+        # Best ranked fuzzy match
+        return self.matcher.best(item_lower)
     
     def extract_modifiers(self, text: str) -> Dict[str, str]:
         """Extract modifiers like 'extra spicy', 'no onion', etc."""
@@ -94,6 +94,92 @@ class ChatbotNLPService:
         
         return modifiers
     
+    def parse_utterance(self, text: str) -> List[Dict]:
+        """
+        Single pass over an utterance, split into one segment per item:
+            "2 butter chicken extra spicy and 3 naan"
+            → [{'quantity': 2, 'text': 'butter chicken', 'modifiers': ['extra spicy']},
+               {'quantity': 3, 'text': 'naan', 'modifiers': []}]
+        
+        A quantity ("2", "two", "2x", "x2") after the item words starts a new
+        item unless it is the last word of the segment ("butter naan 2").
+        Modifier-only segments ("..., extra spicy") attach to the previous item.
+        """
+        text = re.sub(r'\b(\d+)\s*x\b|\bx\s*(\d+)\b', lambda m: m.group(1) or m.group(2), text.lower())
+        tokens = _UTTERANCE_TOKEN_RE.findall(text)
+        
+        segments = []
+        current = {'quantity': None, 'words': [], 'modifiers': []}
+        
+        def close():
+            if current['words']:
+                segments.append({
+                    'quantity': current['quantity'] or 1,
+                    'text': ' '.join(current['words']),
+                    'modifiers': current['modifiers']
+                })
+            elif current['modifiers'] and segments:
+                segments[-1]['modifiers'].extend(current['modifiers'])
+            current.update(quantity=None, words=[], modifiers=[])
+        
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            next_token = tokens[i + 1] if i + 1 < len(tokens) else None
+            
+            if token in ITEM_SEPARATORS:
+                close()
+            elif token.isdigit() or token in NUMBER_WORDS:
+                quantity = int(token) if token.isdigit() else NUMBER_WORDS[token]
+                if current['words'] and not tokenize(' '.join(current['words'])):
+                    current['words'] = []   # only filler so far ("i want 2 ...")
+                if current['words']:
+                    if current['quantity'] is None and (next_token is None or next_token in ITEM_SEPARATORS):
+                        current['quantity'] = quantity   # trailing: "butter naan 2"
+                    else:
+                        close()
+                        current['quantity'] = quantity
+                else:
+                    current['quantity'] = quantity
+            elif token == 'extra' and next_token in SPICE_WORDS:
+                current['modifiers'].append(f"extra {next_token}")
+                i += 1
+            elif token in SPICE_WORDS:
+                current['modifiers'].append(token)
+            elif token in MODIFIER_PREFIXES and token != 'jain' and next_token and next_token not in ITEM_SEPARATORS:
+                current['modifiers'].append(f"{token} {next_token}")
+                i += 1
+            elif token == 'jain':
+                current['modifiers'].append('jain')
+            else:
+                current['words'].append(token)
+            i += 1
+        close()
+        
+        return segments
+    
+    def resolve_order(self, text: str, matcher: Optional[MenuMatcher] = None) -> Dict:
+        """
+        Parse an utterance and resolve every segment against the menu index.
+        Returns {'items': [(quantity, menu_item, special_instructions)], 'unmatched': [segment text]}
+        """
+        matcher = matcher or self.matcher
+        items = []
+        unmatched = []
+        
+        for segment in self.parse_utterance(text):
+            item_tokens = tokenize(segment['text'])
+            if not item_tokens:
+                continue
+            ranked = matcher.score_tokens(item_tokens, limit=1, min_score=0.5)
+            if not ranked:
+                unmatched.append(segment['text'])
+                continue
+            special = ', '.join(m.capitalize() for m in segment['modifiers'])
+            items.append((segment['quantity'], matcher.items[ranked[0][1]], special))
+        
+        return {'items': items, 'unmatched': unmatched}
+    
     async def process_message(self, message: str, context: Dict) -> Dict:
         """
         Process user message and return intent + entities
@@ -110,8 +196,11 @@ class ChatbotNLPService:
         if not self.menu_cache:
             await self.refresh_menu_cache()
         
+        parsed = self.resolve_order(message)
+        intent = intent_router.classify(message, item_hint=1.0 if parsed['items'] else 0.0)['intent']
+        
         # Intent: Show menu
-        if any(word in message for word in ['menu', 'show menu', 'what do you have']):
+        if intent == 'show_menu':
             categories = set(item['category'] for item in self.menu_cache.values())
             return {
                 'intent': 'show_menu',
@@ -120,45 +209,32 @@ class ChatbotNLPService:
             }
         
         # Intent: Confirm order
-        if any(word in message for word in ['confirm', 'yes', 'correct', 'done', 'that\'s all']):
+        if intent == 'confirm_order':
             return {
                 'intent': 'confirm_order',
                 'response': 'Great! I\'ll process your order now.'
             }
         
         # Intent: Cancel
-        if any(word in message for word in ['cancel', 'stop', 'no', 'forget it']):
+        if intent == 'cancel':
             return {
                 'intent': 'cancel',
                 'response': 'Order cancelled. Let me know if you need anything else!'
             }
         
         # Intent: Add items (default)
-        # Parse items from message
+        # Parse every (quantity, item, modifiers) in the message in one pass
         items_found = []
         
-        # Split by 'and' or comma
-        parts = re.split(r'\s+and\s+|,\s*', message)
-        
-        for part in parts:
-            quantity, item_text = self.extract_quantity(part)
-            modifiers = self.extract_modifiers(part)
-            
-            menu_item = await self.find_menu_item(item_text)
-            
-            if menu_item:
-                special_instructions = modifiers.get('special', '')
-                if 'spice' in modifiers:
-                    special_instructions = f"{modifiers['spice']} {special_instructions}".strip()
-                
-                items_found.append({
-                    'menuitemid': str(menu_item['_id']),
-                    'menuitemname': menu_item['name'],
-                    'quantity': quantity,
-                    'price': menu_item['price'],
-                    'specialinstructions': special_instructions,
-                    'foodtype': menu_item.get('foodtype', 'veg')
-                })
+        for quantity, menu_item, special_instructions in parsed['items']:
+            items_found.append({
+                'menuitemid': str(menu_item['_id']),
+                'menuitemname': menu_item['name'],
+                'quantity': quantity,
+                'price': menu_item['price'],
+                'specialinstructions': special_instructions,
+                'foodtype': menu_item.get('foodtype', 'veg')
+            })
         
         if items_found:
             return {
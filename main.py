@@ -74,7 +74,7 @@ import asyncio
 from pydantic import BaseModel, Field, validator
 from typing import Optional, List, Union
 from pathlib import Path
-from fastapi import FastAPI, APIRouter, HTTPException, Form , Body, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, APIRouter, HTTPException, Form , Body, Header, WebSocket, WebSocketDisconnect
 from passlib.context import CryptContext
 from datetime import datetime
 from fastapi.staticfiles import StaticFiles
@@ -83,6 +83,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
+import re
 import uuid
 from routes import payments
 from routes import inventory
@@ -100,6 +101,22 @@ import pytz
 from chatbot_service import ChatbotNLPService
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from routes.payment_routes import router as payment_router, init_payment_routes
+from routes.customers import router as customer_router, init_customer_routes, create_list_indexes
+from services import pricing
+from services.table_state import table_state
+from services.payment_matcher import payment_matcher
+from services.payment_queue import payment_queue
+from services.order_placement import order_placement
+from services.menu_cache import menu_cache, chat_menu_item
+from services.menu_availability import menu_availability
+from services.ai_client import ai_client, AIServiceUnavailable
+from services.session_store import SessionStore
+from services import intent_router
+from services.customer_search import customer_search
+from services.customer_stats import customer_stats
+from services.loyalty import loyalty
+from services import orders as orders_service
+from services.mongo_format import prepare_for_mongo, parse_from_mongo
 #Fix ObjectId serialization
 from bson import ObjectId
 from datetime import datetime
@@ -262,10 +279,12 @@ class IngredientItem(BaseModel):
         extra = "ignore"
 
 class OrderItem(BaseModel):
+    line_id: str = Field(default_factory=lambda: str(uuid.uuid4()))  # Stable key for $pull / line edits
     menuitemid: Optional[str] = ''
     menuitemname: Optional[str] = ''
     price: float = 0
     quantity: int = 1
+    tax_rate: Optional[float] = Field(default=None, ge=0, le=100)  # Per-item GST rate in percent (5 = 5%); None = default 5%
     foodtype: Optional[str] = 'veg'
     category: Optional[str] = ''
     specialinstructions: Optional[str] = ''
@@ -368,55 +387,12 @@ def generate_order_id():
     """Generate a short 8-character order ID like '68786a3c'"""
     return secrets.token_hex(4)  # Generates 8 hex characters
 
-# ==================== CUSTOMER MODELS ====================
-class Address(BaseModel):
-    type: str = "home"  # home, work, other
-    line1: str
-    line2: Optional[str] = ""
-    landmark: Optional[str] = ""
-    city: str
-    pincode: str
-    is_default: bool = True
-
-class OrderHistory(BaseModel):
-    total_orders: int = 0
-    total_spent: float = 0.0
-    average_order_value: float = 0.0
-    last_order_date: Optional[datetime] = None
-    favorite_items: List[str] = []
-
-class CustomerCreate(BaseModel):
-    name: str
-    phone: str
-    email: Optional[str] = ""
-    addresses: List[Address] = []
-
-class CustomerUpdate(BaseModel):
-    name: Optional[str] = None
-    phone: Optional[str] = None
-    email: Optional[str] = None
-    addresses: Optional[List[Address]] = None
-    status: Optional[str] = None
-
-class Customer(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    customer_id: str
-    name: str
-    phone: str
-    email: Optional[str] = ""
-    addresses: List[Address] = []
-    order_history: OrderHistory = OrderHistory()
-    loyalty_points: int = 0
-    status: str = "active"  # active, inactive
-    created_at: datetime = Field(default_factory=lambda: datetime.now(IST))
-    updated_at: datetime = Field(default_factory=lambda: datetime.now(IST))
-
 # ==================== NEW DISCOUNT MODEL ====================
 class Discount(BaseModel):
     type: str  # percentage, fixed
     value: float
     reason: Optional[str] = ""
-    amount: float
+    amount: float = 0.0  # Filled in by the pricing engine
 
 class Order(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -431,6 +407,7 @@ class Order(BaseModel):
     total_amount: float
     discount: Optional[Discount] = None
     gst_applicable: bool = False  
+    gst_inclusive: bool = False  # Menu prices already include GST
     gst_amount: float = 0.0
     final_amount: float = 0.0 
     status: OrderStatus = OrderStatus.PENDING
@@ -440,6 +417,7 @@ class Order(BaseModel):
     updated_at: datetime = Field(default_factory=lambda: datetime.now(IST))
     estimated_completion: Optional[datetime] = None
     kot_generated: bool = False
+    version: int = 0  # Optimistic concurrency counter, bumped by every write
 
     @validator('table_number', pre=True, always=True)
     def convert_table_number(cls, v):
@@ -463,6 +441,7 @@ class OrderCreate(BaseModel):
     items: List[OrderItem]
     discount: Optional[Discount] = None
     gst_applicable: bool = False 
+    gst_inclusive: bool = False
 
 class OrderUpdate(BaseModel):
     customer_name: Optional[str] = None
@@ -480,6 +459,11 @@ class OrderUpdate(BaseModel):
         allow_population_by_field_name = True
         allow_population_by_alias = True
 
+class OrderItemPatch(BaseModel):
+    """Partial update of one order line (quantity 0 removes the line)"""
+    quantity: Optional[int] = Field(default=None, ge=0)
+    specialinstructions: Optional[str] = None
+
 class KOT(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     order_id: str
@@ -549,58 +533,79 @@ class Admin(BaseModel):
     password: str = Field(..., min_length=6)
     created_at: Optional[datetime] = None
 
-# ==================== NEW CUSTOMER MODELS ====================
+# ==================== HELPER FUNCTIONS ====================
+# prepare_for_mongo / parse_from_mongo live in services/mongo_format.py
 
 
+# ==================== ORDER VERSIONING ====================
+def parse_if_match(if_match: Optional[str]) -> Optional[int]:
+    """Read the expected order version from an If-Match header ('3', '"3"' or 'W/"3"')"""
+    if if_match is None or if_match.strip() in ("", "*"):
+        return None
+    value = if_match.strip()
+    if value.startswith("W/"):
+        value = value[2:]
+    try:
+        return int(value.strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid If-Match header: {if_match}")
 
 
-# ==================== HELPER FUNCTIONS ====================
-def prepare_for_mongo(data: Dict[str, Any]) -> Dict[str, Any]:
-    """Convert Pydantic models to MongoDB format.
-    IMPORTANT: Keep datetime objects as datetime for proper MongoDB sorting!
+def version_filter(version: int):
+    """Mongo filter value for an order version (orders created before versioning have no field)"""
+    return {"$in": [0, None]} if version == 0 else version
+
+
+async def raise_order_write_conflict(order_id: str, expected_version: Optional[int], missing_detail: str = "Order not found"):
+    """Explain why a guarded order write matched nothing: 404 if gone, 409 if someone else wrote first"""
+    current = await db.orders.find_one({"id": order_id}, {"version": 1})
+    if current is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    current_version = current.get("version", 0)
+    if expected_version is not None and current_version != expected_version:
+        raise HTTPException(
+            status_code=409,
+            detail={
+                "message": "Order was modified by another terminal. Reload and retry.",
+                "expected_version": expected_version,
+                "current_version": current_version
+            }
+        )
+    raise HTTPException(status_code=404, detail=missing_detail)
+
+
+def gst_flag_filter(gst_applicable: bool):
+    """Mongo filter value for gst_applicable (older orders may not have the field)"""
+    return True if gst_applicable else {"$in": [False, None]}
+
+
+# Stored order total → key of pricing.lines_paise()
+ORDER_TOTAL_FIELDS = {"total_amount": "gross", "gst_amount": "gst", "final_amount": "final"}
+
+
+def order_pricing_args(order: Dict[str, Any]) -> Dict[str, Any]:
+    """Pricing options stored on an order document"""
+    return {
+        "gst_applicable": bool(order.get("gst_applicable", False)),
+        "discount": order.get("discount"),
+        "gst_inclusive": bool(order.get("gst_inclusive", False))
+    }
+
+
+def totals_delta(paise: Dict[str, int], sign: int = 1, discount: Any = None) -> Dict[str, float]:
     """
-    for k, v in data.items():
-        if isinstance(v, datetime):
-            # ✅ KEEP as datetime object, DON'T convert to string!
-            if v.tzinfo is None:
-                v = v.replace(tzinfo=IST)
-            data[k] = v  # ✅ Store as datetime, not ISO string
-        elif isinstance(v, list):
-            data[k] = [prepare_for_mongo(i) if isinstance(i, dict) else i for i in v]
-    return data
+    $inc document that adds (sign=1) or removes (sign=-1) line amounts given in
+    integer paise (pricing.lines_paise, or the difference of two). Each delta
+    is an exact number of paise, so the running totals match a full reprice.
+    """
+    delta = {field: pricing.from_paise(sign * paise[key]) for field, key in ORDER_TOTAL_FIELDS.items()}
+    if discount:
+        delta["discount.amount"] = pricing.from_paise(sign * paise["discount"])
+    return delta
 
 
-def parse_from_mongo(data: Dict[str, Any]) -> Dict[str, Any]:
-    """Parse MongoDB document for Pydantic models."""
-    from bson import ObjectId
-    
-    if "_id" in data:
-        if "id" not in data:
-            data["id"] = str(data["_id"]) if isinstance(data["_id"], ObjectId) else data["_id"]
-            del data["_id"]
-    
-    for k, v in data.items():
-        if isinstance(v, datetime):
-            # ✅ FIX: Convert to IST before converting to ISO string
-            if v.tzinfo is None:
-                v = v.replace(tzinfo=IST)
-            else:
-                v = v.astimezone(IST)
-            data[k] = v.isoformat()
-        elif isinstance(v, str) and k.endswith(("at", "completion")):
-            try:
-                dt = datetime.fromisoformat(v.replace("Z", "+00:00"))
-                # ✅ FIX: Convert to IST
-                dt = dt.astimezone(IST)
-                data[k] = dt.isoformat()
-            except:
-                data[k] = v
-        elif isinstance(v, list):
-            data[k] = [parse_from_mongo(i) if isinstance(i, dict) else i for i in v]
-        elif isinstance(v, dict):
-            data[k] = parse_from_mongo(v)
-    
-    return data
+def paise_change(before: Dict[str, int], after: Dict[str, int]) -> Dict[str, int]:
+    return {key: after[key] - before[key] for key in after}
 
 
 
@@ -840,9 +845,6 @@ from typing import Optional, List, Dict as DictType
 import uuid
 from datetime import datetime, timezone
 
-# Store database reference globally
-chatbot_db = None
-
 class ChatMessage(BaseModel):
     message: str
     session_id: str
@@ -857,143 +859,27 @@ class ChatResponse(BaseModel):
     order_summary: Optional[DictType] = None
     action: Optional[str] = None
 
-# Session storage for ongoing orders
-chatbot_sessions = {}
-
-def get_session(session_id: str) -> Dict:
-    """Get or create a session"""
-    if session_id not in chatbot_sessions:
-        chatbot_sessions[session_id] = {
-            'items': [],
-            'table_number': None,
-            'customer_name': 'Walk-in',
-            'created_at': datetime.now(IST)
-        }
-    return chatbot_sessions[session_id]
-
-        # ===== Fetch menu items =====
-async def fetch_menu_items():
-            """Fetch all menu items from database"""
-            try:
-                if chatbot_db is None:
-                    logger.error("chatbot_db is None")
-                    return []
-                
-                menu_items = []
-                async for item in chatbot_db.menu_items.find({}):
-                    menu_items.append({
-                        'name': item.get('name', ''),
-                        'price': float(item.get('price', 0)) if item.get('price') else 0,
-                        'id': item.get('id') or str(item.get('_id', uuid.uuid4()))
-                    })
-                
-                logger.info(f"✅ Fetched {len(menu_items)} menu items")
-                return menu_items
-                
-            except Exception as e:
-                logger.error(f"Error fetching menu: {e}")
-                import traceback
-                traceback.print_exc()
-                return []
-
-
-
-
-
+# Session storage for ongoing orders (TTL + LRU bounded, mirrored to Mongo once connected)
+chatbot_sessions = SessionStore(
+    ttl_seconds=int(os.getenv("CHATBOT_SESSION_TTL_MINUTES", "120")) * 60,
+    max_sessions=int(os.getenv("CHATBOT_MAX_SESSIONS", "5000"))
+)
 
-async def create_order(session: Dict) -> Dict:
-    """Create order and KOT"""
-    try:
-        if chatbot_db is None:
-            logger.error("chatbot_db is None - cannot create order")
-            return None
-        
-        db = chatbot_db
-        
-        # Build order items with proper field mapping
-        matched_items = []
-        for item in session['items']:
-            # Chatbot stores 'name' and 'price', map them correctly
-            item_dict = {
-                'menuitemid': item.get('menuitemid') or item.get('id', str(uuid.uuid4())),
-                'menuitemname': item.get('menuitemname') or item.get('name', 'Unknown'),
-                'price': float(item.get('price', 0)) if item.get('price') else 0.0,
-                'quantity': int(item.get('quantity', 1)),
-                'specialinstructions': item.get('specialinstructions', ''),
-                'foodtype': item.get('foodtype', 'veg'),
-                'category': item.get('category', ''),
-                'iscustomitem': False,
-                'addedby': 'Chatbot',
-                'addedat': datetime.now(IST)
-            }
-            matched_items.append(item_dict)
-        
-        # Calculate totals - FIXED: Explicitly convert to float and use proper iteration
-        subtotal = 0.0
-        for item in matched_items:
-            subtotal += float(item['quantity']) * float(item['price'])
-        
-        gst = round(subtotal * 0.05, 2)
-        total = round(subtotal + gst, 2)
-        
-        order_id = str(uuid.uuid4())
-        order_number = f"ORD-{datetime.now().strftime('%Y%m%d%H%M%S')}"
-        
-        order_data = {
-            'id': order_id,
-            'order_id': order_number,
-            '_id': order_id,
-            'customer_name': session.get('customer_name', 'Walk-in'),
-            'table_number': session.get('table_number', 0),
-            'items': matched_items,
-            'total_amount': subtotal,
-            'gst_amount': gst,
-            'final_amount': total,
-            'gst_applicable': True,
-            'status': 'pending',
-            'payment_status': 'pending',
-            'kot_generated': False,
-            'created_at': datetime.now(IST),
-            'updated_at': datetime.now(IST)
-        }
-        
-        await db.orders.insert_one(order_data)
-        
-        # Generate KOT
-        kot_count = await db.kots.count_documents({})
-        kot_number = f"KOT-{kot_count + 1:04d}"
-        
-        kot_data = {
-            'id': kot_number,
-            'order_id': order_number,
-            'order_number': kot_number,
-            'table_number': session.get('table_number', 0),
-            'items': matched_items,
-            'status': 'pending',
-            'created_at': datetime.now(IST)
-        }
-        
-        await db.kots.insert_one(kot_data)
-        await db.orders.update_one({'id': order_id}, {'$set': {'kot_generated': True}})
-        
-        logger.info(f"✅ Order created: {order_number}, KOT: {kot_number}")
-        
-        return {
-            'order_id': order_id,
-            'order_number': order_number,
-            'kot_number': kot_number,
-            'total': total
-        }
-        
-    except Exception as e:
-        logger.error(f"Error creating order: {e}")
-        import traceback
-        traceback.print_exc()
-        return None
+# Utterance parser only - menu lookups go through menu_cache's matcher
+chatbot_parser = ChatbotNLPService(db=None)
 
+# Items per chatbot menu page ("menu page 2"); 0 shows the whole menu at once
+CHATBOT_MENU_PAGE_SIZE = int(os.getenv("CHATBOT_MENU_PAGE_SIZE", "25"))
 
+async def get_session(session_id: str, table_number=None, customer_name: Optional[str] = None) -> Dict:
+    """Get or create a session"""
+    return await chatbot_sessions.get_or_create(session_id, lambda: {
+        'items': [],
+        'table_number': table_number,
+        'customer_name': customer_name or 'Walk-in',
+        'created_at': datetime.now(IST)
+    })
 
-# Replace your entire chatbot endpoint (lines 813-990) with this:
 
 @app.post("/api/chatbot/message")
 async def chatbot_message_endpoint(chat: ChatMessage):
@@ -1002,72 +888,40 @@ async def chatbot_message_endpoint(chat: ChatMessage):
     
     try:
         # Initialize or get session
-        if chat.session_id not in chatbot_sessions:
-            chatbot_sessions[chat.session_id] = {
-                'items': [],
-                'customer_name': chat.customer_name or 'Walk-in',
-                'table_number': chat.table_number or 0,
-                'created_at': datetime.now(IST)
-            }
-        
-        session = chatbot_sessions[chat.session_id]
+        session = await get_session(chat.session_id, chat.table_number or 0, chat.customer_name)
         message = chat.message.lower().strip()
         
-        # ===== Fetch menu items =====
-        async def fetch_menu_items():
-            """Fetch all menu items from database"""
+        # ===== Classify intent (menu items named in the message count towards add_items) =====
+        try:
+            matcher = await menu_cache.matcher()
+        except Exception as e:
+            logger.error(f"Error loading menu matcher: {e}")
+            matcher = None
+        parsed = chatbot_parser.resolve_order(message, matcher) if matcher else {'items': [], 'unmatched': []}
+        intent = intent_router.classify(message, item_hint=1.0 if parsed['items'] else 0.0)['intent']
+        
+        # ===== INTENT: Show Menu =====
+        if intent == "show_menu":
+            # Grouped text and item list are precomputed per menu version
             try:
-                if chatbot_db is None:
-                    logger.error("chatbot_db is None")
-                    return []
-                
-                menu_items = []
-                cursor = chatbot_db.menu_items.find({})
-                async for item in cursor:
-                    menu_items.append({
-                        'name': item.get('name', ''),
-                        'price': float(item.get('price', 0)) if item.get('price') else 0,
-                        'id': str(item.get('_id', '')),
-                        'category': item.get('category', 'General'),
-                        'foodtype': item.get('foodtype', 'veg')
-                    })
-                
-                logger.info(f"✅ Fetched {len(menu_items)} menu items")
-                return menu_items
-                
+                rendering = await menu_cache.rendering()
             except Exception as e:
                 logger.error(f"Error fetching menu: {e}")
-                import traceback
-                traceback.print_exc()
-                return []
-        
-        # ===== INTENT: Show Menu =====
-        if any(word in message for word in ['menu', 'show', 'list', 'what', 'available']):
-            menu_items = await fetch_menu_items()
-            if not menu_items:
+                rendering = None
+            if not rendering or not rendering.items:
                 return ChatResponse(
                     response="Sorry, the menu is not available right now. Please try again in a moment!",
                     intent="error"
                 )
             
-            # Group by category
-            categories = {}
-            for item in menu_items:
-                cat = item.get('category', 'General')
-                if cat not in categories:
-                    categories[cat] = []
-                categories[cat].append(item)
-            
-            # Build menu text
-            menu_text = "📋 **Our Menu:**\n\n"
-            for category, items in categories.items():
-                menu_text += f"**{category}:**\n"
-                for item in items:
-                    emoji = "🌱" if item.get('foodtype') == 'veg' else "🍖"
-                    menu_text += f"  {emoji} {item['name']}  - ₹{item['price']:.1f}\n"
-                menu_text += "\n"
-            
-            menu_text += "💬 Type what you'd like to order!\nExample: 'I want 2 butter chicken' or 'add paneer tikka'"
+            # "show starters", "menu page 2"
+            category = rendering.find_category(message)
+            page_match = re.search(r"\bpage\s*(\d+)", message)
+            menu_text, menu_items = rendering.render(
+                category,
+                page=int(page_match.group(1)) if page_match else 1,
+                page_size=CHATBOT_MENU_PAGE_SIZE
+            )
             
             return ChatResponse(
                 response=menu_text,
@@ -1076,9 +930,8 @@ async def chatbot_message_endpoint(chat: ChatMessage):
             )
         
         # ===== INTENT: Add Items (Natural Language) =====
-        elif any(word in message for word in ['want', 'order', 'add', 'get', 'give', 'need', 'can i have', 'like', 'i\'ll have']):
-            menu_items = await fetch_menu_items()
-            if not menu_items:
+        elif intent == "add_items":
+            if not matcher:
                 return ChatResponse(
                     response="Sorry, couldn't load the menu to process your order.",
                     intent="error"
@@ -1086,45 +939,36 @@ async def chatbot_message_endpoint(chat: ChatMessage):
             
             matched_items = []
             
-            # Extract quantity from message
-            quantity = 1
-            for word in message.split():
-                if word.isdigit():
-                    quantity = int(word)
-                    break
-            
-            # Improved item matching - case insensitive partial match
-            search_words = [w.lower() for w in message.split() if len(w) > 2 and not w.isdigit()]
-            
-            for item in menu_items:
-                item_name_lower = item.get('name', '').lower()
-                
-                # Check if any significant word from message matches item name
-                if any(search_word in item_name_lower for search_word in search_words):
-                    matched_item = {
-                        'menuitemid': item['id'],
-                        'menuitemname': item['name'],
-                        'price': item['price'],
-                        'quantity': quantity,
-                        'foodtype': item.get('foodtype', 'veg'),
-                        'category': item.get('category', '')
-                    }
-                    matched_items.append(matched_item)
-                    break
+            # Every (quantity, item, modifiers) in the message, resolved against the menu index at once
+            for quantity, menu_item, special_instructions in parsed['items']:
+                item = chat_menu_item(menu_item)
+                matched_items.append({
+                    'menuitemid': item['id'],
+                    'menuitemname': item['name'],
+                    'price': item['price'],
+                    'quantity': quantity,
+                    'specialinstructions': special_instructions,
+                    'foodtype': item.get('foodtype', 'veg'),
+                    'category': item.get('category', '')
+                })
             
             if matched_items:
                 # Add to session
                 session['items'].extend(matched_items)
                 
-                total = sum(item['quantity'] * item['price'] for item in session['items'])
-                gst = total * 0.05
-                final_total = total + gst
+                totals = pricing.order_totals(session['items'], gst_applicable=True)
+                total = totals['total_amount']
+                gst = totals['gst_amount']
+                final_total = totals['final_amount']
                 
                 # Build items text
                 items_text = "\n".join([
                     f"• {item['quantity']}x {item['menuitemname']} - ₹{item['price'] * item['quantity']:.2f}"
+                    + (f" ({item['specialinstructions']})" if item['specialinstructions'] else "")
                     for item in matched_items
                 ])
+                if parsed['unmatched']:
+                    items_text += "\n\n🤔 Couldn't find: " + ", ".join(parsed['unmatched'])
                 
                 return ChatResponse(
                     response=f"✅ **Added to your order:**\n{items_text}\n\n💰 **Current Total: ₹{total:.2f}**\n\n➕ Want to add more? Just tell me!\n✅ Say 'confirm' to place order\n❌ Say 'cancel' to start over",
@@ -1143,9 +987,42 @@ async def chatbot_message_endpoint(chat: ChatMessage):
                     intent="item_not_found"
                 )
         
-                # ===== INTENT: Confirm Order =====
-                # ===== INTENT: Confirm Order =====
-        elif any(word in message for word in ['confirm', 'done', 'finish', 'complete', 'place', 'submit', 'yes']):
+        # ===== INTENT: Remove Items ("remove the naan") =====
+        elif intent == "remove_items":
+            # Every line of each named dish comes out of the cart
+            named = {}
+            for _, menu_item, _ in parsed['items']:
+                item = chat_menu_item(menu_item)
+                named[item['id']] = item['name']
+            removed = [name for item_id, name in named.items() if any(item['menuitemid'] == item_id for item in session['items'])]
+            if not removed:
+                return ChatResponse(
+                    response=f"🤔 {', '.join(named.values())} is not in your order.\n\n🛒 Say 'cart' to see what you have.",
+                    intent="item_not_found"
+                )
+            
+            session['items'] = [item for item in session['items'] if item['menuitemid'] not in named]
+            if not session['items']:
+                return ChatResponse(
+                    response=f"🗑️ **Removed:** {', '.join(removed)}\n\n🛒 Your cart is now empty. What would you like to order?",
+                    intent="remove_items",
+                    order_summary={'items': [], 'subtotal': 0.0, 'gst': 0.0, 'total': 0.0}
+                )
+            
+            totals = pricing.order_totals(session['items'], gst_applicable=True)
+            return ChatResponse(
+                response=f"🗑️ **Removed:** {', '.join(removed)}\n\n💰 **Current Total: ₹{totals['final_amount']:.2f}**\n\n✅ Say 'confirm' to place order",
+                intent="remove_items",
+                order_summary={
+                    'items': session['items'],
+                    'subtotal': totals['total_amount'],
+                    'gst': totals['gst_amount'],
+                    'total': totals['final_amount']
+                }
+            )
+        
+        # ===== INTENT: Confirm Order =====
+        elif intent == "confirm_order":
             if not session['items']:
                 return ChatResponse(
                     response="🛒 Your cart is empty!\n\nTell me what you'd like to order. Example: 'I want 2 butter chicken'",
@@ -1154,75 +1031,16 @@ async def chatbot_message_endpoint(chat: ChatMessage):
             
             try:
                 # Build order using same format as manual order (Place Order button)
-                total = sum(item['quantity'] * item['price'] for item in session['items'])
-                gst_amount = round(total * 0.05, 2)
-                final_total = round(total + gst_amount, 2)
+                order_data, kot_data = await orders_service.build_chatbot_order(db, session)
+                order_number = order_data['order_id']
+                kot_number = kot_data['id']
+                final_total = order_data['final_amount']
                 
-                # Generate order and KOT numbers
-                order_counter = await chatbot_db.orders.count_documents({}) + 1
-                order_number = f"ORD-{datetime.now().strftime('%Y%m%d')}-{order_counter:04d}"
-                
-                kot_counter = await chatbot_db.kots.count_documents({}) + 1
-                kot_number = f"KOT-{kot_counter:04d}"
-                
-                # FIX: Transform items to match expected format
-                fixed_items = []
-                for item in session['items']:
-                    fixed_items.append({
-                        'menuitemid': str(item.get('menuitemid', '')),
-                        'menuitemname': str(item.get('menuitemname', '')),
-                        'price': float(item.get('price', 0)),
-                        'quantity': int(item.get('quantity', 1)),
-                        'foodtype': item.get('foodtype', 'veg'),
-                        'category': item.get('category', ''),
-                        'specialinstructions': '',
-                        'iscustomitem': False,
-                        'addedby': 'Chatbot',
-                        'addedat': datetime.now(IST).isoformat()
-                    })
-                
-                # Create order directly in database
-                order_id = str(uuid.uuid4())
-                order_data = {
-                    'id': order_number,
-                    'order_id': order_number,
-                    'customer_name': session.get('customer_name', 'Walk-in'),
-                    'table_number': str(session.get('table_number', '0')),
-                    'items': fixed_items,
-                    'total_amount': total,
-                    'gst_amount': gst_amount,
-                    'final_amount': final_total,
-                    'gst_applicable': True,
-                    'status': 'pending',
-                    'payment_status': 'pending',
-                    'order_type': 'Dine-in',
-                    'kot_generated': False,
-                    'created_at': datetime.now(IST),
-                    'updated_at': datetime.now(IST)
-                }
-                
-                # Insert order into database
-                await chatbot_db.orders.insert_one(order_data)
-                
-                # Generate and insert KOT
-                kot_data = {
-                    'id': kot_number,
-                    'order_id': order_number,
-                    'order_number': kot_number,
-                    'table_number': str(session.get('table_number', '0')),
-                    'items': fixed_items,
-                    'status': 'pending',
-                    'created_at': datetime.now(IST)
-                }
-                
-                await chatbot_db.kots.insert_one(kot_data)
-                await chatbot_db.orders.update_one(
-                    {'id': order_number}, 
-                    {'$set': {'kot_generated': True}}
-                )
+                # Order, KOT, table and inventory in one unit (kot_generated is set on insert)
+                await order_placement.place(order_data, kot=kot_data)
                 
                 # Clear session
-                chatbot_sessions.pop(chat.session_id, None)
+                await chatbot_sessions.pop(chat.session_id)
                 
                 logger.info(f"✅ Chatbot order created: {order_number}, KOT: {kot_number}")
                 
@@ -1246,19 +1064,20 @@ async def chatbot_message_endpoint(chat: ChatMessage):
 
         
         # ===== INTENT: Cancel Order =====
-        elif any(word in message for word in ['cancel', 'clear', 'remove', 'delete', 'start over', 'reset']):
-            chatbot_sessions.pop(chat.session_id, None)
+        elif intent == "cancel":
+            await chatbot_sessions.pop(chat.session_id)
             return ChatResponse(
                 response="🗑️ **Order cancelled!**\n\nStarting fresh! What would you like to order?",
                 intent="cancel"
             )
         
         # ===== INTENT: Show Current Cart =====
-        elif any(word in message for word in ['cart', 'current', 'summary', 'total', 'bill', 'my order']):
+        elif intent == "show_cart":
             if session['items']:
-                total = sum(item['quantity'] * item['price'] for item in session['items'])
-                gst = total * 0.05
-                final_total = total + gst
+                totals = pricing.order_totals(session['items'], gst_applicable=True)
+                total = totals['total_amount']
+                gst = totals['gst_amount']
+                final_total = totals['final_amount']
                 
                 items_list = "\n".join([
                     f"🍽️ {item['quantity']}x {item['menuitemname']} - ₹{item['price'] * item['quantity']:.2f}"
@@ -1296,14 +1115,16 @@ async def chatbot_message_endpoint(chat: ChatMessage):
             response="Sorry, I encountered an error. Please try again!",
             intent="error"
         )
+    
+    finally:
+        # Persist cart changes (no-op for sessions cleared above)
+        await chatbot_sessions.save(chat.session_id)
 
 
 
 logger.info("✅ Full functional chatbot endpoint registered")
 # ============ END CHATBOT ENDPOINT ============
 
-import httpx
-
 class AIChatRequest(BaseModel):
     message: str
 
@@ -1311,25 +1132,28 @@ class AIChatRequest(BaseModel):
 async def ai_chat_proxy(request: AIChatRequest):
     """
     Proxy to AI service for intelligent menu search
+    (pooled client, prompt cache and circuit breaker in services/ai_client.py)
     """
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "http://localhost:8003/chat",
-                json={"message": request.message},
-                timeout=30.0
-            )
-            return response.json()
-    except httpx.RequestError as e:
-        logger.error(f"AI Service connection error: {e}")
+        return await ai_client.chat(request.message)
+    except AIServiceUnavailable as e:
+        logger.error(f"AI Service unavailable: {e}")
         raise HTTPException(
             status_code=503,
             detail="AI service unavailable. Using fallback chatbot."
         )
+    except httpx.HTTPStatusError as e:
+        logger.error(f"AI Service rejected request: {e}")
+        raise HTTPException(status_code=e.response.status_code, detail="AI service rejected the request")
     except Exception as e:
         logger.error(f"AI chat error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/ai-chat/stats")
+async def ai_chat_stats():
+    """Circuit state and prompt cache counters of the AI proxy"""
+    return ai_client.stats()
+
 logger.info("✅ AI service proxy endpoint registered")
 
 from routes.kot_printer import routes as kot_routes
@@ -1351,6 +1175,7 @@ async def add_cache_control_headers(request, call_next):
 app.add_middleware(NoCacheMiddleware)
 
 app.include_router(payment_router)
+app.include_router(customer_router)
 app.include_router(kot_routes)
 inventory.set_db(db)  # Pass database reference to inventory module
 app.include_router(inventory.router, prefix="/api")  # Fixed prefix
@@ -1401,7 +1226,7 @@ scheduler = AsyncIOScheduler()
 
 @app.on_event("startup")
 async def startup():
-    global mongo_client, db, chatbot_db, mongodb_connected
+    global mongo_client, db, mongodb_connected
     
     logger.info("🚀 Starting TasteParadise...")
     
@@ -1429,7 +1254,6 @@ async def startup():
             # Test the connection
             await mongo_client.admin.command('ping')
             db = mongo_client.taste_paradise
-            chatbot_db = db
             
             # Create collections if needed
             try:
@@ -1443,18 +1267,70 @@ async def startup():
             except Exception as e:
                 logger.warning(f"Could not create collections: {e}")
             
+            menu_cache.set_db(db)
+            
+            # Chatbot sessions survive restarts unless disabled
+            if os.getenv("CHATBOT_SESSION_PERSIST", "1") == "1":
+                try:
+                    await chatbot_sessions.enable_persistence(db.chatbot_sessions)
+                except Exception as e:
+                    logger.warning(f"Chatbot session persistence disabled: {e}")
+            
             # Initialize inventory system
             try:
                 inventory.set_db(db)
                 await inventory.initialize_collections()
+                await inventory.load_snapshot()
+                await menu_availability.init(db, inventory.normalize_to_base_unit, broadcast=manager.broadcast)
+                # Catch up on usage rollups missed while the machine was off
+                asyncio.create_task(inventory.refresh_consumption())
                 logger.info("✅ Inventory system initialized")
             except Exception as e:
                 logger.error(f"Inventory initialization failed: {e}")
             
+            # Load table → active order index
+            try:
+                await table_state.load(db)
+            except Exception as e:
+                logger.error(f"Table state initialization failed: {e}")
+            
+            # Order placement unit of work (transactions or outbox replay)
+            try:
+                await order_placement.init(
+                    db, mongo_client,
+                    deduct_inventory=inventory.deduct_for_order,
+                    after_deduction=inventory.after_deduction
+                )
+            except Exception as e:
+                logger.error(f"Order placement initialization failed: {e}")
+            
+            # Lines stored before line ids existed (the line endpoints address lines by id)
+            try:
+                await orders_service.backfill_line_ids(db)
+            except Exception as e:
+                logger.error(f"Order line id backfill failed: {e}")
+            
+            # Customer type-ahead tries - loaded in the background, search falls back to Mongo meanwhile
+            asyncio.create_task(customer_search.init(db))
+            try:
+                await customer_stats.init(db)
+                await create_list_indexes(db)
+            except Exception as e:
+                logger.error(f"Customer stats initialization failed: {e}")
+            
+            # Pending-amount index for payment auto-matching
+            try:
+                await payment_matcher.init(db)
+                await payment_queue.start(db, broadcast=manager.broadcast)
+            except Exception as e:
+                logger.error(f"Payment matcher initialization failed: {e}")
+            
             # Initialize payment routes
             try:
                 logger.info("✅ Chatbot database reference set")
                 init_payment_routes(db)
+                init_customer_routes(db)
+                payments.init_legacy_payment_routes(db, manager.broadcast)
                 logger.info("✅ Payment routes initialized successfully")
             except Exception as e:
                 logger.error(f"Payment routes initialization failed: {e}")
@@ -1566,16 +1442,49 @@ async def startup():
     except Exception as e:
         logger.error(f"Scheduler error: {e}")
     
+    # Nightly check of loyalty balances against the ledger
+    try:
+        if not scheduler.get_job('loyalty_reconcile'):
+            scheduler.add_job(
+                loyalty.reconcile,
+                "cron",
+                hour=3,
+                minute=0,
+                id="loyalty_reconcile",
+                replace_existing=True
+            )
+    except Exception as e:
+        logger.error(f"Scheduler error: {e}")
+    
+    # Nightly ingredient usage rollup and stock-out forecasts
+    try:
+        if not scheduler.get_job('consumption_forecast'):
+            scheduler.add_job(
+                inventory.refresh_consumption,
+                "cron",
+                hour=2,
+                minute=30,
+                id="consumption_forecast",
+                replace_existing=True
+            )
+    except Exception as e:
+        logger.error(f"Scheduler error: {e}")
+    
     if not scheduler.running:
         scheduler.start()
         logger.info("Scheduler started - daily reset scheduled for midnight")
 
+    # One pooled client for the AI chat proxy, closed on shutdown
+    await ai_client.start()
+
 @app.on_event("shutdown")
 async def shutdown():
     global _app_started
     try:
         if scheduler.running:
             scheduler.shutdown()
+        await ai_client.close()
+        await payment_queue.stop()
         if mongo_client:
             mongo_client.close()
         stop_mongodb()
@@ -1594,11 +1503,22 @@ async def daily_reset():
         logger.error(f"Error in daily reset: {str(e)}")
 
 # ==================== MENU ENDPOINTS ====================
+async def reload_menu_availability():
+    """Recipes changed - rebuild the ingredient → dish index (see services/menu_availability.py)"""
+    if not menu_availability.loaded:
+        return
+    try:
+        await menu_availability.reload_menu()
+    except Exception as e:
+        logger.error(f"Menu availability reload failed: {e}")
+
 @api_router.post("/menu", response_model=MenuItem)
 async def create_menu_item(item: MenuItemCreate):
     menu_item = MenuItem(**item.model_dump())
     item_dict = prepare_for_mongo(menu_item.model_dump())
     await db.menu_items.insert_one(item_dict)
+    menu_cache.invalidate("menu item created")
+    await reload_menu_availability()
     return menu_item
 
 @api_router.get("/menu", response_model=List[MenuItem])
@@ -1618,6 +1538,8 @@ async def update_menu_item(menu_item_id: str, item: MenuItemCreate = Body(...)):
     )
     if updated is None:
         raise HTTPException(status_code=404, detail="Menu item not found")
+    menu_cache.invalidate("menu item updated")
+    await reload_menu_availability()
     return MenuItem(**parse_from_mongo(updated))
 
 # ============== EXCEL IMPORT/EXPORT ENDPOINTS ==============
@@ -1770,6 +1692,9 @@ async def import_menu(file: UploadFile = File(...)):
             "errors": errors[:10]
         }
         
+        if imported_count:
+            menu_cache.invalidate("menu imported")
+            await reload_menu_availability()
         logger.info(f"Import complete: {result}")
         return result
         
@@ -1787,67 +1712,31 @@ async def delete_menu_item(menu_item_id: str):
     result = await db.menu_items.delete_one({"id": menu_item_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Menu item not found")
+    menu_cache.invalidate("menu item deleted")
+    await reload_menu_availability()
     return {"message": "Menu item deleted successfully"}
 
     
 # ==================== ORDER ENDPOINTS ====================
 @api_router.post("/orders", response_model=Order)
 async def create_order(order_data: OrderCreate):
-    enriched_items = []
-    max_prep_time = 30
-    
-    for item in order_data.items:
-    # ✅ Get menuitemname with better fallback
-        item_name = getattr(item, 'menuitemname', None) or getattr(item, 'name', None) or "Unknown Item"
-    
-    # ✅ Add debug logging
-        logger.info(f"Processing item: ID={item.menuitemid}, Name={item_name}")
-    
-    # Try to find menu item for additional details
-        menu_item = await db.menu_items.find_one({"id": item.menuitemid})
-
-        
-        if menu_item:
-            max_prep_time = max(max_prep_time, menu_item.get('preparation_time', 15))
-            
-            enriched_item = OrderItem(
-                menuitemid=str(menu_item.get("id", item.menuitemid)),
-                menuitemname=item_name or menu_item.get("name", "Unknown Item"),
-                price=float(item.price),
-                quantity=int(item.quantity),
-                foodtype=menu_item.get("food_type", "veg"),
-                category=menu_item.get("category", ""),
-                specialinstructions=getattr(item, 'specialinstructions', "") or "",
-                iscustomitem=False,
-                addedby="POS",
-                addedat=datetime.now(IST)
-            )
-        else:
-            # Menu item not found - use frontend data
-            enriched_item = OrderItem(
-                menuitemid=item.menuitemid,
-                menuitemname=item_name or "Unknown Item",
-                price=float(item.price),
-                quantity=int(item.quantity),
-                specialinstructions=getattr(item, 'specialinstructions', "") or "",
-                iscustomitem=False,
-                addedby="POS",
-                addedat=datetime.now(IST)
-            )
-            logger.warning(f"Menu item not found for ID: {item.menuitemid}, using name: {item_name}")
-        
-        enriched_items.append(enriched_item)
+    cart = [item.model_dump() for item in order_data.items]
+    menu_items = await orders_service.menu_details(db, (item["menuitemid"] for item in cart))
     
-    # Calculate totals using enriched items
-    total_amount = sum(i.quantity * i.price for i in enriched_items)
-    
-    # Calculate GST if applicable
-    gst_amount = 0.0
-    final_amount = total_amount
-    
-    if order_data.gst_applicable:
-        gst_amount = round(total_amount * 0.05, 2)
-        final_amount = round(total_amount + gst_amount, 2)
+    enriched_items = []
+    for item in cart:
+        menu_item = menu_items.get(item["menuitemid"])
+        if not menu_item:
+            logger.warning(f"Menu item not found for ID: {item['menuitemid']}, using name: {item.get('menuitemname')}")
+        enriched_items.append(OrderItem(**orders_service.pos_line(item, menu_item)))
+    max_prep_time = orders_service.preparation_minutes(menu_items.values())
+    
+    # Price with the shared engine (discount first, then GST per line)
+    item_dicts = [i.model_dump() for i in enriched_items]
+    totals = pricing.order_totals(item_dicts, order_data.gst_applicable, order_data.discount, order_data.gst_inclusive)
+    total_amount = totals["total_amount"]
+    gst_amount = totals["gst_amount"]
+    final_amount = totals["final_amount"]
     
     estimated_completion = datetime.now(IST).replace(microsecond=0) + timedelta(minutes=max_prep_time)
     
@@ -1863,8 +1752,9 @@ async def create_order(order_data: OrderCreate):
         address=order_data.address,
         table_number=order_data.table_number,
         items=enriched_items,
-        discount=order_data.discount,
+        discount=pricing.discount_record(order_data.discount, item_dicts),
         gst_applicable=order_data.gst_applicable,
+        gst_inclusive=order_data.gst_inclusive,
         total_amount=total_amount,
         gst_amount=gst_amount,
         final_amount=final_amount,
@@ -1875,56 +1765,21 @@ async def create_order(order_data: OrderCreate):
     
     order_dict = prepare_for_mongo(order.model_dump())
     
-    await db.orders.insert_one(order_dict)
+    # ✅ Order, table and inventory deduction are written as one unit
+    placement = await order_placement.place(order_dict)
     
-    # ✅ AUTO-DEDUCT INVENTORY FOR ORDER
-    try:
-        logger.info(f"🔄 Attempting inventory deduction for order {order.order_id}")
-        
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            deduction_payload = {
-                "order_id": order.order_id,
-                "items": [
-                    {
-                        "menuitemid": item.menuitemid,
-                        "menuitemname": item.menuitemname,
-                        "quantity": item.quantity
-                    }
-                    for item in enriched_items
-                ]
-            }
-            
-            response = await client.post(
-                "http://127.0.0.1:8002/api/inventory/deduct-for-order",
-                json=deduction_payload
+    inventory_result = placement["inventory"]
+    if inventory_result:
+        if inventory_result.get("failed_items"):
+            logger.warning(
+                f"⚠️ Inventory deduction incomplete for order {order.order_id}: "
+                f"{inventory_result['failed_items']}"
+            )
+        else:
+            logger.info(
+                f"✅ Inventory deducted successfully for order {order.order_id}: "
+                f"{len(inventory_result.get('deducted_items', []))} items deducted"
             )
-            
-            if response.status_code == 200:
-                result = response.json()
-                logger.info(
-                    f"✅ Inventory deducted successfully for order {order.order_id}: "
-                    f"{len(result.get('deducted_items', []))} items deducted"
-                )
-            else:
-                logger.warning(
-                    f"⚠️ Inventory deduction failed for order {order.order_id}: "
-                    f"{response.status_code} - {response.text}"
-                )
-                
-    except httpx.RequestError as e:
-        logger.error(f"❌ Inventory service connection error for order {order.order_id}: {e}")
-        # Continue with order creation even if inventory fails
-    except Exception as e:
-        logger.error(f"❌ Unexpected error during inventory deduction for order {order.order_id}: {e}")
-        import traceback
-        traceback.print_exc()
-    
-    # Update table status if applicable
-    if order.table_number:
-        await db.tables.update_one(
-            {"table_number": order.table_number},
-            {"$set": {"status": "occupied", "current_order_id": order.id}}
-        )
     
     # Broadcast order creation
     await manager.broadcast({
@@ -2023,7 +1878,8 @@ async def fix_order_status():
                                 "status": correct_status,
                                 "payment_status": payment_status,
                                 "updated_at": datetime.now(IST).isoformat()
-                            }
+                            },
+                            "$inc": {"version": 1}
                         }
                     )
 
@@ -2302,10 +2158,16 @@ async def fix_order_dates():
         raise HTTPException(status_code=500, detail=str(e))
     
 @api_router.put("/orders/{order_id}", response_model=Order)
-async def update_order(order_id: str, order_data: OrderUpdate = Body(...)):
+async def update_order(
+    order_id: str,
+    response: Response,
+    order_data: OrderUpdate = Body(...),
+    if_match: Optional[str] = Header(None, alias="If-Match")
+):
     try:
         logger.info(f"DEBUG update_order {order_id} payload: {order_data}")
         
+        expected_version = parse_if_match(if_match)
         order_dict = order_data.model_dump(exclude_unset=True)
         
         # Recalculate amounts if items or gst_applicable changed
@@ -2315,56 +2177,361 @@ async def update_order(order_id: str, order_data: OrderUpdate = Body(...)):
             if not current_order:
                 raise HTTPException(status_code=404, detail="Order not found")
             
+            # ✅ Totals below are derived from this read - only write them back if nobody
+            # changed the order in between (clients without If-Match get our read version)
+            if expected_version is None:
+                expected_version = current_order.get("version", 0)
+            
             # Use updated items or keep current
             items = order_dict.get("items", current_order.get("items", []))
-            gst_applicable = order_dict.get("gst_applicable", current_order.get("gst_applicable", False))
-            
-            # Calculate subtotal
-            total_amount = sum(item.get("quantity", 0) * item.get("price", 0) for item in items)
-            
-            # Calculate GST
-            gst_amount = 0.0
-            final_amount = total_amount
-            
-            if gst_applicable:
-                gst_amount = round(total_amount * 0.05, 2)
-                final_amount = round(total_amount + gst_amount, 2)
+            pricing_args = order_pricing_args({**current_order, **order_dict})
             
-            order_dict["total_amount"] = total_amount
-            order_dict["gst_amount"] = gst_amount
-            order_dict["final_amount"] = final_amount
+            order_dict.update(pricing.order_totals(items, **pricing_args))
+            if pricing_args["discount"]:
+                order_dict["discount"] = pricing.discount_record(pricing_args["discount"], items)
             order_dict["estimated_completion"] = datetime.now(IST).replace(microsecond=0) + timedelta(minutes=30)
         
         logger.info(f"Calculated amounts: {order_dict}")
         order_dict["updated_at"] = datetime.now(IST)
         
+        query = {"id": order_id}
+        if expected_version is not None:
+            query["version"] = version_filter(expected_version)
+        
         updated = await db.orders.find_one_and_update(
-            {"id": order_id},
-            {"$set": order_dict},
+            query,
+            {"$set": order_dict, "$inc": {"version": 1}},
             return_document=True
         )
         
         if updated is None:
-            raise HTTPException(status_code=404, detail="Order not found")
-        
-        logger.info(f"Order {order_id} updated successfully")
+            await raise_order_write_conflict(order_id, expected_version)
+        
+        # Keep the table index in step with status / table changes
+        if updated.get("status") == OrderStatus.CANCELLED.value or updated.get("payment_status") == PaymentStatus.PAID.value:
+            await table_state.release(order_id)
+        elif "table_number" in order_dict:
+            await table_state.occupy(updated.get("table_number"), order_id)
+        payment_matcher.track(updated)
+        if updated.get("status") == OrderStatus.CANCELLED.value:
+            await customer_stats.on_cancelled(order_id)
+        elif updated.get("payment_status") == PaymentStatus.PAID.value:
+            await customer_stats.on_paid(order_id)
+        
+        logger.info(f"Order {order_id} updated successfully (version {updated['version']})")
         await manager.broadcast({
             "type": "order_updated",
             "order_id": order_id,
+            "version": updated["version"],
             "timestamp": datetime.now(IST).isoformat()
         })
+        response.headers["ETag"] = f'"{updated["version"]}"'
         return Order(**parse_from_mongo(updated))
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error updating order {order_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error updating order: {str(e)}")
 
 
+# ==================== ORDER LINE ITEM ENDPOINTS ====================
+LINE_WRITE_RETRIES = 5
+
+
+async def broadcast_order_lines(order: Dict[str, Any], delta: List[Dict[str, Any]]):
+    """Tell POS screens the order moved on and send the kitchen only the changed lines"""
+    payment_matcher.track(order)
+    await manager.broadcast({
+        "type": "order_updated",
+        "order_id": order["id"],
+        "version": order.get("version", 0),
+        "timestamp": datetime.now(IST).isoformat()
+    })
+    await manager.broadcast({
+        "type": "kitchen_delta",
+        "order_id": order["id"],
+        "order_number": order.get("order_id"),
+        "table_number": order.get("table_number"),
+        "delta": delta,
+        "timestamp": datetime.now(IST).isoformat()
+    })
+
+
+def raise_line_write_contention(order_id: str):
+    logger.warning(f"Gave up on line write for order {order_id} after {LINE_WRITE_RETRIES} attempts")
+    raise HTTPException(status_code=409, detail="Order is being edited on another terminal. Please retry.")
+
+
+def kitchen_line(item: Dict[str, Any], quantity_delta: int) -> Dict[str, Any]:
+    return {
+        "line_id": item.get("line_id"),
+        "menuitemid": item.get("menuitemid"),
+        "menuitemname": item.get("menuitemname"),
+        "quantity_delta": quantity_delta,
+        "specialinstructions": item.get("specialinstructions", "")
+    }
+
+
+def pricing_filter(pricing_args: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Filter that pins the pricing options a line delta was computed with -
+    if GST or the discount changes in between, the write misses and is retried
+    """
+    query = {
+        "gst_applicable": gst_flag_filter(pricing_args["gst_applicable"]),
+        "gst_inclusive": gst_flag_filter(pricing_args["gst_inclusive"])
+    }
+    discount = pricing_args["discount"]
+    if discount:
+        query["discount.type"] = discount.get("type")
+        query["discount.value"] = discount.get("value")
+    else:
+        query["discount"] = None
+    return query
+
+
+async def reprice_order_lines(order_id: str, mutate):
+    """
+    Line edit for orders whose totals are not line-additive (fixed discounts are
+    shared across lines): apply `mutate` to the full item list and reprice the
+    whole order, guarded by the version that was read.
+    `mutate(items)` returns (new_items, kitchen_delta).
+    """
+    for _ in range(LINE_WRITE_RETRIES):
+        current = await db.orders.find_one({"id": order_id})
+        if current is None:
+            raise HTTPException(status_code=404, detail="Order not found")
+        current_version = current.get("version", 0)
+        
+        items, delta = mutate(current.get("items", []))
+        pricing_args = order_pricing_args(current)
+        set_fields = {
+            "items": items,
+            "updated_at": datetime.now(IST),
+            **pricing.order_totals(items, **pricing_args)
+        }
+        if pricing_args["discount"]:
+            set_fields["discount"] = pricing.discount_record(pricing_args["discount"], items)
+        
+        updated = await db.orders.find_one_and_update(
+            {"id": order_id, "version": version_filter(current_version)},
+            {"$set": set_fields, "$inc": {"version": 1}},
+            return_document=True
+        )
+        if updated is not None:
+            return updated, delta
+    raise_line_write_contention(order_id)
+
+
+def find_line(items: List[Dict[str, Any]], line_id: str) -> Dict[str, Any]:
+    for item in items:
+        if item.get("line_id") == line_id:
+            return item
+    raise HTTPException(status_code=404, detail="Order item not found")
+
+
+async def load_order_line(order_id: str, line_id: str) -> Dict[str, Any]:
+    """Fetch just the pricing options and one line of an order"""
+    current = await db.orders.find_one(
+        {"id": order_id},
+        {
+            "id": 1, "gst_applicable": 1, "gst_inclusive": 1, "discount": 1,
+            "items": {"$elemMatch": {"line_id": line_id}}
+        }
+    )
+    if current is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    if not current.get("items"):
+        raise HTTPException(status_code=404, detail="Order item not found")
+    return current
+
+
+def line_filter(order_id: str, line: Dict[str, Any], pricing_args: Dict[str, Any]) -> Dict[str, Any]:
+    """Compare-and-swap filter on one line: misses if the line was changed or removed in between"""
+    return {
+        "id": order_id,
+        **pricing_filter(pricing_args),
+        "items": {"$elemMatch": {
+            "line_id": line.get("line_id"),
+            "quantity": line.get("quantity"),
+            "price": line.get("price")
+        }}
+    }
+
+
+@api_router.post("/orders/{order_id}/items", response_model=Order)
+async def add_order_items(
+    order_id: str,
+    response: Response,
+    items: List[OrderItem] = Body(...)
+):
+    """
+    Append items with $push and bump totals with $inc in the same atomic write.
+    There is no version guard, so two terminals adding to the same tab both
+    land without a conflict or a resend of the full list.
+    """
+    if not items:
+        raise HTTPException(status_code=400, detail="No items to add")
+    
+    new_items = [prepare_for_mongo(item.model_dump()) for item in items]
+    
+    delta = [kitchen_line(item, item["quantity"]) for item in new_items]
+    
+    for _ in range(LINE_WRITE_RETRIES):
+        current = await db.orders.find_one(
+            {"id": order_id},
+            {"gst_applicable": 1, "gst_inclusive": 1, "discount": 1}
+        )
+        if current is None:
+            raise HTTPException(status_code=404, detail="Order not found")
+        pricing_args = order_pricing_args(current)
+        
+        if not pricing.is_line_additive(pricing_args["discount"]):
+            updated, _ = await reprice_order_lines(order_id, lambda items: (items + new_items, delta))
+            break
+        
+        added = pricing.lines_paise(new_items, **pricing_args)
+        
+        # Pricing options are part of the filter: if they change in between, recompute the delta
+        updated = await db.orders.find_one_and_update(
+            {"id": order_id, **pricing_filter(pricing_args)},
+            {
+                "$push": {"items": {"$each": new_items}},
+                "$inc": {"version": 1, **totals_delta(added, discount=pricing_args["discount"])},
+                "$set": {"updated_at": datetime.now(IST)}
+            },
+            return_document=True
+        )
+        if updated is not None:
+            break
+    else:
+        raise_line_write_contention(order_id)
+    
+    logger.info(f"Added {len(new_items)} item(s) to order {order_id} (version {updated['version']})")
+    await broadcast_order_lines(updated, delta)
+    response.headers["ETag"] = f'"{updated["version"]}"'
+    return Order(**parse_from_mongo(updated))
+
+
+@api_router.patch("/orders/{order_id}/items/{line_id}", response_model=Order)
+async def patch_order_item(
+    order_id: str,
+    line_id: str,
+    response: Response,
+    patch: OrderItemPatch = Body(...)
+):
+    """
+    Change one line in place with a positional $set and move the totals by the
+    line's difference with $inc. The write is a compare-and-swap on that line
+    only, so edits to other lines of the same order never conflict with it.
+    """
+    if patch.quantity == 0:
+        return await remove_order_item(order_id, line_id, response)
+    
+    def patched(line: Dict[str, Any]) -> Dict[str, Any]:
+        new_line = dict(line)
+        if patch.quantity is not None:
+            new_line["quantity"] = patch.quantity
+        if patch.specialinstructions is not None:
+            new_line["specialinstructions"] = patch.specialinstructions
+        return new_line
+    
+    def patch_items(items):
+        line = find_line(items, line_id)
+        new_line = patched(line)
+        new_items = [new_line if item is line else item for item in items]
+        return new_items, [kitchen_line(new_line, new_line.get("quantity", 0) - line.get("quantity", 0))]
+    
+    for _ in range(LINE_WRITE_RETRIES):
+        current = await load_order_line(order_id, line_id)
+        pricing_args = order_pricing_args(current)
+        
+        if not pricing.is_line_additive(pricing_args["discount"]):
+            updated, delta = await reprice_order_lines(order_id, patch_items)
+            break
+        
+        line = current["items"][0]
+        new_line = patched(line)
+        set_fields = {"updated_at": datetime.now(IST)}
+        if patch.quantity is not None:
+            set_fields["items.$.quantity"] = patch.quantity
+        if patch.specialinstructions is not None:
+            set_fields["items.$.specialinstructions"] = patch.specialinstructions
+        
+        change = paise_change(
+            pricing.lines_paise([line], **pricing_args),
+            pricing.lines_paise([new_line], **pricing_args)
+        )
+        
+        updated = await db.orders.find_one_and_update(
+            line_filter(order_id, line, pricing_args),
+            {"$set": set_fields, "$inc": {"version": 1, **totals_delta(change, discount=pricing_args["discount"])}},
+            return_document=True
+        )
+        if updated is not None:
+            delta = [kitchen_line(new_line, new_line.get("quantity", 0) - line.get("quantity", 0))]
+            break
+    else:
+        raise_line_write_contention(order_id)
+    
+    logger.info(f"Patched item {line_id} of order {order_id} (version {updated['version']})")
+    await broadcast_order_lines(updated, delta)
+    response.headers["ETag"] = f'"{updated["version"]}"'
+    return Order(**parse_from_mongo(updated))
+
+
+@api_router.delete("/orders/{order_id}/items/{line_id}", response_model=Order)
+async def remove_order_item(
+    order_id: str,
+    line_id: str,
+    response: Response
+):
+    """Remove one line with $pull and take its amounts off the totals with $inc"""
+    def remove_line(items):
+        line = find_line(items, line_id)
+        return [item for item in items if item is not line], [kitchen_line(line, -line.get("quantity", 0))]
+    
+    for _ in range(LINE_WRITE_RETRIES):
+        current = await load_order_line(order_id, line_id)
+        pricing_args = order_pricing_args(current)
+        
+        if not pricing.is_line_additive(pricing_args["discount"]):
+            updated, delta = await reprice_order_lines(order_id, remove_line)
+            break
+        
+        line = current["items"][0]
+        removed = pricing.lines_paise([line], **pricing_args)
+        
+        updated = await db.orders.find_one_and_update(
+            line_filter(order_id, line, pricing_args),
+            {
+                "$pull": {"items": {"line_id": line_id}},
+                "$inc": {"version": 1, **totals_delta(removed, sign=-1, discount=pricing_args["discount"])},
+                "$set": {"updated_at": datetime.now(IST)}
+            },
+            return_document=True
+        )
+        if updated is not None:
+            delta = [kitchen_line(line, -line.get("quantity", 0))]
+            break
+    else:
+        raise_line_write_contention(order_id)
+    
+    logger.info(f"Removed item {line_id} from order {order_id} (version {updated['version']})")
+    await broadcast_order_lines(updated, delta)
+    response.headers["ETag"] = f'"{updated["version"]}"'
+    return Order(**parse_from_mongo(updated))
+
+
 @api_router.delete("/orders/{order_id}")
 async def delete_order(order_id: str):
-    result = await db.orders.delete_one({"id": order_id})
-    if result.deleted_count == 0:
+    deleted = await db.orders.find_one_and_delete({"id": order_id})
+    if deleted is None:
         raise HTTPException(status_code=404, detail="Order not found")
+    await table_state.release(order_id)
+    payment_matcher.forget(order_id)
+    await customer_stats.on_deleted(deleted)
     return {"message": "Order deleted successfully"}
 
 @api_router.post("/fix-old-orders")
@@ -2406,7 +2573,7 @@ async def fix_old_order_items():
             if needs_update:
                 await db.orders.update_one(
                     {"_id": order["_id"]},
-                    {"$set": {"items": updated_items}}
+                    {"$set": {"items": updated_items}, "$inc": {"version": 1}}
                 )
                 fixed_count += 1
                 logger.info(f"Fixed order: {order.get('order_id', order.get('_id'))}")
@@ -2425,8 +2592,14 @@ async def fix_old_order_items():
 
 
 @api_router.put("/orders/{order_id}/pay")
-async def pay_order(order_id: str, payment_data: dict = Body(...)):
+async def pay_order(
+    order_id: str,
+    response: Response,
+    payment_data: dict = Body(...),
+    if_match: Optional[str] = Header(None, alias="If-Match")
+):
     logger.info(f"Payment request for order {order_id}: {payment_data}")
+    expected_version = parse_if_match(if_match)
     payment_status = payment_data.get('payment_status', 'paid')
     payment_method = payment_data.get('payment_method')
     
@@ -2437,40 +2610,54 @@ async def pay_order(order_id: str, payment_data: dict = Body(...)):
         "updated_at": datetime.now(IST)
     }
     
+    query = {"id": order_id}
+    if expected_version is not None:
+        query["version"] = version_filter(expected_version)
+    
     updated = await db.orders.find_one_and_update(
-        {"id": order_id},
-        {"$set": update_data},
+        query,
+        {"$set": update_data, "$inc": {"version": 1}},
         return_document=True
     )
     
     if updated is None:
-        raise HTTPException(status_code=404, detail="Order not found")
+        await raise_order_write_conflict(order_id, expected_version)
+    if payment_status == PaymentStatus.PAID.value:
+        await table_state.release(order_id)
+        await customer_stats.on_paid(order_id)
+    payment_matcher.track(updated)
     logger.info(f"Order {order_id} payment updated successfully")
     await manager.broadcast({
         "type": "payment_updated",
         "order_id": order_id,
         "payment_status": payment_status,
         "payment_method": payment_method,
+        "version": updated["version"],
         "timestamp": datetime.now(IST).isoformat()
     })
     logger.info(f"Broadcast sent for order {order_id}")  # Add logging to debug
+    response.headers["ETag"] = f'"{updated["version"]}"'
     return {
         "message": "Payment processed and order marked as served",
         "order_id": order_id,
         "payment_status": payment_status,
-        "payment_method": payment_method
+        "payment_method": payment_method,
+        "version": updated["version"]
     }
 
 @api_router.put("/orders/{order_id}/cancel")
 async def cancel_order(order_id: str):
     updated = await db.orders.find_one_and_update(
         {"id": order_id},
-        {"$set": {"status": "cancelled", "updated_at": datetime.now(IST)}},
+        {"$set": {"status": "cancelled", "updated_at": datetime.now(IST)}, "$inc": {"version": 1}},
         return_document=True
     )
     
     if updated is None:
         raise HTTPException(status_code=404, detail="Order not found")
+    await table_state.release(order_id)
+    payment_matcher.track(updated)
+    await customer_stats.on_cancelled(order_id)
     return {"message": "Order cancelled", "order": parse_from_mongo(updated)}
 
 # ==================== KOT ENDPOINTS ====================
@@ -2493,7 +2680,7 @@ async def generate_kot(order_id: str):
     
     kot_dict = prepare_for_mongo(kot.model_dump())
     await db.kots.insert_one(kot_dict)
-    await db.orders.update_one({"id": order_id}, {"$set": {"kot_generated": True}})
+    await db.orders.update_one({"id": order_id}, {"$set": {"kot_generated": True}, "$inc": {"version": 1}})
     await manager.broadcast({
         "type": "kot_generated",
         "order_id": order_id,
@@ -2608,24 +2795,47 @@ async def get_pending_orders(date: str):
 async def create_table(table_data: TableCreate):
     table = RestaurantTable(**table_data.model_dump())
     table_dict = prepare_for_mongo(table.model_dump())
-    await db.tables.insert_one(table_dict)
+    await table_state.add_table(table_dict)
     return table
 
 @api_router.get("/tables", response_model=List[RestaurantTable])
 async def get_tables():
-    tables_cursor = db.tables.find({})
-    tables = []
-    async for table in tables_cursor:
-        tables.append(RestaurantTable(**parse_from_mongo(table)))
-    return tables
+    # Served from the in-memory table index - no collection scan
+    return table_state.all()
+
+@api_router.get("/tables/floor-plan")
+async def get_floor_plan():
+    """
+    Compact floor view: every table with its status, seats, position and a
+    summary of the orders open on it, in one response
+    """
+    plan = table_state.floor_plan()
+    order_ids = [order_id for table in plan for order_id in table["order_ids"]]
+    
+    summaries = {}
+    if order_ids:
+        orders_cursor = db.orders.find(
+            {"id": {"$in": order_ids}},
+            {
+                "_id": 0, "id": 1, "order_id": 1, "customer_name": 1, "status": 1,
+                "final_amount": 1, "kot_generated": 1, "created_at": 1, "version": 1
+            }
+        )
+        async for order in orders_cursor:
+            summaries[order["id"]] = parse_from_mongo(order)
+    
+    for table in plan:
+        table["orders"] = [summaries[order_id] for order_id in table.pop("order_ids") if order_id in summaries]
+    
+    return {
+        "tables": plan,
+        "occupied": sum(1 for table in plan if table["orders"]),
+        "total": len(plan)
+    }
 
 @api_router.put("/tables/{table_id}", response_model=RestaurantTable)
 async def update_table(table_id: str, table_data: TableUpdate = Body(...)):
-    updated = await db.tables.find_one_and_update(
-        {"id": table_id},
-        {"$set": table_data.model_dump(exclude_unset=True)},
-        return_document=True
-    )
+    updated = await table_state.update_table(table_id, table_data.model_dump(exclude_unset=True))
     
     if updated is None:
         raise HTTPException(status_code=404, detail="Table not found")
@@ -2633,191 +2843,10 @@ async def update_table(table_id: str, table_data: TableUpdate = Body(...)):
 
 @api_router.delete("/tables/{table_id}")
 async def delete_table(table_id: str):
-    result = await db.tables.delete_one({"id": table_id})
-    if result.deleted_count == 0:
+    if not await table_state.remove_table(table_id):
         raise HTTPException(status_code=404, detail="Table not found")
     return {"message": "Table deleted successfully"}
 
-# ==================== CUSTOMER ENDPOINTS ====================
-# ================ CUSTOMER ENDPOINTS ================
-
-@api_router.post("/customers", response_model=Customer)
-async def create_customer(customer: CustomerCreate):
-    """Create a new customer"""
-    try:
-        # Check if phone already exists
-        existing = await db.customers.find_one({"phone": customer.phone})
-        if existing:
-            raise HTTPException(status_code=400, detail="Customer with this phone number already exists")
-        
-        customer_dict = customer.dict()
-        customer_dict["id"] = str(uuid.uuid4())
-        customer_dict["customer_id"] = f"CUST-{str(uuid.uuid4())[:8]}"
-        customer_dict["created_at"] = datetime.now(IST)
-        customer_dict["updated_at"] = datetime.now(IST)
-        customer_dict["order_history"] = {"total_orders": 0, "total_spent": 0.0, "average_order_value": 0.0, "last_order_date": None, "favorite_items": []}
-        customer_dict["loyalty_points"] = 0
-        customer_dict["status"] = "active"
-        
-        customer_dict = prepare_for_mongo(customer_dict)
-        result = await db.customers.insert_one(customer_dict)
-        
-        created_customer = await db.customers.find_one({"_id": result.inserted_id})
-        logger.info(f"Customer created: {customer.phone}")
-        
-        return Customer.parse_from_mongo(created_customer)
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Error creating customer: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-
-
-@api_router.get("/customers/search", response_model=List[Customer])
-async def search_customers(query: str):
-    """Search customers by name or phone"""
-    try:
-        if not query or len(query) < 2:
-            return []
-        
-        import re
-        regex_pattern = re.compile(query, re.IGNORECASE)
-        
-        customers_cursor = db.customers.find({
-            "$or": [
-                {"name": {"$regex": regex_pattern}},
-                {"phone": {"$regex": query}},
-                {"email": {"$regex": regex_pattern}}
-            ],
-            "status": "active"
-        }).limit(10)
-        
-        customers = []
-        async for customer in customers_cursor:
-            customers.append(Customer.parse_obj(customer))
-        
-        return customers
-    except Exception as e:
-        logger.error(f"Error searching customers: {e}")
-        return []
-
-
-@api_router.get("/customers/{customer_id}", response_model=Customer)
-async def get_customer(customer_id: str):
-    """Get customer by ID"""
-    try:
-        customer = await db.customers.find_one({"customer_id": customer_id})
-        if not customer:
-            raise HTTPException(status_code=404, detail="Customer not found")
-        return Customer.parse_obj(customer)
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Error getting customer: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-
-
-@api_router.get("/customers/{customer_id}/history")
-async def get_customer_history(customer_id: str):
-    """Get customer order history and spending statistics"""
-    try:
-        # Fetch customer info
-        customer = await db.customers.find_one({"customer_id": customer_id})
-        if not customer:
-            raise HTTPException(status_code=404, detail="Customer not found")
-        
-        # Fetch all orders for this customer
-        all_orders_cursor = db.orders.find({"customer_id": customer_id}).sort("created_at", -1)
-        all_orders = await all_orders_cursor.to_list(None)
-        
-        # Get recent orders (last 10)
-        recent_orders_cursor = db.orders.find({"customer_id": customer_id}).sort("created_at", -1).limit(10)
-        recent_orders_list = await recent_orders_cursor.to_list(10)
-        
-        # Calculate statistics
-        total_orders = len(all_orders)
-        total_spent = sum([order.get("final_amount", order.get("total_amount", 0)) for order in all_orders])
-        average_order_value = total_spent / total_orders if total_orders > 0 else 0
-        
-        # Format recent orders
-        formatted_recent_orders = [
-            {
-                "order_id": order.get("order_id"),
-                "created_at": order.get("created_at"),
-                "final_amount": order.get("final_amount", order.get("total_amount", 0)),
-                "status": order.get("status", "pending")
-            }
-            for order in recent_orders_list
-        ]
-        
-        logger.info(f"Customer history fetched: {customer_id}, Orders: {total_orders}, Spent: {total_spent}")
-        
-        return {
-            "customer": {
-                "customer_id": customer.get("customer_id"),
-                "name": customer.get("name"),
-                "phone": customer.get("phone"),
-                "email": customer.get("email")
-            },
-            "statistics": {
-                "total_orders": total_orders,
-                "total_spent": round(total_spent, 2),
-                "average_order_value": round(average_order_value, 2)
-            },
-            "recent_orders": formatted_recent_orders
-        }
-    
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Error fetching customer history: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error fetching customer history: {str(e)}")
-
-
-@api_router.put("/customers/{customer_id}", response_model=Customer)
-async def update_customer(customer_id: str, customer_update: CustomerUpdate):
-    """Update customer details"""
-    try:
-        update_data = {k: v for k, v in customer_update.dict().items() if v is not None}
-        if not update_data:
-            raise HTTPException(status_code=400, detail="No fields to update")
-        
-        update_data["updated_at"] = datetime.now(IST)
-        update_data = prepare_for_mongo(update_data)
-        
-        result = await db.customers.update_one(
-            {"customer_id": customer_id},
-            {"$set": update_data}
-        )
-        
-        if result.matched_count == 0:
-            raise HTTPException(status_code=404, detail="Customer not found")
-        
-        updated_customer = await db.customers.find_one({"customer_id": customer_id})
-        return Customer.parse_obj(updated_customer)
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Error updating customer: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-
-
-@api_router.get("/customers", response_model=List[Customer])
-async def get_all_customers(skip: int = 0, limit: int = 50, active_only: bool = True):
-    """Get all customers"""
-    try:
-        query = {"status": "active"} if active_only else {}
-        customers_cursor = db.customers.find(query).skip(skip).limit(limit)
-        customers = []
-        async for customer in customers_cursor:
-            customers.append(Customer.parse_obj(customer))
-        return customers
-    except Exception as e:
-        logger.error(f"Error getting customers: {e}")
-        return []
-
-
-
 # ==================== REPORT ENDPOINTS ====================
 @api_router.get("/report")
 async def get_daily_report(date: str):
@@ -3288,14 +3317,6 @@ async def list_printers():
         return {"printers": printers}
     except Exception as e:
         return {"error": str(e), "printers": []}
-# ==================== DIRECT PRINT ENDPOINT ====================
-@api_router.get("/health")
-async def api_health_check():
-    return {"status": "ok", "message": "API is running"}
-        
-@api_router.get("/health")
-async def health_check():
-    return {"status": "ok", "message": "API is running"}
 
 
 # ================================
@@ -3447,243 +3468,6 @@ def start_server():
         access_log=False
     )
 
-# ==================== CUSTOMER ENDPOINTS ====================
-# ==================== CUSTOMER ENDPOINTS ====================
-
-@api_router.post("/customers", response_model=Customer)
-async def create_customer(customer: CustomerCreate):
-    """Create a new customer"""
-    try:
-        # Check if phone already exists
-        existing = await db.customers.find_one({"phone": customer.phone})
-        if existing:
-            raise HTTPException(
-                status_code=400,
-                detail="Customer with this phone number already exists"
-            )
-        
-        customer_dict = customer.dict()
-        customer_dict["id"] = str(uuid.uuid4())
-        customer_dict["customer_id"] = f"CUST-{str(uuid.uuid4())[:8]}"
-        customer_dict["created_at"] = datetime.now(IST)
-        customer_dict["updated_at"] = datetime.now(IST)
-        customer_dict["order_history"] = {
-            "total_orders": 0,
-            "total_spent": 0.0,
-            "average_order_value": 0.0,
-            "last_order_date": None,
-            "favorite_items": []
-        }
-        customer_dict["loyalty_points"] = 0
-        customer_dict["status"] = "active"
-        
-        # Convert datetime objects for MongoDB
-        customer_dict = prepare_for_mongo(customer_dict)
-        
-        # Insert into database
-        result = await db.customers.insert_one(customer_dict)
-        
-        # Fetch the created customer
-        created_customer = await db.customers.find_one({"_id": result.inserted_id})
-        
-        # Parse and return
-        return Customer(**parse_from_mongo(created_customer))
-    
-    except HTTPException:
-        raise
-    except Exception as e:
-        print(f"Error creating customer: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-
-
-@api_router.get("/customers/search", response_model=List[Customer])
-async def search_customers(query: str):
-    """Search customers by name or phone"""
-    try:
-        if not query or len(query) < 2:
-            return []
-        
-        import re
-        regex_pattern = re.compile(query, re.IGNORECASE)
-        
-        customers_cursor = db.customers.find({
-            "$or": [
-                {"name": {"$regex": regex_pattern}},
-                {"phone": {"$regex": query}},
-                {"email": {"$regex": regex_pattern}}
-            ],
-            "status": "active"
-        }).limit(10)
-        
-        customers = []
-        async for customer in customers_cursor:
-            customers.append(Customer(**parse_from_mongo(customer)))
-        
-        return customers
-    
-    except Exception as e:
-        print(f"Error searching customers: {e}")
-        return []
-
-
-@api_router.get("/customers/{customer_id}", response_model=Customer)
-async def get_customer(customer_id: str):
-    """Get customer by ID"""
-    try:
-        customer = await db.customers.find_one({"customer_id": customer_id})
-        if not customer:
-            raise HTTPException(status_code=404, detail="Customer not found")
-        return Customer(**parse_from_mongo(customer))
-    
-    except HTTPException:
-        raise
-    except Exception as e:
-        print(f"Error getting customer: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-    
-
-
-
-@api_router.put("/customers/{customer_id}", response_model=Customer)
-async def update_customer(customer_id: str, customer_update: CustomerUpdate):
-    """Update customer details"""
-    try:
-        update_data = {k: v for k, v in customer_update.dict().items() if v is not None}
-        
-        if not update_data:
-            raise HTTPException(status_code=400, detail="No fields to update")
-        
-        update_data["updated_at"] = datetime.now(IST)
-        update_data = prepare_for_mongo(update_data)
-        
-        result = await db.customers.update_one(
-            {"customer_id": customer_id},
-            {"$set": update_data}
-        )
-        
-        if result.matched_count == 0:
-            raise HTTPException(status_code=404, detail="Customer not found")
-        
-        updated_customer = await db.customers.find_one({"customer_id": customer_id})
-        return Customer(**parse_from_mongo(updated_customer))
-    
-    except HTTPException:
-        raise
-    except Exception as e:
-        print(f"Error updating customer: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-
-
-@api_router.get("/customers", response_model=List[Customer])
-async def get_all_customers(skip: int = 0, limit: int = 50, active_only: bool = True):
-    """Get all customers"""
-    try:
-        query = {"status": "active"} if active_only else {}
-        customers_cursor = db.customers.find(query).skip(skip).limit(limit)
-        customers = []
-        async for customer in customers_cursor:
-            customers.append(Customer(**parse_from_mongo(customer)))
-        return customers
-    
-    except Exception as e:
-        print(f"Error getting customers: {e}")
-        return []
-
-
-# ==================== UPDATE ORDER CREATION ====================
-# Modify your existing create_order endpoint to handle new fields:
-# Find your @api_router.post("/orders") endpoint and update it to:
-
-@api_router.post("/orders-enhanced", response_model=Order)
-async def create_order_enhanced(order_data: OrderCreate):
-    """Enhanced order creation with customer and discount support"""
-    # Calculate subtotal
-    total_amount = sum(i.quantity * i.price for i in order_data.items)
-    
-    # Calculate discount
-    discount_amount = 0.0
-    discount_obj = None
-    
-    if hasattr(order_data, 'discount') and order_data.discount:
-        if order_data.discount.type == "percentage":
-            discount_amount = (total_amount * order_data.discount.value) / 100
-        elif order_data.discount.type == "fixed":
-            discount_amount = order_data.discount.value
-        
-        discount_amount = min(discount_amount, total_amount)
-        
-        discount_obj = {
-            "type": order_data.discount.type,
-            "value": order_data.discount.value,
-            "reason": order_data.discount.reason or "",
-            "amount": discount_amount
-        }
-    
-    # Calculate GST on (subtotal - discount)
-    taxable_amount = total_amount - discount_amount
-    gst_amount = 0.0
-    final_amount = taxable_amount
-    
-    if order_data.gst_applicable:
-        gst_amount = round(taxable_amount * 0.05, 2)
-        final_amount = round(taxable_amount + gst_amount, 2)
-    
-    # Create order
-    now_ist = datetime.now(IST)
-    order_dict = order_data.dict()
-    order_dict["id"] = str(uuid.uuid4())
-    order_dict["order_id"] = generate_order_id()
-    order_dict["total_amount"] = round(total_amount, 2)
-    order_dict["discount"] = discount_obj
-    order_dict["gst_amount"] = gst_amount
-    order_dict["final_amount"] = final_amount
-    order_dict["status"] = OrderStatus.PENDING.value
-    order_dict["payment_status"] = PaymentStatus.PENDING.value
-    order_dict["created_at"] = now_ist
-    order_dict["updated_at"] = now_ist
-    order_dict["estimated_completion"] = now_ist + timedelta(minutes=30)
-    order_dict["kot_generated"] = False
-    
-    order_dict = prepare_for_mongo(order_dict)
-    await db.orders.insert_one(order_dict)
-    
-    # Update customer order history if customer_id provided
-    if order_dict.get("customer_id"):
-        await update_customer_order_history(order_dict["customer_id"], final_amount)
-    
-    # Update table status if table_number provided
-    if order_dict.get("table_number"):
-        await db.tables.update_one(
-            {"table_number": order_dict["table_number"]},
-            {"$set": {"status": "occupied", "current_order_id": order_dict["id"]}}
-        )
-    
-    return Order(**parse_from_mongo(order_dict))
-
-async def update_customer_order_history(customer_id: str, order_total: float):
-    """Update customer's order history"""
-    customer = await db.customers.find_one({"customer_id": customer_id})
-    if customer:
-        order_history = customer.get("order_history", {})
-        total_orders = order_history.get("total_orders", 0) + 1
-        total_spent = order_history.get("total_spent", 0.0) + order_total
-        avg_order_value = total_spent / total_orders
-        
-        await db.customers.update_one(
-            {"customer_id": customer_id},
-            {
-                "$set": {
-                    "order_history.total_orders": total_orders,
-                    "order_history.total_spent": round(total_spent, 2),
-                    "order_history.average_order_value": round(avg_order_value, 2),
-                    "order_history.last_order_date": datetime.now(IST),
-                    "loyalty_points": customer.get("loyalty_points", 0) + int(order_total / 10),
-                    "updated_at": datetime.now(IST)
-                }
-            }
-        )
-
-
 # ==================== LOGIN/SIGNUP WINDOW (FILE-BASED USER CHECK) ====================
 if __name__ == "__main__":
     import argparse
@@ -3754,8 +3538,10 @@ if __name__ == "__main__":
         
         print("✅ Connected to MongoDB")
         
-        # Initialize payment routes with database
+        # Initialize payment and customer routes with database
         init_payment_routes(db)
+        init_customer_routes(db)
+        payments.init_legacy_payment_routes(db, manager.broadcast)
         
     except Exception as e:
         print(f"❌ MongoDB connection failed: {e}")
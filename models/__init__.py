@@ -8,6 +8,13 @@ from .soundbox_models import (
     PaymentMatchingSettings,
     SoundboxWebhookPayload,
 )
+from .customer_models import (
+    Address,
+    OrderHistory,
+    CustomerCreate,
+    CustomerUpdate,
+    Customer,
+)
 
 __all__ = [
     "SoundboxConfigModel",
@@ -16,4 +23,9 @@ __all__ = [
     "UnmatchedPaymentModel",
     "PaymentMatchingSettings",
     "SoundboxWebhookPayload",
+    "Address",
+    "OrderHistory",
+    "CustomerCreate",
+    "CustomerUpdate",
+    "Customer",
 ]
@@ -0,0 +1,52 @@
+"""Customer models for Taste Paradise"""
+
+from pydantic import BaseModel, Field
+from typing import Optional, List
+from datetime import datetime
+import uuid
+
+from services.mongo_format import IST
+
+
+class Address(BaseModel):
+    type: str = "home"  # home, work, other
+    line1: str
+    line2: Optional[str] = ""
+    landmark: Optional[str] = ""
+    city: str
+    pincode: str
+    is_default: bool = True
+
+class OrderHistory(BaseModel):
+    total_orders: int = 0
+    paid_orders: int = 0
+    total_spent: float = 0.0
+    average_order_value: float = 0.0
+    last_order_date: Optional[datetime] = None
+    favorite_items: List[str] = []
+
+class CustomerCreate(BaseModel):
+    name: str
+    phone: str
+    email: Optional[str] = ""
+    addresses: List[Address] = []
+
+class CustomerUpdate(BaseModel):
+    name: Optional[str] = None
+    phone: Optional[str] = None
+    email: Optional[str] = None
+    addresses: Optional[List[Address]] = None
+    status: Optional[str] = None
+
+class Customer(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    customer_id: str
+    name: str
+    phone: str
+    email: Optional[str] = ""
+    addresses: List[Address] = []
+    order_history: OrderHistory = OrderHistory()
+    loyalty_points: int = 0
+    status: str = "active"  # active, inactive
+    created_at: datetime = Field(default_factory=lambda: datetime.now(IST))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(IST))
@@ -0,0 +1,394 @@
+# routes/customers.py
+"""
+Customer endpoints - CRUD, type-ahead search, profile history, favorites
+
+Search runs on the in-memory tries of services/customer_search.py (Mongo
+prefix queries until they are loaded); lifetime stats and item counters are
+maintained incrementally by services/customer_stats.py.
+"""
+
+from fastapi import APIRouter, HTTPException, Body
+from typing import Any, Dict, List, Optional
+from datetime import datetime
+import logging
+import uuid
+
+from models.customer_models import Customer, CustomerCreate, CustomerUpdate
+from services.customer_search import customer_search, search_fields, normalize_phone, prefix_query
+from services.customer_stats import customer_stats, with_average
+from services.loyalty import loyalty
+from services.menu_cache import menu_cache
+from services.mongo_format import IST, prepare_for_mongo, parse_from_mongo
+from services.pagination import SortKey, InvalidCursor, decode_cursor, keyset_filter, split_page
+
+logger = logging.getLogger(__name__)
+router = APIRouter(prefix="/api", tags=["customers"])
+
+# This will be injected from main.py
+db = None
+
+LIST_SORTS = {
+    "created": SortKey("created_at", descending=True),
+    "name": SortKey("name"),
+    "spend": SortKey("order_history.total_spent", descending=True),
+    "last_visit": SortKey("order_history.last_order_date", descending=True)
+}
+LIST_PROJECTION = {
+    "_id": 1, "id": 1, "customer_id": 1, "name": 1, "phone": 1, "email": 1, "status": 1, "loyalty_points": 1,
+    "order_history.total_orders": 1, "order_history.total_spent": 1, "order_history.last_order_date": 1,
+    "created_at": 1
+}
+
+def init_customer_routes(database):
+    """Initialize routes with database connection"""
+    global db
+    db = database
+
+
+async def create_list_indexes(database):
+    """Per list sort: (status, sort field, _id) for active_only, (sort field, _id) for the full list"""
+    for sort_key in LIST_SORTS.values():
+        direction = -1 if sort_key.descending else 1
+        await database.customers.create_index([("status", 1), (sort_key.field, direction), ("_id", direction)])
+        await database.customers.create_index([(sort_key.field, direction), ("_id", direction)])
+
+
+@router.post("/customers", response_model=Customer)
+async def create_customer(customer: CustomerCreate):
+    """Create a new customer"""
+    try:
+        # Check if phone already exists ("+91 98765 43210" and "9876543210" are the same number)
+        existing = await db.customers.find_one({
+            "$or": [{"phone": customer.phone}, {"phone_digits": normalize_phone(customer.phone)}]
+        })
+        if existing:
+            raise HTTPException(status_code=400, detail="Customer with this phone number already exists")
+        
+        customer_dict = customer.dict()
+        customer_dict["id"] = str(uuid.uuid4())
+        customer_dict["customer_id"] = f"CUST-{str(uuid.uuid4())[:8]}"
+        customer_dict["created_at"] = datetime.now(IST)
+        customer_dict["updated_at"] = datetime.now(IST)
+        customer_dict["order_history"] = {"total_orders": 0, "total_spent": 0.0, "average_order_value": 0.0, "last_order_date": None, "favorite_items": []}
+        customer_dict["loyalty_points"] = 0
+        customer_dict["status"] = "active"
+        customer_dict.update(search_fields(customer_dict))
+        
+        customer_dict = prepare_for_mongo(customer_dict)
+        result = await db.customers.insert_one(customer_dict)
+        
+        created_customer = await db.customers.find_one({"_id": result.inserted_id})
+        customer_search.upsert(created_customer)
+        logger.info(f"Customer created: {customer.phone}")
+        
+        return Customer(**parse_from_mongo(with_average(created_customer)))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error creating customer: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/customers/search", response_model=List[Customer])
+async def search_customers(query: str, limit: int = 10, ranked: bool = False):
+    """
+    Search customers by phone, name or email prefix (type-ahead).
+    ranked=true runs a relevance-ranked text search on name/email instead.
+    """
+    try:
+        if not query or len(query.strip()) < 2:
+            return []
+        limit = min(max(limit, 1), 50)
+        
+        if ranked:
+            customers_cursor = db.customers.find(
+                {"$text": {"$search": query}, "status": "active"},
+                {"score": {"$meta": "textScore"}}
+            ).sort([("score", {"$meta": "textScore"})]).limit(limit)
+        elif customer_search.loaded:
+            # In-memory tries pick the ids, one indexed $in fetches the documents
+            ids = customer_search.search(query, limit)
+            if not ids:
+                return []
+            found = {c["customer_id"]: c async for c in db.customers.find({"customer_id": {"$in": ids}})}
+            return [Customer(**parse_from_mongo(with_average(found[i]))) for i in ids if i in found]
+        else:
+            # Index still warming up - same prefix search on the indexed fields
+            customers_cursor = db.customers.find({**prefix_query(query), "status": "active"}).limit(limit)
+        
+        customers = []
+        async for customer in customers_cursor:
+            customer.pop("score", None)
+            customers.append(Customer(**parse_from_mongo(with_average(customer))))
+        
+        return customers
+    except Exception as e:
+        logger.error(f"Error searching customers: {e}")
+        return []
+
+
+@router.get("/customers/{customer_id}", response_model=Customer)
+async def get_customer(customer_id: str):
+    """Get customer by ID"""
+    try:
+        customer = await db.customers.find_one({"customer_id": customer_id})
+        if not customer:
+            raise HTTPException(status_code=404, detail="Customer not found")
+        return Customer(**parse_from_mongo(with_average(customer)))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting customer: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/customers/{customer_id}/history")
+async def get_customer_history(customer_id: str):
+    """Get customer order history and spending statistics"""
+    try:
+        # Fetch customer info
+        customer = await db.customers.find_one({"customer_id": customer_id})
+        if not customer:
+            raise HTTPException(status_code=404, detail="Customer not found")
+        
+        customer = with_average(customer)
+        stats = customer["order_history"]
+
+        # Only the latest orders - totals come from the incrementally maintained order_history
+        recent_orders_list = await db.orders.find(
+            {"customer_id": customer_id},
+            {"_id": 0, "order_id": 1, "created_at": 1, "final_amount": 1, "total_amount": 1, "status": 1}
+        ).sort("created_at", -1).limit(10).to_list(10)
+        
+        # Format recent orders
+        formatted_recent_orders = [
+            {
+                "order_id": order.get("order_id"),
+                "created_at": order.get("created_at"),
+                "final_amount": order.get("final_amount", order.get("total_amount", 0)),
+                "status": order.get("status", "pending")
+            }
+            for order in recent_orders_list
+        ]
+        
+        logger.info(f"Customer history fetched: {customer_id}, Orders: {stats.get('total_orders', 0)}, Spent: {stats['total_spent']}")
+        
+        return {
+            "customer": {
+                "customer_id": customer.get("customer_id"),
+                "name": customer.get("name"),
+                "phone": customer.get("phone"),
+                "email": customer.get("email")
+            },
+            "statistics": {
+                "total_orders": stats.get("total_orders", 0),
+                "paid_orders": stats.get("paid_orders", 0),
+                "total_spent": stats["total_spent"],
+                "average_order_value": stats["average_order_value"],
+                "last_order_date": stats.get("last_order_date")
+            },
+            "recent_orders": formatted_recent_orders
+        }
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error fetching customer history: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error fetching customer history: {str(e)}")
+
+
+async def with_menu_details(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Attach current price / availability from the menu cache to customer item counters"""
+    menu = {item.get("id"): item for item in await menu_cache.items()}
+    for item in items:
+        menu_item = menu.get(item["menu_item_id"])
+        item["price"] = float(menu_item.get("price") or 0) if menu_item else None
+        item["is_available"] = bool(menu_item and menu_item.get("is_available", True))
+    return items
+
+
+@router.get("/customers/{customer_id}/favorites")
+async def get_customer_favorites(customer_id: str, limit: int = 10):
+    """Top-N dishes of a customer from the precomputed item counters"""
+    try:
+        limit = min(max(limit, 1), 50)
+        favorites = await customer_stats.favorites(customer_id, limit)
+        return {"customer_id": customer_id, "favorites": await with_menu_details(favorites)}
+    except Exception as e:
+        logger.error(f"Error fetching customer favorites: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error fetching customer favorites: {str(e)}")
+
+
+@router.get("/customers/{customer_id}/usual-order")
+async def get_customer_usual_order(customer_id: str):
+    """Dishes the customer orders most times, with typical quantities - ready to re-ring in one tap"""
+    try:
+        customer = await db.customers.find_one(
+            {"customer_id": customer_id}, {"_id": 0, "order_history.total_orders": 1}
+        )
+        if not customer:
+            raise HTTPException(status_code=404, detail="Customer not found")
+        total_orders = (customer.get("order_history") or {}).get("total_orders", 0)
+        items = await with_menu_details(await customer_stats.usual_order(customer_id, total_orders))
+        return {
+            "customer_id": customer_id,
+            "total_orders": total_orders,
+            "items": items,
+            "estimated_total": round(sum(
+                (item["price"] or 0) * item["typical_quantity"] for item in items if item["is_available"]
+            ), 2)
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error fetching usual order: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error fetching usual order: {str(e)}")
+
+
+@router.post("/customers/stats/rebuild")
+async def rebuild_customer_stats(customer_id: Optional[str] = None):
+    """Recompute order_history counters and item counters from the orders collection (all customers or one)"""
+    try:
+        rebuilt = await customer_stats.rebuild(customer_id)
+        await customer_stats.rebuild_items(customer_id)
+        return {"success": True, "customers_rebuilt": rebuilt}
+    except Exception as e:
+        logger.error(f"Error rebuilding customer stats: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error rebuilding customer stats: {str(e)}")
+
+
+@router.get("/customers/{customer_id}/loyalty")
+async def get_customer_loyalty(customer_id: str, limit: int = 50):
+    """Points balance and the latest ledger entries"""
+    try:
+        customer = await db.customers.find_one(
+            {"customer_id": customer_id}, {"_id": 0, "customer_id": 1, "loyalty_points": 1}
+        )
+        if not customer:
+            raise HTTPException(status_code=404, detail="Customer not found")
+        return {
+            "customer_id": customer_id,
+            "balance": customer.get("loyalty_points", 0),
+            "entries": await loyalty.history(customer_id, min(max(limit, 1), 200))
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error fetching loyalty ledger: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error fetching loyalty ledger: {str(e)}")
+
+
+@router.post("/customers/{customer_id}/loyalty/adjust")
+async def adjust_customer_loyalty(customer_id: str, adjustment: Dict[str, Any] = Body(...)):
+    """Manual points correction - recorded in the ledger like any other change"""
+    try:
+        points = int(adjustment.get("points", 0))
+        reason = (adjustment.get("reason") or "").strip()
+        if points == 0 or not reason:
+            raise HTTPException(status_code=400, detail="points (non-zero) and reason are required")
+        if not await db.customers.count_documents({"customer_id": customer_id}, limit=1):
+            raise HTTPException(status_code=404, detail="Customer not found")
+        entry = await loyalty.adjust(customer_id, points, reason)
+        return {"success": True, "entry": entry}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error adjusting loyalty points: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error adjusting loyalty points: {str(e)}")
+
+
+@router.post("/customers/loyalty/reconcile")
+async def reconcile_loyalty():
+    """Run the nightly balance check now"""
+    try:
+        corrected = await loyalty.reconcile()
+        return {"success": True, "balances_corrected": corrected}
+    except Exception as e:
+        logger.error(f"Error reconciling loyalty balances: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error reconciling loyalty balances: {str(e)}")
+
+
+@router.put("/customers/{customer_id}", response_model=Customer)
+async def update_customer(customer_id: str, customer_update: CustomerUpdate):
+    """Update customer details"""
+    try:
+        update_data = {k: v for k, v in customer_update.dict().items() if v is not None}
+        if not update_data:
+            raise HTTPException(status_code=400, detail="No fields to update")
+        
+        # Keep the normalized search fields in step with what changed
+        fields = search_fields(update_data)
+        if "phone" in update_data:
+            update_data["phone_digits"] = fields["phone_digits"]
+        if "name" in update_data:
+            update_data["name_tokens"] = fields["name_tokens"]
+        if "email" in update_data:
+            update_data["email_lower"] = fields["email_lower"]
+        
+        update_data["updated_at"] = datetime.now(IST)
+        update_data = prepare_for_mongo(update_data)
+        
+        updated_customer = await db.customers.find_one_and_update(
+            {"customer_id": customer_id},
+            {"$set": update_data},
+            return_document=True
+        )
+        
+        if updated_customer is None:
+            raise HTTPException(status_code=404, detail="Customer not found")
+        
+        customer_search.upsert(updated_customer)
+        return Customer(**parse_from_mongo(with_average(updated_customer)))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error updating customer: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/customers")
+async def get_all_customers(
+    cursor: Optional[str] = None,
+    limit: int = 50,
+    sort: str = "created",
+    active_only: bool = True
+):
+    """
+    Customer list, one keyset page at a time.
+    sort: created (newest first), name, spend (highest first) or last_visit (most recent first).
+    Pass next_cursor back as `cursor` for the following page.
+    active_only=false lists every customer, whatever (or whether any) status is stored.
+    total_estimate is the collection-wide count from the collection metadata -
+    it counts every customer, not only the ones this filter lists.
+    """
+    try:
+        sort_key = LIST_SORTS.get(sort)
+        if sort_key is None:
+            raise HTTPException(status_code=400, detail=f"sort must be one of: {', '.join(LIST_SORTS)}")
+        limit = min(max(limit, 1), 200)
+        try:
+            position = decode_cursor(cursor, sort_key)
+        except InvalidCursor as e:
+            raise HTTPException(status_code=400, detail=f"Invalid cursor: {e}")
+        
+        query = {"status": "active"} if active_only else {}
+        query.update(keyset_filter(sort_key, position))
+        rows = await db.customers.find(query, LIST_PROJECTION).sort(
+            sort_key.mongo_sort()
+        ).limit(limit + 1).to_list(limit + 1)
+        page, next_cursor = split_page(rows, sort_key, limit)
+        
+        customers = []
+        for row in page:
+            row.pop("_id", None)
+            customers.append(parse_from_mongo(row))
+        return {
+            "customers": customers,
+            "next_cursor": next_cursor,
+            "total_estimate": await db.customers.estimated_document_count()
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting customers: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
@@ -20,16 +20,26 @@ from fastapi.responses import Response
 import pandas as pd
 from io import BytesIO
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 from datetime import datetime, timezone
 from typing import List, Optional, Dict, Any
 import logging
 import uuid
 
+from services.menu_cache import menu_cache
+from services.inventory_snapshot import InventorySnapshot
+from services.consumption import ConsumptionAnalytics, HISTORY_DAYS
+from services.procurement import procurement, PurchaseOrderError
+from services.menu_availability import menu_availability
+
 logger = logging.getLogger(__name__)
 
 # This will be injected from main.py
 db = None
 
+# Compare-and-set attempts per ingredient when concurrent deductions race
+STOCK_WRITE_RETRIES = 5
+
 router = APIRouter(prefix="/inventory", tags=["inventory"])
 
 def set_db(database):
@@ -132,6 +142,67 @@ def format_quantity_smart(quantity: float, unit: str) -> str:
     else:
         return f"{quantity} {unit}"
 
+def format_item(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Inventory item as the API returns it"""
+    current_stock = item.get("current_stock", 0)
+    return {
+        "id": str(item["_id"]),
+        "name": item.get("name"),
+        "category": item.get("category"),
+        "unit": item.get("unit"),
+        "current_stock": round(current_stock, 2),
+        "current_stock_display": format_quantity_smart(current_stock, item.get("unit") or ""),
+        "reorder_level": round(item.get("reorder_level", 0), 2),
+        "unit_cost": item.get("unit_cost", 0),
+        "supplier": item.get("supplier"),
+        "supplier_contact": item.get("supplier_contact"),
+        "pack_size": item.get("pack_size"),
+        "min_order_qty": item.get("min_order_qty"),
+        "status": item.get("status", "active"),
+        "inventory_value": round(current_stock * item.get("unit_cost", 0), 2),
+        "last_updated": item.get("last_updated"),
+        "created_at": item.get("created_at")
+    }
+
+# Item table kept in memory for the read endpoints (Mongo answers until it is loaded)
+snapshot = InventorySnapshot(format_item)
+
+
+async def load_snapshot():
+    try:
+        await snapshot.load(db)
+    except Exception as e:
+        logger.error(f"❌ Inventory snapshot not loaded - reads stay on Mongo: {e}")
+
+
+async def refresh_availability(stock: Dict[str, float], units: Optional[Dict[str, str]] = None):
+    """Re-check the dishes that use these ingredients; never fails the stock write itself"""
+    try:
+        await menu_availability.on_stock_change(stock, units)
+    except Exception as e:
+        logger.error(f"❌ Menu availability update failed: {e}")
+
+
+async def after_deduction(result: Optional[Dict[str, Any]]):
+    """Bring the snapshot and dish availability up to date once a deduction's writes are durable"""
+    if result and result.get("stock_updates"):
+        snapshot.apply_stock_updates(result["stock_updates"], last_updated=datetime.now(timezone.utc))
+        await refresh_availability(result["stock_updates"])
+
+def base_factor(unit: str) -> float:
+    """Base units per storage unit (kg → 1000 gm)"""
+    return normalize_to_base_unit(1, unit)[0] if unit else 1.0
+
+# Daily usage rollup + stock-out forecasts, refreshed nightly
+consumption = ConsumptionAnalytics(base_factor)
+
+
+async def refresh_consumption():
+    try:
+        await consumption.refresh()
+    except Exception as e:
+        logger.error(f"❌ Consumption forecast refresh failed: {e}")
+
 # ==================== INITIALIZE COLLECTIONS ====================
 async def initialize_collections():
     """Initialize inventory collections if they don't exist"""
@@ -154,6 +225,15 @@ async def initialize_collections():
             await db.create_collection('stock_transactions')
             logger.info("✅ Created stock_transactions collection")
 
+        # Order deductions look up what was already applied for an order (idempotent replays)
+        await db.stock_transactions.create_index([("order_id", 1), ("deduction_key", 1)])
+        # One deduction per key - the guard that makes replays and concurrent runs safe
+        await db.stock_transactions.create_index(
+            "deduction_key", unique=True, partialFilterExpression={"deduction_key": {"$exists": True}}
+        )
+        await consumption.init(db)
+        await procurement.init(db)
+
         logger.info("✅ Inventory collections initialized")
 
     except Exception as e:
@@ -221,6 +301,8 @@ async def import_inventory_items(file: UploadFile = File(...)):
 
     Excel Format Expected:
     | name | category | unit | current_stock | reorder_level | unit_cost | supplier | supplier_contact |
+
+    Optional purchasing columns: pack_size, min_order_qty (in the item's unit)
     """
     try:
         # Validate file type
@@ -246,6 +328,8 @@ async def import_inventory_items(file: UploadFile = File(...)):
 
         imported_count = 0
         updated_count = 0
+        stock_levels = {}
+        units = {}
 
         for idx, row in df.iterrows():
             try:
@@ -264,6 +348,9 @@ async def import_inventory_items(file: UploadFile = File(...)):
                     "status": "active",
                     "last_updated": datetime.now(timezone.utc)
                 }
+                for column in ('pack_size', 'min_order_qty'):
+                    if column in df.columns and not pd.isna(row[column]):
+                        item_data[column] = round(float(row[column]), 2)
 
                 # Check if item exists
                 existing = await db.inventory_items.find_one(
@@ -276,17 +363,23 @@ async def import_inventory_items(file: UploadFile = File(...)):
                         {"_id": existing["_id"]},
                         {"$set": item_data}
                     )
+                    snapshot.upsert({**existing, **item_data})
+                    stock_levels[str(existing["_id"])] = item_data["current_stock"]
+                    units[str(existing["_id"])] = item_data["unit"]
                     updated_count += 1
                 else:
                     # Insert new
                     item_data["created_at"] = datetime.now(timezone.utc)
                     await db.inventory_items.insert_one(item_data)
+                    snapshot.upsert(item_data)
                     imported_count += 1
 
             except Exception as e:
                 logger.error(f"Error processing row {idx+2}: {e}")
                 continue
 
+        await refresh_availability(stock_levels, units)
+
         return {
             "message": "Inventory items imported successfully",
             "imported": imported_count,
@@ -450,6 +543,10 @@ async def import_menu_with_ingredients(file: UploadFile = File(...)):
                 logger.error(f"Error processing row {idx+2}: {str(e)}")
                 errors.append(f"Row {idx+2}: {str(e)}")
 
+        if imported_items or updated_items:
+            menu_cache.invalidate("menu imported with ingredients")
+            await menu_availability.reload_menu()
+
         return {
             "message": "Menu items imported successfully",
             "imported_count": len(imported_items),
@@ -467,11 +564,44 @@ async def import_menu_with_ingredients(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=f"Failed to import menu: {str(e)}")
 
 # ==================== AUTO-DEDUCT INVENTORY (SMART CONVERSION + ROUNDING) ====================
-@router.post("/deduct-for-order")
-async def deduct_inventory_for_order(order_data: Dict = Body(...)):
+async def finish_pending_deduction(txn: Dict[str, Any], session=None) -> Optional[float]:
+    """
+    A deduction logged but interrupted before it was marked applied: write
+    its stock level if the item still holds the level it was computed from,
+    otherwise it already went through. Returns the item's stock afterwards.
+    """
+    result = await db.inventory_items.update_one(
+        {"_id": ObjectId(txn["item_id"]), "current_stock": txn["previous_stock"]},
+        {"$set": {"current_stock": txn["new_stock"], "last_updated": datetime.now(timezone.utc)}},
+        session=session
+    )
+    new_stock = txn["new_stock"]
+    if not result.matched_count:
+        item = await db.inventory_items.find_one({"_id": ObjectId(txn["item_id"])}, {"current_stock": 1}, session=session)
+        new_stock = item.get("current_stock") if item else None
+        if new_stock != txn["new_stock"]:
+            logger.warning(
+                f"⚠️ Pending deduction {txn['deduction_key']}: stock moved since, treating it as applied"
+            )
+    await db.stock_transactions.update_one(
+        {"_id": txn["_id"]}, {"$set": {"applied": True}}, session=session
+    )
+    logger.info(f"🔁 Finished interrupted deduction {txn['deduction_key']}")
+    return new_stock
+
+async def deduct_for_order(order_id: str, order_items: List[Dict[str, Any]], session=None) -> Dict[str, Any]:
     """
     Auto-deduct inventory with SMART unit conversion and proper rounding
 
+    Called in-process by order placement (inside its Mongo transaction when
+    `session` is given) and by the /deduct-for-order endpoint. Safe to repeat
+    for the same order: each ingredient deduction is first logged as a
+    pending stock_transaction under a unique deduction_key, then the stock is
+    written (compare-and-set on the level read), then the entry is marked
+    applied. Keys already logged are skipped, and entries left pending by a
+    crash are finished by finish_pending_deduction(), so an outbox replay
+    never deducts twice.
+
     ✅ LOGIC:
     1. Convert inventory to BASE UNIT (kg→gm, ltr→ml)
     2. Compare and deduct in BASE UNIT (clean integers!)
@@ -485,52 +615,70 @@ async def deduct_inventory_for_order(order_data: Dict = Body(...)):
     - Store: 700 gm = 0.7 kg (rounded)
     - Display: "700 gm" (clearer than 0.7 kg)
     """
-    try:
-        order_id = order_data.get('order_id')
-        order_items = order_data.get('items', [])
-
-        if not order_id or not order_items:
-            raise HTTPException(status_code=400, detail="Missing order_id or items")
-
-        deducted_items = []
-        failed_items = []
-        transactions = []
-
-        for order_item in order_items:
-            menu_item_id = order_item.get('menuitemid')
-            menu_item_name = order_item.get('menuitemname', 'Unknown')
-            order_quantity = int(order_item.get('quantity', 1))
-
-            # Get menu item with ingredients
-            menu_item = await db.menu_items.find_one({"id": menu_item_id})
-
-            # Try with _id if not found by id
-            if not menu_item:
-                try:
-                    menu_item = await db.menu_items.find_one({"_id": ObjectId(menu_item_id)})
-                except:
-                    pass
-
-            if not menu_item or not menu_item.get('ingredients'):
-                logger.warning(f"No ingredients found for {menu_item_name}")
+    deducted_items = []
+    failed_items = []
+    transactions = []
+    stock_updates = {}
+
+    already_applied = set()
+    async for txn in db.stock_transactions.find(
+        {"order_id": order_id, "deduction_key": {"$exists": True}},
+        {"deduction_key": 1, "applied": 1, "item_id": 1, "previous_stock": 1, "new_stock": 1},
+        session=session
+    ):
+        if txn.get("applied") is False:
+            new_stock = await finish_pending_deduction(txn, session=session)
+            if new_stock is not None:
+                stock_updates[txn["item_id"]] = new_stock
+        already_applied.add(txn["deduction_key"])
+
+    for line_index, order_item in enumerate(order_items):
+        menu_item_id = order_item.get('menuitemid')
+        menu_item_name = order_item.get('menuitemname', 'Unknown')
+        order_quantity = int(order_item.get('quantity', 1))
+
+        # Get menu item with ingredients
+        menu_item = await db.menu_items.find_one({"id": menu_item_id}, session=session)
+
+        # Try with _id if not found by id
+        if not menu_item:
+            try:
+                menu_item = await db.menu_items.find_one({"_id": ObjectId(menu_item_id)}, session=session)
+            except:
+                pass
+
+        if not menu_item or not menu_item.get('ingredients'):
+            logger.warning(f"No ingredients found for {menu_item_name}")
+            continue
+
+        # Deduct each ingredient
+        for ingredient in menu_item['ingredients']:
+            ingredient_id = ingredient.get('ingredient_id')
+            ingredient_name = ingredient.get('ingredient_name')
+            required_quantity = ingredient.get('quantity', 0) * order_quantity
+            recipe_unit = ingredient.get('unit')
+            deduction_key = f"{order_id}:{line_index}:{ingredient_id}"
+
+            if deduction_key in already_applied:
+                logger.info(f"⏭️ {ingredient_name} already deducted for order {order_id}")
                 continue
 
-            # Deduct each ingredient
-            for ingredient in menu_item['ingredients']:
-                ingredient_id = ingredient.get('ingredient_id')
-                ingredient_name = ingredient.get('ingredient_name')
-                required_quantity = ingredient.get('quantity', 0) * order_quantity
-                recipe_unit = ingredient.get('unit')
-
+            # The keyed transaction is logged (pending) before the stock write,
+            # and the stock write is a compare-and-set against the level read;
+            # if another deduction moved the level in between, read again
+            failure = None
+            logged = False
+            deducted = False
+            for attempt in range(STOCK_WRITE_RETRIES):
                 # Get inventory item
                 try:
-                    inv_item = await db.inventory_items.find_one({"_id": ObjectId(ingredient_id)})
+                    inv_item = await db.inventory_items.find_one({"_id": ObjectId(ingredient_id)}, session=session)
                 except:
                     inv_item = None
 
                 if not inv_item:
-                    failed_items.append(f"{ingredient_name}: Not found in inventory")
-                    continue
+                    failure = f"{ingredient_name}: Not found in inventory"
+                    break
 
                 current_stock = inv_item.get('current_stock', 0)
                 inventory_unit = inv_item.get('unit')
@@ -543,10 +691,8 @@ async def deduct_inventory_for_order(order_data: Dict = Body(...)):
 
                 # ✅ STEP 3: Check units match
                 if base_unit != required_base_unit:
-                    failed_items.append(
-                        f"{ingredient_name}: Unit mismatch (inventory: {base_unit}, recipe: {required_base_unit})"
-                    )
-                    continue
+                    failure = f"{ingredient_name}: Unit mismatch (inventory: {base_unit}, recipe: {required_base_unit})"
+                    break
 
                 logger.info(
                     f"🔄 Conversion: Inventory {current_stock} {inventory_unit} = {stock_in_base} {base_unit}, "
@@ -555,12 +701,12 @@ async def deduct_inventory_for_order(order_data: Dict = Body(...)):
 
                 # ✅ STEP 4: Check sufficient stock (comparing in BASE UNIT - clean!)
                 if stock_in_base < required_in_base:
-                    failed_items.append(
+                    failure = (
                         f"{ingredient_name}: Insufficient stock "
                         f"(need {required_in_base} {base_unit}, "
                         f"have {stock_in_base} {base_unit})"
                     )
-                    continue
+                    break
 
                 # ✅ STEP 5: Deduct in BASE UNIT (clean calculation!)
                 new_stock_in_base = round(stock_in_base - required_in_base, 2)
@@ -568,30 +714,8 @@ async def deduct_inventory_for_order(order_data: Dict = Body(...)):
                 # ✅ STEP 6: Convert back to ORIGINAL UNIT for storage (with rounding)
                 new_stock_in_original = convert_from_base_unit(new_stock_in_base, base_unit, inventory_unit)
 
-                # ✅ STEP 7: Smart display format
-                display_deducted = format_quantity_smart(
-                    convert_from_base_unit(required_in_base, base_unit, inventory_unit), 
-                    inventory_unit
-                )
-                display_remaining = format_quantity_smart(new_stock_in_original, inventory_unit)
-
-                logger.info(
-                    f"✅ Deduction: {stock_in_base} - {required_in_base} = {new_stock_in_base} {base_unit} "
-                    f"= {new_stock_in_original} {inventory_unit} ({display_remaining})"
-                )
-
-                # Update database
-                await db.inventory_items.update_one(
-                    {"_id": ObjectId(ingredient_id)},
-                    {
-                        "$set": {
-                            "current_stock": new_stock_in_original,
-                            "last_updated": datetime.now(timezone.utc)
-                        }
-                    }
-                )
-
-                # Log transaction
+                # ✅ STEP 7: Log the keyed transaction first - after a crash the
+                # replay finishes it (see finish_pending_deduction) instead of deducting again
                 transaction = {
                     "item_id": ingredient_id,
                     "item_name": ingredient_name,
@@ -602,41 +726,120 @@ async def deduct_inventory_for_order(order_data: Dict = Body(...)):
                     "new_stock": new_stock_in_original,
                     "storage_unit": inventory_unit,
                     "order_id": order_id,
+                    "deduction_key": deduction_key,
+                    "applied": False,
                     "menu_item": menu_item_name,
                     "recipe_quantity": required_quantity,
                     "recipe_unit": recipe_unit,
                     "transaction_date": datetime.now(timezone.utc),
                     "created_by": "system"
                 }
+                if not logged:
+                    try:
+                        await db.stock_transactions.insert_one(transaction, session=session)
+                    except DuplicateKeyError:
+                        # A concurrent run of this deduction owns the key
+                        logger.info(f"⏭️ {ingredient_name} already being deducted for order {order_id}")
+                        break
+                    logged = True
+                else:
+                    await db.stock_transactions.update_one(
+                        {"deduction_key": deduction_key},
+                        {"$set": {"previous_stock": current_stock, "new_stock": new_stock_in_original}},
+                        session=session
+                    )
 
-                await db.stock_transactions.insert_one(transaction)
-                transactions.append(transaction)
+                # ✅ STEP 8: Update stock only if it still holds the level read above
+                result = await db.inventory_items.update_one(
+                    {"_id": ObjectId(ingredient_id), "current_stock": current_stock},
+                    {
+                        "$set": {
+                            "current_stock": new_stock_in_original,
+                            "last_updated": datetime.now(timezone.utc)
+                        }
+                    },
+                    session=session
+                )
+                if result.matched_count:
+                    deducted = True
+                    break
+            else:
+                failure = f"{ingredient_name}: Stock changed during deduction, not deducted"
 
-                deducted_items.append({
-                    "ingredient": ingredient_name,
-                    "deducted": required_in_base,
-                    "deducted_unit": base_unit,
-                    "deducted_display": display_deducted,
-                    "remaining": new_stock_in_original,
-                    "remaining_unit": inventory_unit,
-                    "remaining_display": display_remaining,
-                    "recipe_requested": f"{required_quantity} {recipe_unit}"
-                })
+            if not deducted:
+                if logged:
+                    # Never applied - the pending entry must not be replayed
+                    await db.stock_transactions.delete_one(
+                        {"deduction_key": deduction_key, "applied": False}, session=session
+                    )
+                if failure:
+                    failed_items.append(failure)
+                continue
 
-                logger.info(
-                    f"✅ Successfully deducted {display_deducted} "
-                    f"of {ingredient_name} for order {order_id}. Remaining: {display_remaining}"
-                )
+            await db.stock_transactions.update_one(
+                {"deduction_key": deduction_key}, {"$set": {"applied": True}}, session=session
+            )
+            transaction["applied"] = True
 
-        return {
-            "message": "Inventory deduction completed",
-            "order_id": order_id,
-            "deducted_items": deducted_items,
-            "failed_items": failed_items,
-            "transactions_logged": len(transactions),
-            "status": "success" if not failed_items else "partial_success"
-        }
+            # Smart display format
+            display_deducted = format_quantity_smart(
+                convert_from_base_unit(required_in_base, base_unit, inventory_unit),
+                inventory_unit
+            )
+            display_remaining = format_quantity_smart(new_stock_in_original, inventory_unit)
 
+            logger.info(
+                f"✅ Deduction: {stock_in_base} - {required_in_base} = {new_stock_in_base} {base_unit} "
+                f"= {new_stock_in_original} {inventory_unit} ({display_remaining})"
+            )
+
+            transactions.append(transaction)
+            stock_updates[ingredient_id] = new_stock_in_original
+
+            deducted_items.append({
+                "ingredient": ingredient_name,
+                "deducted": required_in_base,
+                "deducted_unit": base_unit,
+                "deducted_display": display_deducted,
+                "remaining": new_stock_in_original,
+                "remaining_unit": inventory_unit,
+                "remaining_display": display_remaining,
+                "recipe_requested": f"{required_quantity} {recipe_unit}"
+            })
+
+            logger.info(
+                f"✅ Successfully deducted {display_deducted} "
+                f"of {ingredient_name} for order {order_id}. Remaining: {display_remaining}"
+            )
+
+    return {
+        "message": "Inventory deduction completed",
+        "order_id": order_id,
+        "deducted_items": deducted_items,
+        "failed_items": failed_items,
+        "transactions_logged": len(transactions),
+        # item_id → new stock, for after_deduction() once the writes are committed
+        "stock_updates": stock_updates,
+        "status": "success" if not failed_items else "partial_success"
+    }
+
+
+@router.post("/deduct-for-order")
+async def deduct_inventory_for_order(order_data: Dict = Body(...)):
+    """Deduct inventory for an order placed outside the POS (see deduct_for_order)"""
+    try:
+        order_id = order_data.get('order_id')
+        order_items = order_data.get('items', [])
+
+        if not order_id or not order_items:
+            raise HTTPException(status_code=400, detail="Missing order_id or items")
+
+        result = await deduct_for_order(order_id, order_items)
+        await after_deduction(result)
+        return result
+
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error deducting inventory: {str(e)}")
         import traceback
@@ -657,6 +860,7 @@ async def create_inventory_item(item_data: Dict = Body(...)):
         }
 
         result = await db.inventory_items.insert_one(inventory_item)
+        snapshot.upsert(inventory_item)
         logger.info(f"Created inventory item: {item_data.get('name')}")
 
         return {
@@ -682,38 +886,17 @@ async def get_inventory_items(
 ):
     """Get all inventory items with optional filters"""
     try:
-        query = {}
-        if status:
-            query["status"] = status
-        if category:
-            query["category"] = category
-
-        items = await db.inventory_items.find(query).to_list(length=None)
-
-        if low_stock_only:
-            items = [
-                item for item in items 
-                if item["current_stock"] <= item["reorder_level"]
-            ]
-
-        formatted_items = []
-        for item in items:
-            formatted_items.append({
-                "id": str(item["_id"]),
-                "name": item["name"],
-                "category": item["category"],
-                "unit": item["unit"],
-                "current_stock": round(item["current_stock"], 2),
-                "current_stock_display": format_quantity_smart(item["current_stock"], item["unit"]),
-                "reorder_level": round(item["reorder_level"], 2),
-                "unit_cost": item.get("unit_cost", 0),
-                "supplier": item.get("supplier"),
-                "supplier_contact": item.get("supplier_contact"),
-                "status": item.get("status", "active"),
-                "inventory_value": round(item["current_stock"] * item.get("unit_cost", 0), 2),
-                "last_updated": item.get("last_updated"),
-                "created_at": item.get("created_at")
-            })
+        if snapshot.loaded:
+            formatted_items = snapshot.rows(status=status, category=category or None, low_stock_only=low_stock_only)
+        else:
+            query = {}
+            if status:
+                query["status"] = status
+            if category:
+                query["category"] = category
+            if low_stock_only:
+                query["$expr"] = {"$lte": ["$current_stock", "$reorder_level"]}
+            formatted_items = [format_item(item) async for item in db.inventory_items.find(query)]
 
         logger.info(f"Retrieved {len(formatted_items)} inventory items")
         return formatted_items
@@ -727,27 +910,19 @@ async def get_inventory_items(
 async def get_inventory_item(item_id: str):
     """Get single inventory item by ID"""
     try:
+        item = snapshot.get(item_id) if snapshot.loaded else None
+        if item is not None:
+            return item
+
         item = await db.inventory_items.find_one({"_id": ObjectId(item_id)})
 
         if not item:
             raise HTTPException(status_code=404, detail="Inventory item not found")
 
-        return {
-            "id": str(item["_id"]),
-            "name": item["name"],
-            "category": item["category"],
-            "unit": item["unit"],
-            "current_stock": round(item["current_stock"], 2),
-            "reorder_level": round(item["reorder_level"], 2),
-            "unit_cost": item.get("unit_cost", 0),
-            "supplier": item.get("supplier"),
-            "supplier_contact": item.get("supplier_contact"),
-            "status": item.get("status", "active"),
-            "inventory_value": round(item["current_stock"] * item.get("unit_cost", 0), 2),
-            "last_updated": item.get("last_updated"),
-            "created_at": item.get("created_at")
-        }
+        return format_item(item)
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching inventory item: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -768,6 +943,13 @@ async def update_inventory_item(item_id: str, item_data: Dict = Body(...)):
 
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="Inventory item not found")
+        snapshot.update(item_id, item_data)
+
+        if item_data.get("status", "active") != "active":
+            await menu_availability.on_item_removed(item_id)
+        elif "current_stock" in item_data:
+            unit = item_data.get("unit") or (snapshot.get(item_id) or {}).get("unit")
+            await refresh_availability({item_id: item_data["current_stock"]}, {item_id: unit} if unit else None)
 
         logger.info(f"Updated inventory item: {item_id}")
         return {"message": "Item updated successfully", "status": "success"}
@@ -781,13 +963,13 @@ async def update_inventory_item(item_id: str, item_data: Dict = Body(...)):
 async def delete_inventory_item(item_id: str):
     """Soft delete inventory item (mark as inactive)"""
     try:
-        result = await db.inventory_items.update_one(
-            {"_id": ObjectId(item_id)},
-            {"$set": {"status": "inactive", "last_updated": datetime.now(timezone.utc)}}
-        )
+        changes = {"status": "inactive", "last_updated": datetime.now(timezone.utc)}
+        result = await db.inventory_items.update_one({"_id": ObjectId(item_id)}, {"$set": changes})
 
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="Inventory item not found")
+        snapshot.update(item_id, changes)
+        await menu_availability.on_item_removed(item_id)
 
         logger.info(f"Deleted inventory item: {item_id}")
         return {"message": "Item deleted successfully", "status": "success"}
@@ -801,10 +983,13 @@ async def delete_inventory_item(item_id: str):
 async def get_low_stock_alerts():
     """Get items that are below reorder level"""
     try:
-        items = await db.inventory_items.find({
-            "status": "active",
-            "$expr": {"$lte": ["$current_stock", "$reorder_level"]}
-        }).to_list(length=None)
+        if snapshot.loaded:
+            items = snapshot.low_stock_docs()
+        else:
+            items = await db.inventory_items.find({
+                "status": "active",
+                "$expr": {"$lte": ["$current_stock", "$reorder_level"]}
+            }).to_list(length=None)
 
         formatted_items = []
         critical_count = 0
@@ -817,6 +1002,7 @@ async def get_low_stock_alerts():
                 urgency = "warning"
 
             needed = max(0, item["reorder_level"] - item["current_stock"])
+            forecast = consumption.forecasts.get(str(item["_id"]), {})
 
             formatted_items.append({
                 "id": str(item["_id"]),
@@ -828,16 +1014,42 @@ async def get_low_stock_alerts():
                 "unit": item["unit"],
                 "urgency": urgency,
                 "needed": round(needed, 2),
+                "days_until_stockout": forecast.get("days_until_stockout"),
+                "suggested_reorder_qty": forecast.get("suggested_reorder_qty"),
                 "supplier": item.get("supplier"),
                 "supplier_contact": item.get("supplier_contact")
             })
 
-        logger.info(f"Found {len(formatted_items)} low stock items")
+        # Items the usage forecast expects to cross their reorder level soon
+        active = []
+        if snapshot.loaded:
+            active = snapshot.docs()
+        elif consumption.forecasts:
+            active = await db.inventory_items.find(
+                {"status": "active", "_id": {"$in": [ObjectId(i) for i in consumption.forecasts]}},
+                {"current_stock": 1, "reorder_level": 1}
+            ).to_list(length=None)
+        forecast_items = [
+            {
+                "id": forecast["item_id"],
+                "name": forecast["item_name"],
+                "unit": forecast["unit"],
+                "urgency": "forecast",
+                "days_until_reorder": forecast["days_until_reorder"],
+                "days_until_stockout": forecast["days_until_stockout"],
+                "avg_daily_usage": forecast["avg_daily_usage"],
+                "suggested_reorder_qty": forecast["suggested_reorder_qty"]
+            }
+            for forecast in consumption.approaching_reorder(active)
+        ]
+
+        logger.info(f"Found {len(formatted_items)} low stock items, {len(forecast_items)} approaching reorder level")
 
         return {
             "low_stock_items": formatted_items,
             "count": len(formatted_items),
             "critical_count": critical_count,
+            "forecast_items": forecast_items,
             "status": "success"
         }
 
@@ -845,6 +1057,164 @@ async def get_low_stock_alerts():
         logger.error(f"Error fetching low stock alerts: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# ==================== CONSUMPTION FORECASTS ====================
+@router.get("/forecast")
+async def get_consumption_forecast(within_days: Optional[float] = Query(None, ge=0)):
+    """Per-ingredient usage forecast, soonest stock-out first"""
+    try:
+        forecasts = list(consumption.forecasts.values())
+        if within_days is not None:
+            forecasts = [
+                f for f in forecasts
+                if f.get("days_until_stockout") is not None and f["days_until_stockout"] <= within_days
+            ]
+        forecasts.sort(key=lambda f: (f.get("days_until_stockout") is None, f.get("days_until_stockout") or 0))
+        return {
+            "forecasts": forecasts,
+            "count": len(forecasts),
+            "status": "success"
+        }
+
+    except Exception as e:
+        logger.error(f"Error fetching consumption forecast: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/forecast/refresh")
+async def refresh_consumption_forecast(full: bool = Query(False)):
+    """Roll up usage and recompute forecasts now (full=true re-aggregates all history)"""
+    try:
+        count = await consumption.refresh(full_rollup=full)
+        return {"message": f"Forecasts refreshed for {count} items", "count": count, "status": "success"}
+
+    except Exception as e:
+        logger.error(f"Error refreshing consumption forecast: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/items/{item_id}/usage")
+async def get_item_usage(item_id: str, days: int = Query(HISTORY_DAYS, ge=1, le=365)):
+    """Daily usage of one ingredient (base unit) from the nightly rollup"""
+    try:
+        series = await consumption.usage_series(item_id, days)
+        return {
+            "item_id": item_id,
+            "usage": series,
+            "forecast": consumption.forecasts.get(item_id),
+            "status": "success"
+        }
+
+    except Exception as e:
+        logger.error(f"Error fetching item usage: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# ==================== MENU AVAILABILITY ====================
+@router.get("/menu-availability")
+async def get_menu_availability():
+    """Portions of each dish the current stock allows, fewest first"""
+    try:
+        if not menu_availability.loaded:
+            raise HTTPException(status_code=503, detail="Menu availability is still loading")
+        dishes = menu_availability.summary()
+        return {
+            "dishes": dishes,
+            "unavailable_count": sum(1 for dish in dishes if not dish["is_available"]),
+            "status": "success"
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error fetching menu availability: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# ==================== PURCHASE ORDERS ====================
+@router.post("/purchase-orders/generate")
+async def generate_purchase_orders(include_forecast: bool = Query(True)):
+    """Draft one purchase order per supplier for low-stock (and soon-low) items"""
+    try:
+        if snapshot.loaded:
+            active = snapshot.docs()
+        else:
+            active = await db.inventory_items.find({"status": "active"}).to_list(length=None)
+
+        items = [item for item in active if (item.get("current_stock") or 0) <= (item.get("reorder_level") or 0)]
+        if include_forecast:
+            soon = {forecast["item_id"] for forecast in consumption.approaching_reorder(active)}
+            items += [item for item in active if str(item["_id"]) in soon]
+
+        drafts = await procurement.generate(items, consumption.forecasts)
+        return {
+            "purchase_orders": drafts,
+            "count": len(drafts),
+            "status": "success"
+        }
+
+    except Exception as e:
+        logger.error(f"Error generating purchase orders: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/purchase-orders")
+async def get_purchase_orders(status: Optional[str] = Query(None), limit: int = Query(50, le=500)):
+    """Purchase orders, newest first"""
+    try:
+        purchase_orders = await procurement.list_orders(status, limit)
+        return {"purchase_orders": purchase_orders, "count": len(purchase_orders), "status": "success"}
+
+    except Exception as e:
+        logger.error(f"Error fetching purchase orders: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/purchase-orders/{po_id}")
+async def get_purchase_order(po_id: str):
+    try:
+        po = await procurement.get(po_id)
+        if not po:
+            raise HTTPException(status_code=404, detail="Purchase order not found")
+        return po
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error fetching purchase order: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.put("/purchase-orders/{po_id}/status")
+async def update_purchase_order_status(po_id: str, data: Dict = Body(...)):
+    """Mark a draft as ordered, or cancel it ({"status": "ordered" | "cancelled"})"""
+    try:
+        return await procurement.set_status(po_id, data.get("status", ""))
+
+    except LookupError:
+        raise HTTPException(status_code=404, detail="Purchase order not found")
+    except PurchaseOrderError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error updating purchase order: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/purchase-orders/{po_id}/receive")
+async def receive_purchase_order(po_id: str, data: Optional[Dict] = Body(None)):
+    """
+    Book a delivery into stock. Body {"received": {item_id: quantity}} for
+    partial / different quantities; without it the ordered quantities are booked.
+    """
+    try:
+        outcome = await procurement.receive(po_id, (data or {}).get("received"))
+        snapshot.apply_stock_updates(outcome["stock_updates"], last_updated=datetime.now(timezone.utc))
+        await refresh_availability(outcome["stock_updates"])
+        return {
+            "purchase_order": outcome["purchase_order"],
+            "items_restocked": len(outcome["stock_updates"]),
+            "status": "success"
+        }
+
+    except LookupError:
+        raise HTTPException(status_code=404, detail="Purchase order not found")
+    except PurchaseOrderError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error receiving purchase order: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 # ==================== GET STOCK TRANSACTIONS ====================
 @router.get("/transactions")
 async def get_stock_transactions(
@@ -869,11 +1239,13 @@ async def get_stock_transactions(
                 "item_name": txn.get("item_name"),
                 "transaction_type": txn.get("transaction_type"),
                 "quantity_deducted": txn.get("quantity_deducted"),
+                "quantity_added": txn.get("quantity_added"),
                 "unit": txn.get("unit"),
                 "previous_stock": round(txn.get("previous_stock", 0), 2),
                 "new_stock": round(txn.get("new_stock", 0), 2),
                 "storage_unit": txn.get("storage_unit"),
                 "order_id": txn.get("order_id"),
+                "purchase_order_id": txn.get("purchase_order_id"),
                 "menu_item": txn.get("menu_item"),
                 "recipe_quantity": txn.get("recipe_quantity"),
                 "recipe_unit": txn.get("recipe_unit"),
@@ -895,15 +1267,23 @@ async def get_stock_transactions(
 async def get_inventory_dashboard_stats():
     """Get inventory dashboard statistics"""
     try:
-        total_items = await db.inventory_items.count_documents({"status": "active"})
-
-        low_stock_items = await db.inventory_items.count_documents({
-            "status": "active",
-            "$expr": {"$lte": ["$current_stock", "$reorder_level"]}
-        })
-
-        all_items = await db.inventory_items.find({"status": "active"}).to_list(length=None)
-        total_value = sum(item["current_stock"] * item.get("unit_cost", 0) for item in all_items)
+        if snapshot.loaded:
+            total_items = snapshot.count()
+            low_stock_items = snapshot.low_stock_count()
+            total_value = snapshot.total_value()
+        else:
+            total_items = await db.inventory_items.count_documents({"status": "active"})
+            low_stock_items = await db.inventory_items.count_documents({
+                "status": "active",
+                "$expr": {"$lte": ["$current_stock", "$reorder_level"]}
+            })
+            totals = await db.inventory_items.aggregate([
+                {"$match": {"status": "active"}},
+                {"$group": {"_id": None, "value": {"$sum": {"$multiply": [
+                    "$current_stock", {"$ifNull": ["$unit_cost", 0]}
+                ]}}}}
+            ]).to_list(length=1)
+            total_value = totals[0]["value"] if totals else 0
 
         from datetime import timedelta
         yesterday = datetime.now(timezone.utc) - timedelta(days=1)
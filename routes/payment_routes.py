@@ -5,6 +5,7 @@ from typing import List, Optional
 from datetime import datetime, timezone
 import logging
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 
 from models.soundbox_models import (
     SoundboxConfigModel,
@@ -15,7 +16,11 @@ from models.soundbox_models import (
     SoundboxWebhookPayload
 )
 
-from services.payment_matcher import PaymentMatcher
+from services.payment_matcher import payment_matcher
+from services.payment_queue import payment_queue
+from services import reconciliation
+from services.customer_stats import customer_stats
+from services.table_state import table_state
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api", tags=["payments"])
@@ -248,47 +253,49 @@ async def soundbox_webhook_simple(payload: dict):
         if not transaction_id or amount <= 0:
             raise HTTPException(status_code=400, detail="Invalid payment data")
         
-        # Check if payment already exists
-        existing = await db.payments.find_one({"transaction_id": transaction_id})
-        if existing:
-            logger.warning(f"⚠️ Duplicate payment: {transaction_id}")
-            return {"status": "duplicate", "message": "Payment already processed"}
-        
         # Create payment record
+        now = datetime.now(timezone.utc).isoformat()
         payment_record = {
             "transaction_id": transaction_id,
             "amount": amount,
             "upi_id": upi_id,
             "payment_method": payment_method,
             "status": status,
-            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "timestamp": now,
             "matched": False,
             "order_id": None,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "match_status": "queued",
+            "match_attempts": 0,
+            "created_at": now
         }
         
-        # Save to database
-        result = await db.payments.insert_one(payment_record)
+        # One upsert on the unique transaction_id - provider retries become no-ops
+        try:
+            result = await db.payments.update_one(
+                {"transaction_id": transaction_id},
+                {"$setOnInsert": payment_record},
+                upsert=True
+            )
+            is_new = result.upserted_id is not None
+        except DuplicateKeyError:
+            is_new = False
+        
+        if not is_new:
+            logger.warning(f"⚠️ Duplicate payment: {transaction_id}")
+            return {"status": "duplicate", "message": "Payment already processed"}
+        
         logger.info(f"💾 Payment saved: {transaction_id}")
         
-        # Try to match with pending orders
-        matched_order = await auto_match_payment(amount, transaction_id)
+        # Matching runs on the payment queue; the result goes out over the WebSocket
+        payment_queue.enqueue(transaction_id)
         
-        if matched_order:
-            logger.info(f"✅ Payment matched to order: {matched_order['order_id']}")
-            return {
-                "status": "success",
-                "message": "Payment received and matched",
-                "order_id": matched_order["order_id"],
-                "matched": True
-            }
-        else:
-            logger.warning(f"⚠️ No matching order found for ₹{amount}")
-            return {
-                "status": "success",
-                "message": "Payment received, no matching order",
-                "matched": False
-            }
+        return {
+            "status": "success",
+            "message": "Payment received, matching queued",
+            "transaction_id": transaction_id,
+            "matched": False,
+            "queued": True
+        }
             
     except HTTPException:
         raise
@@ -296,62 +303,6 @@ async def soundbox_webhook_simple(payload: dict):
         logger.error(f"Error processing webhook: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-async def auto_match_payment(amount: float, transaction_id: str):
-    """Auto-match payment to pending order by amount"""
-    try:
-        logger.info(f"🔍 Attempting to match payment: ₹{amount} (TXN: {transaction_id})")
-        
-        # Find pending orders with matching amount (±2 tolerance)
-        pending_orders = await db.orders.find({
-            "payment_status": "pending",
-            "final_amount": {"$gte": amount - 2, "$lte": amount + 2}
-        }).sort("created_at", 1).to_list(length=10)
-        
-        if not pending_orders:
-            logger.warning(f"⚠️ No matching pending orders found for ₹{amount}")
-            return None
-        
-        # Match to oldest pending order
-        order = pending_orders[0]
-        order_id = order.get("order_id")
-        logger.info(f"🎯 Matching to order: {order_id}")
-        
-        # Update order with correct field name
-        update_result = await db.orders.update_one(
-            {"order_id": order_id},
-            {"$set": {
-                "payment_status": "paid",
-                "payment_method": "online",
-                "transaction_id": transaction_id,
-                "paid_at": datetime.now(timezone.utc).isoformat(),
-                "status": "served",
-                "updated_at": datetime.now(timezone.utc).isoformat()
-            }}
-        )
-        
-        if update_result.modified_count == 0:
-            logger.error(f"❌ Failed to update order {order_id}")
-            return None
-        
-        # Update payment record
-        await db.payments.update_one(
-            {"transaction_id": transaction_id},
-            {"$set": {
-                "matched": True,
-                "order_id": order_id,
-                "matched_at": datetime.now(timezone.utc).isoformat()
-            }}
-        )
-        
-        logger.info(f"✅ Order {order_id} marked as PAID via ONLINE payment!")
-        return order
-        
-    except Exception as e:
-        logger.error(f"❌ Error matching payment: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return None
-
 @router.post("/webhook/soundbox/test")
 async def test_webhook():
     """Test endpoint to simulate payment notification"""
@@ -447,8 +398,11 @@ async def manual_match_payment(payment_id: str, order_id: str):
                 "payment_status": "paid",
                 "transaction_id": payment_id,
                 "paid_at": datetime.now(timezone.utc).isoformat()
-            }}
+            }, "$inc": {"version": 1}}
         )
+        await table_state.release(order.get("id"))
+        payment_matcher.forget(order.get("id"))
+        await customer_stats.on_paid(order.get("id"))
         
         # Update payment
         await db.payments.update_one(
@@ -456,7 +410,8 @@ async def manual_match_payment(payment_id: str, order_id: str):
             {"$set": {
                 "matched": True,
                 "order_id": order_id,
-                "matched_at": datetime.now(timezone.utc).isoformat()
+                "matched_at": datetime.now(timezone.utc).isoformat(),
+                "match_status": "manual"
             }}
         )
         
@@ -474,12 +429,140 @@ async def manual_match_payment(payment_id: str, order_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 # ============================================================================
-# ✅ PAYMENT STATISTICS - FIXED WITH mongo_to_dict()
+# RECONCILIATION & SETTLEMENT
+# ============================================================================
+
+@router.get("/payments/reconcile")
+async def preview_reconciliation(
+    date: Optional[str] = None,
+    tolerance: float = reconciliation.DEFAULT_TOLERANCE,
+    window_minutes: int = reconciliation.DEFAULT_WINDOW_MINUTES
+):
+    """Propose matches for a day's unmatched payments (nothing is written)"""
+    try:
+        start, payments, orders = await reconciliation.load_day(db, date, window_minutes)
+        proposals = reconciliation.propose_matches(payments, orders, tolerance, window_minutes)
+        return {
+            "date": start.date().isoformat(),
+            "unmatched_payments": len(payments),
+            "unpaid_orders": len(orders),
+            "proposals": mongo_to_dict(proposals),
+            "count": len(proposals)
+        }
+    except Exception as e:
+        logger.error(f"Error proposing reconciliation: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/payments/reconcile")
+async def run_reconciliation(payload: dict = Body(default={})):
+    """
+    Apply reconciliation for a day and store its settlement report.
+    payload: {date?, tolerance?, window_minutes?, accept?: [transaction_id]}
+    - without `accept` every proposal is applied
+    """
+    try:
+        date = payload.get("date")
+        tolerance = float(payload.get("tolerance", reconciliation.DEFAULT_TOLERANCE))
+        window_minutes = int(payload.get("window_minutes", reconciliation.DEFAULT_WINDOW_MINUTES))
+        accept = payload.get("accept")
+        
+        start, payments, orders = await reconciliation.load_day(db, date, window_minutes)
+        proposals = reconciliation.propose_matches(payments, orders, tolerance, window_minutes)
+        if accept is not None:
+            accepted_ids = set(accept)
+            proposals = [p for p in proposals if p["transaction_id"] in accepted_ids]
+        
+        applied = await reconciliation.apply_matches(db, proposals)
+        report = await reconciliation.settlement_summary(db, start, applied)
+        
+        await db.settlement_reports.update_one(
+            {"date": report["date"]},
+            {"$set": report},
+            upsert=True
+        )
+        logger.info(f"✅ Reconciled {len(applied)} payment(s) for {report['date']}")
+        
+        return {
+            "status": "success",
+            "applied": mongo_to_dict(applied),
+            "skipped": len(proposals) - len(applied),
+            "settlement": report
+        }
+    except Exception as e:
+        logger.error(f"Error running reconciliation: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/payments/settlement")
+async def get_settlement_report(date: Optional[str] = None):
+    """Stored end-of-day settlement report, or a live one if the day was never reconciled"""
+    try:
+        start, _ = reconciliation.day_bounds(date)
+        report = await db.settlement_reports.find_one({"date": start.date().isoformat()}, {"_id": 0})
+        if report is None:
+            report = await reconciliation.settlement_summary(db, start, [])
+            report["stored"] = False
+        return report
+    except Exception as e:
+        logger.error(f"Error fetching settlement report: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# ============================================================================
+# PAYMENT STATISTICS - ONE AGGREGATION
 # ============================================================================
 
+def payment_stats_pipeline(start_of_day, end_of_day, pending_skip: int, pending_limit: int) -> list:
+    """
+    Runs on `payments`: the day's webhook payments, with the day's orders
+    unioned in, split by $facet into per-method paid totals, the matched /
+    unmatched counts and one page of pending orders (MongoDB 4.4+)
+    """
+    pending = {"_kind": "order", "payment_status": {"$ne": "paid"}}
+    return [
+        {"$match": reconciliation.day_range_filter("timestamp", start_of_day, end_of_day)},
+        {"$project": {"_kind": {"$literal": "payment"}, "matched": 1}},
+        {"$unionWith": {
+            "coll": "orders",
+            "pipeline": [
+                {"$match": reconciliation.day_range_filter("created_at", start_of_day, end_of_day)},
+                {"$addFields": {"_kind": "order"}}
+            ]
+        }},
+        {"$facet": {
+            "paid_by_method": [
+                {"$match": {"_kind": "order", "payment_status": "paid"}},
+                {"$group": {
+                    "_id": {"$ifNull": ["$payment_method", None]},
+                    "amount": {"$sum": {"$ifNull": ["$final_amount", {"$ifNull": ["$total", 0]}]}},
+                    "count": {"$sum": 1}
+                }}
+            ],
+            "webhook": [
+                {"$match": {"_kind": "payment"}},
+                {"$group": {
+                    "_id": None,
+                    "total": {"$sum": 1},
+                    "matched": {"$sum": {"$cond": [{"$eq": ["$matched", True]}, 1, 0]}}
+                }}
+            ],
+            "pending_count": [{"$match": pending}, {"$count": "count"}],
+            "pending_orders": [
+                {"$match": pending},
+                {"$sort": {"created_at": 1}},
+                {"$skip": pending_skip},
+                {"$limit": pending_limit},
+                {"$project": {"_kind": 0}}
+            ]
+        }}
+    ]
+
+
 @router.get("/payments/stats")
-async def get_payment_stats(date: Optional[str] = None):
-    """Get payment statistics - includes ALL paid orders"""
+async def get_payment_stats(
+    date: Optional[str] = None,
+    pending_page: int = 1,
+    pending_limit: int = 100
+):
+    """Get payment statistics - includes ALL paid orders, in one round trip"""
     try:
         # Use provided date or today
         if date:
@@ -491,81 +574,52 @@ async def get_payment_stats(date: Optional[str] = None):
         start_of_day = target_date.replace(hour=0, minute=0, second=0, microsecond=0)
         end_of_day = target_date.replace(hour=23, minute=59, second=59, microsecond=999999)
         
+        pending_page = max(pending_page, 1)
+        pending_limit = min(max(pending_limit, 1), 500)
+        
         logger.info(f"📊 Fetching payment stats for: {start_of_day.date()}")
         
-        # =====================================================================
-        # GET ALL PAID ORDERS (This includes cash, online, and unknown)
-        # =====================================================================
-        all_paid_orders = await db.orders.find({
-            "payment_status": "paid",
-            "created_at": {
-                "$gte": start_of_day.isoformat(),
-                "$lte": end_of_day.isoformat()
-            }
-        }).to_list(length=1000)
-        
-        # ✅ CRITICAL FIX: Convert ALL orders using mongo_to_dict FIRST
-        all_paid_orders = [mongo_to_dict(order) for order in all_paid_orders]
-        
-        # Separate by payment method (now safe to use)
-        online_orders = [o for o in all_paid_orders if o.get("payment_method") == "online"]
-        cash_orders = [o for o in all_paid_orders if o.get("payment_method") == "cash"]
-        unknown_orders = [o for o in all_paid_orders if not o.get("payment_method")]
-        
-        # Calculate totals
-        total_online = sum(float(o.get("final_amount", o.get("total", 0))) for o in online_orders)
-        total_cash = sum(float(o.get("final_amount", o.get("total", 0))) for o in cash_orders)
-        total_unknown = sum(float(o.get("final_amount", o.get("total", 0))) for o in unknown_orders)
-        
-        # Total amount
-        total_amount = total_online + total_cash + total_unknown
-        
-        logger.info(f"💰 Online: ₹{total_online}, Cash: ₹{total_cash}, Unknown: ₹{total_unknown}")
-        
-        # =====================================================================
-        # GET PENDING ORDERS (for matching dropdown)
-        # =====================================================================
-        pending_orders = await db.orders.find({
-            "payment_status": {"$ne": "paid"},
-            "created_at": {
-                "$gte": start_of_day.isoformat(),
-                "$lte": end_of_day.isoformat()
-            }
-        }).to_list(length=100)
-        
-        # ✅ Convert pending orders
-        pending_orders = [mongo_to_dict(order) for order in pending_orders]
-        
-        # =====================================================================
-        # GET WEBHOOK PAYMENTS (from soundbox/test webhook)
-        # =====================================================================
-        today_payments = await db.payments.find({
-            "timestamp": {
-                "$gte": start_of_day.isoformat(),
-                "$lte": end_of_day.isoformat()
-            }
-        }).to_list(length=1000)
+        results = await db.payments.aggregate(
+            payment_stats_pipeline(start_of_day, end_of_day, (pending_page - 1) * pending_limit, pending_limit)
+        ).to_list(length=1)
+        facets = results[0] if results else {}
+        
+        # Per-method totals: online, cash, no method recorded, anything else
+        by_method = {}
+        for row in facets.get("paid_by_method", []):
+            method = row["_id"] or "unknown"
+            bucket = by_method.setdefault(method, {"amount": 0.0, "count": 0})
+            bucket["amount"] += float(row["amount"] or 0)
+            bucket["count"] += row["count"]
+        
+        online = by_method.get("online", {"amount": 0.0, "count": 0})
+        cash = by_method.get("cash", {"amount": 0.0, "count": 0})
+        unknown = by_method.get("unknown", {"amount": 0.0, "count": 0})
+        total_amount = sum(bucket["amount"] for bucket in by_method.values())
+        total_paid = sum(bucket["count"] for bucket in by_method.values())
         
-        # ✅ Convert webhook payments
-        today_payments = [mongo_to_dict(payment) for payment in today_payments]
+        logger.info(f"💰 Online: ₹{online['amount']}, Cash: ₹{cash['amount']}, Unknown: ₹{unknown['amount']}")
         
-        # Count matched/unmatched webhook payments
-        matched_count = sum(1 for p in today_payments if p.get("matched", False))
-        unmatched_count = len(today_payments) - matched_count
+        webhook = (facets.get("webhook") or [{"total": 0, "matched": 0}])[0]
+        pending_count = (facets.get("pending_count") or [{"count": 0}])[0]["count"]
         
         # Return plain dict (all ObjectIds converted to strings)
         return {
-            "total_payments_today": len(all_paid_orders),  # Total ORDERS paid
+            "total_payments_today": total_paid,  # Total ORDERS paid
             "total_amount": float(total_amount),
-            "matched_payments": matched_count,  # Webhook payments matched
-            "unmatched_payments": unmatched_count,  # Webhook payments unmatched
-            "pending_orders": pending_orders,
-            "today_online": float(total_online),
-            "today_cash": float(total_cash),
-            "today_unknown": float(total_unknown),
-            "online_orders_count": len(online_orders),
-            "cash_orders_count": len(cash_orders),
-            "unknown_orders_count": len(unknown_orders),
+            "matched_payments": webhook["matched"],  # Webhook payments matched
+            "unmatched_payments": webhook["total"] - webhook["matched"],  # Webhook payments unmatched
+            "pending_orders": [mongo_to_dict(order) for order in facets.get("pending_orders", [])],
+            "pending_orders_total": pending_count,
+            "pending_page": pending_page,
+            "pending_limit": pending_limit,
+            "today_online": float(online["amount"]),
+            "today_cash": float(cash["amount"]),
+            "today_unknown": float(unknown["amount"]),
+            "online_orders_count": online["count"],
+            "cash_orders_count": cash["count"],
+            "unknown_orders_count": unknown["count"],
+            "by_method": by_method,
             "date": start_of_day.isoformat()
         }
         
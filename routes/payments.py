@@ -1,11 +1,13 @@
 from fastapi import APIRouter, HTTPException
 from datetime import datetime
-from pymongo import MongoClient
 
-# MongoDB connection
-client = MongoClient("mongodb://localhost:27017/")
-db = client["taste_paradise"]
-orders_collection = db["orders"]
+from services.table_state import table_state
+from services.payment_matcher import payment_matcher
+from services.customer_stats import customer_stats
+
+# Injected from main.py (same Motor database as the rest of the app)
+db = None
+broadcast = None
 
 # Create router
 router = APIRouter(
@@ -14,11 +16,18 @@ router = APIRouter(
 )
 
 
+def init_legacy_payment_routes(database, broadcast_fn=None):
+    """Initialize routes with the database connection and the WebSocket broadcast"""
+    global db, broadcast
+    db = database
+    broadcast = broadcast_fn
+
+
 @router.post("/{order_id}/mark-cash")
 async def mark_order_as_cash(order_id: str):
     """Mark an order as paid with cash"""
     try:
-        result = orders_collection.update_one(
+        updated = await db.orders.find_one_and_update(
             {"order_id": order_id},
             {
                 "$set": {
@@ -26,19 +35,37 @@ async def mark_order_as_cash(order_id: str):
                     "payment_status": "paid",
                     "status": "paid",
                     "paid_at": datetime.now().isoformat()
-                }
-            }
+                },
+                "$inc": {"version": 1}
+            },
+            return_document=True
         )
-        
-        if result.modified_count > 0:
-            return {
-                "success": True, 
-                "message": "Order marked as cash payment",
-                "order_id": order_id
-            }
-        else:
+
+        if updated is None:
             raise HTTPException(status_code=404, detail="Order not found")
-            
+
+        # Same post-write hooks as PUT /api/orders/{id}/pay
+        await table_state.release(updated["id"])
+        await customer_stats.on_paid(updated["id"])
+        payment_matcher.track(updated)
+        if broadcast:
+            await broadcast({
+                "type": "payment_updated",
+                "order_id": updated["id"],
+                "payment_status": "paid",
+                "payment_method": "cash",
+                "version": updated["version"],
+                "timestamp": datetime.now().isoformat()
+            })
+
+        return {
+            "success": True,
+            "message": "Order marked as cash payment",
+            "order_id": order_id
+        }
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -47,16 +74,23 @@ async def mark_order_as_cash(order_id: str):
 async def cancel_order(order_id: str):
     """Cancel/delete an order"""
     try:
-        result = orders_collection.delete_one({"order_id": order_id})
-        
-        if result.deleted_count > 0:
-            return {
-                "success": True, 
-                "message": "Order cancelled successfully",
-                "order_id": order_id
-            }
-        else:
+        deleted = await db.orders.find_one_and_delete({"order_id": order_id})
+
+        if deleted is None:
             raise HTTPException(status_code=404, detail="Order not found")
-            
+
+        # Same post-write hooks as DELETE /api/orders/{id}
+        await table_state.release(deleted["id"])
+        payment_matcher.forget(deleted["id"])
+        await customer_stats.on_deleted(deleted)
+
+        return {
+            "success": True,
+            "message": "Order cancelled successfully",
+            "order_id": order_id
+        }
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
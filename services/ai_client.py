@@ -0,0 +1,219 @@
+# services/ai_client.py
+"""
+Shared HTTP client for the external AI chat service
+
+- One httpx.AsyncClient for the app's lifetime (started/closed with the app),
+  so keep-alive connections to the AI service are pooled and reused
+- Per-route timeouts, plus a semaphore capping in-flight upstream calls
+- Circuit breaker: after `failure_threshold` consecutive failures the
+  upstream is skipped for `reset_seconds`, then a single trial call decides
+  whether to close the circuit again
+- LRU + TTL cache keyed on the normalized prompt, so repeated FAQ-style
+  questions ("What are your timings?") never leave the process
+
+Local stand-in for the upstream:  python test_endpoint.py  (serves /chat on :8003)
+Tests (in-process stub upstream):  python -m pytest test_ai_client.py
+"""
+
+import asyncio
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+import logging
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+AI_SERVICE_URL = os.getenv("AI_SERVICE_URL", "http://localhost:8003")
+
+# path → timeout; connect/pool stay short so a dead upstream fails fast
+ROUTE_TIMEOUTS = {
+    "/chat": httpx.Timeout(connect=2.0, read=30.0, write=5.0, pool=2.0),
+}
+DEFAULT_TIMEOUT = httpx.Timeout(connect=2.0, read=10.0, write=5.0, pool=2.0)
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]")
+_SPACES_RE = re.compile(r"\s+")
+
+
+class AIServiceUnavailable(Exception):
+    """Upstream down, circuit open or too many calls in flight"""
+
+
+def normalize_prompt(message: str) -> str:
+    """Cache key: "What are your timings?" and "what are your  timings" are the same question"""
+    return _SPACES_RE.sub(" ", _PUNCTUATION_RE.sub(" ", (message or "").lower())).strip()
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker: closed → open → half-open (one trial call) → closed"""
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._trial_in_flight or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logger.warning(f"⚡ AI service circuit opened after {self.failures} failures")
+            self.opened_at = time.monotonic()
+        self._trial_in_flight = False
+
+    def cancel_trial(self):
+        """The allowed call never reached the upstream"""
+        self._trial_in_flight = False
+
+
+class ResponseCache:
+    """LRU of normalized prompt → upstream JSON, each entry valid for ttl_seconds"""
+
+    def __init__(self, max_entries: int = 512, ttl_seconds: float = 15 * 60):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: str, value: Dict[str, Any]):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class AIChatClient:
+    """Pooled, bounded, circuit-broken client for the AI chat service"""
+
+    def __init__(self, base_url: str = AI_SERVICE_URL, max_concurrency: int = 20,
+                 cache: Optional[ResponseCache] = None, breaker: Optional[CircuitBreaker] = None,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.base_url = base_url
+        self.max_concurrency = max_concurrency
+        # An empty ResponseCache is falsy (it has __len__), so test for None
+        self.cache = cache if cache is not None else ResponseCache()
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        # None = real network; tests pass an in-process transport (httpx.MockTransport)
+        self.transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._slots = asyncio.Semaphore(max_concurrency)
+
+    async def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=DEFAULT_TIMEOUT,
+                transport=self.transport,
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency,
+                    keepalive_expiry=60.0
+                )
+            )
+            logger.info(f"✅ AI service client ready ({self.base_url}, {self.max_concurrency} connections)")
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _post(self, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        if self._client is None:
+            await self.start()
+        if not self.breaker.allow():
+            raise AIServiceUnavailable("circuit open")
+
+        timeout = ROUTE_TIMEOUTS.get(path, DEFAULT_TIMEOUT)
+        try:
+            # Wait for a slot no longer than the pool timeout allows
+            await asyncio.wait_for(self._slots.acquire(), timeout=timeout.pool)
+        except asyncio.TimeoutError:
+            self.breaker.cancel_trial()
+            raise AIServiceUnavailable("too many AI requests in flight")
+
+        try:
+            response = await self._client.post(path, json=payload, timeout=timeout)
+            if response.status_code >= 500:
+                raise AIServiceUnavailable(f"upstream returned {response.status_code}")
+            response.raise_for_status()
+            data = response.json()
+        except httpx.HTTPStatusError:
+            # 4xx: the upstream is up, the request was bad
+            self.breaker.record_success()
+            raise
+        except (httpx.RequestError, ValueError, AIServiceUnavailable) as e:
+            self.breaker.record_failure()
+            raise AIServiceUnavailable(str(e)) from e
+        finally:
+            self._slots.release()
+
+        self.breaker.record_success()
+        return data
+
+    async def chat(self, message: str) -> Dict[str, Any]:
+        """Answer from the prompt cache, else forward to the AI service's /chat"""
+        key = normalize_prompt(message)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        data = await self._post("/chat", {"message": message})
+        if key:
+            self.cache.put(key, data)
+        return data
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "cache_entries": len(self.cache),
+            "cache_hits": self.cache.hits,
+            "cache_misses": self.cache.misses,
+        }
+
+
+ai_client = AIChatClient(
+    max_concurrency=int(os.getenv("AI_SERVICE_MAX_CONCURRENCY", "20"))
+)
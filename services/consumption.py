@@ -0,0 +1,259 @@
+# services/consumption.py
+"""
+Ingredient consumption analytics and stock-out forecasts
+
+stock_transactions logs every order deduction, one document per ingredient
+per order line. Nightly:
+
+1. rollup()  - one aggregation folds new deductions into inventory_usage_daily,
+               one document per (item_id, IST day) with the quantity used in
+               the ingredient's base unit (gm / ml / pieces). It starts from
+               the last day it rolled up (a watermark in consumption_state,
+               less ROLLUP_OVERLAP_DAYS for late writes), so nights the
+               machine was off are caught up by the next run - including the
+               one at startup.
+2. refresh() - builds an items × days usage matrix from the rollup and
+               forecasts the next days for all items at once with NumPy:
+
+                   daily forecast = 7-day moving average × weekday factor
+
+               where the weekday factor is the item's mean usage on that
+               weekday over its overall mean (once there are two weeks of
+               history). From that come days until stock-out, days until
+               the reorder level is reached and a suggested reorder quantity
+               covering REORDER_COVER_DAYS plus the reorder level.
+
+Results go to inventory_forecasts and stay in memory for the low-stock
+alerts, which can then warn before an item reaches its reorder level.
+
+Run the benchmark:  python -m services.consumption_benchmark
+"""
+
+from datetime import date, datetime, time, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+import logging
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+from services.mongo_format import IST
+
+logger = logging.getLogger(__name__)
+
+HISTORY_DAYS = int(os.getenv("FORECAST_HISTORY_DAYS", "28"))
+HORIZON_DAYS = int(os.getenv("FORECAST_HORIZON_DAYS", "14"))
+REORDER_COVER_DAYS = int(os.getenv("REORDER_COVER_DAYS", "7"))
+ALERT_HORIZON_DAYS = float(os.getenv("FORECAST_ALERT_DAYS", "3"))
+MOVING_AVERAGE_DAYS = 7
+SEASONAL_MIN_DAYS = 14
+ROLLUP_OVERLAP_DAYS = 2
+
+
+# ==================== VECTORIZED FORECAST ====================
+def usage_matrix(rows: Sequence[Dict[str, Any]], item_ids: Sequence[str], days: Sequence[date]) -> np.ndarray:
+    """Rollup rows → items × days array of usage (0 where nothing was used)"""
+    matrix = np.zeros((len(item_ids), len(days)))
+    if not rows:
+        return matrix
+    frame = pd.DataFrame(rows, columns=["item_id", "day", "quantity"])
+    item_index = pd.Index(list(item_ids)).get_indexer(frame["item_id"])
+    day_index = pd.Index([day.isoformat() for day in days]).get_indexer(frame["day"])
+    known = (item_index >= 0) & (day_index >= 0)
+    np.add.at(matrix, (item_index[known], day_index[known]), frame["quantity"].to_numpy(dtype=float)[known])
+    return matrix
+
+
+def weekday_factors(matrix: np.ndarray, first_weekday: int) -> np.ndarray:
+    """items × 7 multipliers: mean usage on each weekday / overall mean (1.0 without enough history)"""
+    items, days = matrix.shape
+    if days < SEASONAL_MIN_DAYS:
+        return np.ones((items, 7))
+    weekdays = (first_weekday + np.arange(days)) % 7
+    onehot = (weekdays[:, None] == np.arange(7)).astype(float)
+    per_weekday = matrix @ onehot / onehot.sum(axis=0)
+    overall = matrix.mean(axis=1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        factors = np.where(overall > 0, per_weekday / overall, 1.0)
+    return factors
+
+
+def forecast_usage(matrix: np.ndarray, first_weekday: int, horizon: int = HORIZON_DAYS) -> np.ndarray:
+    """items × horizon forecast of daily usage for the days after the matrix"""
+    items, days = matrix.shape
+    if days == 0:
+        return np.zeros((items, horizon))
+    moving_average = matrix[:, -MOVING_AVERAGE_DAYS:].mean(axis=1)
+    factors = weekday_factors(matrix, first_weekday)
+    future_weekdays = (first_weekday + days + np.arange(horizon)) % 7
+    return moving_average[:, None] * factors[:, future_weekdays]
+
+
+def days_until(daily: np.ndarray, available: np.ndarray) -> np.ndarray:
+    """Days until cumulative forecast usage reaches `available` (0 if already there, inf beyond the horizon)"""
+    cumulative = np.cumsum(daily, axis=1)
+    reached = cumulative >= available[:, None]
+    result = np.where(reached.any(axis=1), reached.argmax(axis=1) + 1, np.inf).astype(float)
+    result[available <= 0] = 0.0
+    return result
+
+
+def suggested_reorder(daily: np.ndarray, stock: np.ndarray, reorder_level: np.ndarray,
+                      cover_days: int = REORDER_COVER_DAYS) -> np.ndarray:
+    """Quantity that covers `cover_days` of forecast usage and leaves the reorder level in stock"""
+    needed = daily[:, :cover_days].sum(axis=1) + reorder_level - stock
+    return np.clip(needed, 0, None)
+
+
+def _finite(value: float) -> Optional[float]:
+    return None if math.isinf(value) else round(float(value), 1)
+
+
+# ==================== JOBS ====================
+class ConsumptionAnalytics:
+    """Nightly usage rollup + forecasts; `base_factor(unit)` gives base units per storage unit (kg → 1000)"""
+
+    def __init__(self, base_factor: Callable[[str], float]):
+        self.base_factor = base_factor
+        self.db = None
+        self.forecasts: Dict[str, Dict[str, Any]] = {}
+
+    async def init(self, db):
+        self.db = db
+        await db.inventory_usage_daily.create_index([("item_id", 1), ("day", 1)], unique=True)
+        await db.stock_transactions.create_index([("transaction_type", 1), ("transaction_date", 1)])
+        self.forecasts = {
+            doc["item_id"]: doc async for doc in db.inventory_forecasts.find({}, {"_id": 0})
+        }
+
+    async def rollup(self, full: bool = False) -> None:
+        """
+        Fold order deductions into daily usage, from the last day rolled up
+        (re-aggregating ROLLUP_OVERLAP_DAYS before it so late writes are
+        included); everything when there is no watermark yet
+        """
+        today = datetime.now(IST).date()
+        match: Dict[str, Any] = {"transaction_type": "order_deduction", "applied": {"$ne": False}}
+        state = None if full else await self.db.consumption_state.find_one({"_id": "rollup"})
+        if state and state.get("rolled_up_day"):
+            since_day = date.fromisoformat(state["rolled_up_day"]) - timedelta(days=ROLLUP_OVERLAP_DAYS)
+            match["transaction_date"] = {"$gte": IST.localize(datetime.combine(since_day, time.min))}
+
+        await self.db.stock_transactions.aggregate([
+            {"$match": match},
+            {"$group": {
+                "_id": {
+                    "item_id": "$item_id",
+                    "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$transaction_date", "timezone": "Asia/Kolkata"}}
+                },
+                "quantity": {"$sum": "$quantity_deducted"},
+                "transactions": {"$sum": 1},
+                "unit": {"$last": "$unit"}
+            }},
+            {"$project": {
+                "_id": 0,
+                "item_id": "$_id.item_id",
+                "day": "$_id.day",
+                "quantity": 1,
+                "transactions": 1,
+                "unit": 1
+            }},
+            {"$merge": {
+                "into": "inventory_usage_daily",
+                "on": ["item_id", "day"],
+                "whenMatched": "replace",
+                "whenNotMatched": "insert"
+            }}
+        ]).to_list(length=None)
+
+        await self.db.consumption_state.update_one(
+            {"_id": "rollup"},
+            {"$set": {"rolled_up_day": today.isoformat(), "rolled_up_at": datetime.now(IST)}},
+            upsert=True
+        )
+
+    async def usage_series(self, item_id: str, days: int = HISTORY_DAYS) -> List[Dict[str, Any]]:
+        first_day = (datetime.now(IST).date() - timedelta(days=days)).isoformat()
+        return await self.db.inventory_usage_daily.find(
+            {"item_id": item_id, "day": {"$gte": first_day}},
+            {"_id": 0, "day": 1, "quantity": 1, "unit": 1, "transactions": 1}
+        ).sort("day", 1).to_list(length=None)
+
+    async def refresh(self, full_rollup: bool = False) -> int:
+        """Roll up, forecast every active item and store the results; returns the number of items"""
+        from pymongo import ReplaceOne
+
+        await self.rollup(full=full_rollup)
+
+        items = await self.db.inventory_items.find(
+            {"status": "active"},
+            {"_id": 1, "name": 1, "unit": 1, "current_stock": 1, "reorder_level": 1}
+        ).to_list(length=None)
+        if not items:
+            self.forecasts = {}
+            return 0
+
+        # History up to yesterday - today is still being consumed
+        today = datetime.now(IST).date()
+        days = [today - timedelta(days=offset) for offset in range(HISTORY_DAYS, 0, -1)]
+        item_ids = [str(item["_id"]) for item in items]
+        rows = await self.db.inventory_usage_daily.find(
+            {"item_id": {"$in": item_ids}, "day": {"$gte": days[0].isoformat()}},
+            {"_id": 0, "item_id": 1, "day": 1, "quantity": 1}
+        ).to_list(length=None)
+
+        factors = np.array([self.base_factor(item.get("unit") or "") or 1.0 for item in items])
+        stock = np.array([item.get("current_stock") or 0 for item in items], dtype=float) * factors
+        reorder_level = np.array([item.get("reorder_level") or 0 for item in items], dtype=float) * factors
+
+        matrix = usage_matrix(rows, item_ids, days)
+        daily = forecast_usage(matrix, days[0].weekday())
+        stockout = days_until(daily, stock)
+        to_reorder = days_until(daily, stock - reorder_level)
+        reorder_qty = suggested_reorder(daily, stock, reorder_level) / factors
+        average = matrix[:, -MOVING_AVERAGE_DAYS:].mean(axis=1) / factors
+
+        refreshed_at = datetime.now(IST)
+        forecasts = {}
+        for i, item in enumerate(items):
+            forecasts[item_ids[i]] = {
+                "item_id": item_ids[i],
+                "item_name": item.get("name"),
+                "unit": item.get("unit"),
+                "avg_daily_usage": round(float(average[i]), 3),
+                "forecast_daily": [round(float(v), 3) for v in daily[i] / factors[i]],
+                "days_until_stockout": _finite(stockout[i]),
+                "days_until_reorder": _finite(to_reorder[i]),
+                "suggested_reorder_qty": math.ceil(float(reorder_qty[i]) * 100) / 100,
+                "refreshed_at": refreshed_at
+            }
+
+        await self.db.inventory_forecasts.bulk_write(
+            [ReplaceOne({"item_id": item_id}, doc, upsert=True) for item_id, doc in forecasts.items()],
+            ordered=False
+        )
+        await self.db.inventory_forecasts.delete_many({"item_id": {"$nin": item_ids}})
+        self.forecasts = forecasts
+        logger.info(f"✅ Consumption forecasts refreshed for {len(forecasts)} items")
+        return len(forecasts)
+
+    def approaching_reorder(self, items: Iterable[Dict[str, Any]],
+                            horizon_days: float = ALERT_HORIZON_DAYS) -> List[Dict[str, Any]]:
+        """
+        Items still above their reorder level that the forecast expects to
+        reach it within the horizon, re-projected from their current stock
+        """
+        alerts = []
+        for item in items:
+            forecast = self.forecasts.get(str(item["_id"]))
+            headroom = (item.get("current_stock") or 0) - (item.get("reorder_level") or 0)
+            if not forecast or headroom <= 0:
+                continue
+            used = 0.0
+            for day, usage in enumerate(forecast["forecast_daily"][:math.ceil(horizon_days)], start=1):
+                used += usage
+                if used >= headroom:
+                    alerts.append({**forecast, "days_until_reorder": day})
+                    break
+        return sorted(alerts, key=lambda f: f["days_until_reorder"])
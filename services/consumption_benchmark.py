@@ -0,0 +1,109 @@
+# services/consumption_benchmark.py
+"""
+Micro-benchmark for the consumption forecasts
+
+Builds random daily usage for a batch of ingredients, forecasts it with the
+vectorized functions in services.consumption and with a plain per-item loop
+(same formulas, one ingredient at a time), checks that both agree and prints
+the timings.
+
+Run:  python -m services.consumption_benchmark [items]
+"""
+
+from datetime import date, timedelta
+import math
+import sys
+import time
+
+import numpy as np
+
+from services.consumption import (
+    HISTORY_DAYS, HORIZON_DAYS, MOVING_AVERAGE_DAYS, SEASONAL_MIN_DAYS,
+    days_until, forecast_usage, suggested_reorder, usage_matrix
+)
+
+
+def make_rows(count: int, days, seed: int = 7):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for index in range(count):
+        base = rng.uniform(50, 5000)
+        weekend_boost = rng.uniform(1.0, 1.8)
+        for day in days:
+            if rng.random() < 0.1:
+                continue  # no sales of this ingredient that day
+            boost = weekend_boost if day.weekday() >= 5 else 1.0
+            rows.append({"item_id": f"I{index}", "day": day.isoformat(), "quantity": base * boost * rng.uniform(0.7, 1.3)})
+    stock = rng.uniform(0, 60000, count)
+    reorder_level = rng.uniform(0, 10000, count)
+    return rows, stock, reorder_level
+
+
+def forecast_one(series, first_weekday, stock, reorder_level):
+    """Reference implementation for a single ingredient"""
+    window = series[-MOVING_AVERAGE_DAYS:]
+    average = sum(window) / len(window)
+    factors = [1.0] * 7
+    overall = sum(series) / len(series)
+    if len(series) >= SEASONAL_MIN_DAYS and overall > 0:
+        for weekday in range(7):
+            values = [v for i, v in enumerate(series) if (first_weekday + i) % 7 == weekday]
+            factors[weekday] = (sum(values) / len(values)) / overall
+    daily = [average * factors[(first_weekday + len(series) + d) % 7] for d in range(HORIZON_DAYS)]
+
+    def until(available):
+        if available <= 0:
+            return 0.0
+        used = 0.0
+        for d, value in enumerate(daily):
+            used += value
+            if used >= available:
+                return float(d + 1)
+        return math.inf
+
+    return until(stock), until(stock - reorder_level), max(0.0, sum(daily[:7]) + reorder_level - stock)
+
+
+def main(count: int = 2000):
+    today = date.today()
+    days = [today - timedelta(days=offset) for offset in range(HISTORY_DAYS, 0, -1)]
+    rows, stock, reorder_level = make_rows(count, days)
+    item_ids = [f"I{index}" for index in range(count)]
+
+    started = time.perf_counter()
+    matrix = usage_matrix(rows, item_ids, days)
+    daily = forecast_usage(matrix, days[0].weekday())
+    vector = np.stack([
+        days_until(daily, stock),
+        days_until(daily, stock - reorder_level),
+        suggested_reorder(daily, stock, reorder_level)
+    ], axis=1)
+    vector_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    series = {item_id: [0.0] * len(days) for item_id in item_ids}
+    positions = {day.isoformat(): i for i, day in enumerate(days)}
+    for row in rows:
+        series[row["item_id"]][positions[row["day"]]] += row["quantity"]
+    scalar = [
+        forecast_one(series[item_id], days[0].weekday(), stock[i], reorder_level[i])
+        for i, item_id in enumerate(item_ids)
+    ]
+    scalar_seconds = time.perf_counter() - started
+
+    mismatches = 0
+    for i, expected in enumerate(scalar):
+        if not np.allclose(vector[i], expected, rtol=1e-9, atol=1e-6):
+            mismatches += 1
+            print(f"❌ {item_ids[i]}: vectorized={vector[i].tolist()} loop={list(expected)}")
+
+    print(f"📊 {count} ingredients × {len(days)} days ({len(rows)} usage rows)")
+    print(f"   per-item loop: {scalar_seconds * 1000:8.1f} ms")
+    print(f"   vectorized:    {vector_seconds * 1000:8.1f} ms")
+    print("✅ Both paths agree" if not mismatches else f"❌ {mismatches} ingredients differ")
+    return mismatches == 0
+
+
+if __name__ == "__main__":
+    ok = main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,259 @@
+# services/customer_search.py
+"""
+Customer search for the POS type-ahead
+
+Every customer document carries normalized, indexed search fields:
+    phone_digits  "+91 98765-43210" → "9876543210"
+    name_tokens   "Rahul  K. Sharma" → ["rahul", "k", "sharma"]
+    email_lower
+
+An in-memory prefix trie over those fields answers type-ahead queries without
+touching the database; it is loaded once at startup and kept warm by
+customer create/update. When the index is not loaded the same query runs
+against Mongo as anchored (index-backed) prefix regexes, with the user input
+escaped. ranked=True uses the text index on name/email instead.
+
+Run the benchmark:  python -m services.customer_search_benchmark
+"""
+
+import re
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+SEARCH_PROJECTION = {"_id": 0, "customer_id": 1, "name": 1, "phone": 1, "email": 1, "status": 1}
+MIN_QUERY_LENGTH = 2
+
+_NON_DIGITS_RE = re.compile(r"\D+")
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def normalize_phone(phone: Optional[str]) -> str:
+    """Digits only, without the +91 / leading 0 of Indian numbers"""
+    digits = _NON_DIGITS_RE.sub("", phone or "")
+    if len(digits) == 12 and digits.startswith("91"):
+        return digits[2:]
+    if len(digits) == 11 and digits.startswith("0"):
+        return digits[1:]
+    return digits
+
+
+def name_tokens(name: Optional[str]) -> List[str]:
+    return _TOKEN_RE.findall((name or "").lower())
+
+
+def looks_like_phone(query: str) -> bool:
+    return _NON_DIGITS_RE.sub("", query) != "" and re.fullmatch(r"[+\d\s()-]+", query) is not None
+
+
+def search_fields(customer: Dict[str, Any]) -> Dict[str, Any]:
+    """Normalized fields to $set on a customer document whenever name/phone/email change"""
+    return {
+        "phone_digits": normalize_phone(customer.get("phone")),
+        "name_tokens": name_tokens(customer.get("name")),
+        "email_lower": (customer.get("email") or "").strip().lower()
+    }
+
+
+class PrefixTrie:
+    """Keys → ids; yields the ids of all keys starting with a prefix, shortest keys first"""
+
+    __slots__ = ("root",)
+
+    def __init__(self):
+        # node = [children dict, ids set]
+        self.root = [{}, set()]
+
+    def insert(self, key: str, item_id: str):
+        node = self.root
+        for char in key:
+            node = node[0].setdefault(char, [{}, set()])
+        node[1].add(item_id)
+
+    def remove(self, key: str, item_id: str):
+        path = [self.root]
+        for char in key:
+            child = path[-1][0].get(char)
+            if child is None:
+                return
+            path.append(child)
+        path[-1][1].discard(item_id)
+        # Prune empty branches
+        for depth in range(len(key), 0, -1):
+            node = path[depth]
+            if node[0] or node[1]:
+                break
+            del path[depth - 1][0][key[depth - 1]]
+
+    def iter_prefixed(self, prefix: str) -> Iterator[str]:
+        """Distinct ids under `prefix`, breadth first (exact key, then longer keys)"""
+        node = self.root
+        for char in prefix:
+            node = node[0].get(char)
+            if node is None:
+                return
+        seen: Set[str] = set()
+        level = [node]
+        while level:
+            next_level = []
+            for current in level:
+                for item_id in current[1]:
+                    if item_id not in seen:
+                        seen.add(item_id)
+                        yield item_id
+                next_level.extend(current[0].values())
+            level = next_level
+
+    def iter_prefixed_deep(self, prefix: str) -> Iterator[str]:
+        """Ids under `prefix` depth first - reaches the first hits fastest when all keys are long"""
+        node = self.root
+        for char in prefix:
+            node = node[0].get(char)
+            if node is None:
+                return
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            yield from current[1]
+            stack.extend(current[0].values())
+
+    def prefixed(self, prefix: str, limit: int) -> List[str]:
+        return list(islice(self.iter_prefixed(prefix), limit))
+
+
+class CustomerSearchIndex:
+    """Phone / name / email prefix tries over active customers"""
+
+    def __init__(self):
+        self.db = None
+        self.loaded = False
+        self._customers: Dict[str, Dict[str, Any]] = {}
+        self._phones = PrefixTrie()
+        self._words = PrefixTrie()
+
+    def __len__(self):
+        return len(self._customers)
+
+    async def init(self, db):
+        """Create indexes, backfill search fields on old documents and load the tries"""
+        self.db = db
+        try:
+            await self._prepare(db)
+            await self.load()
+        except Exception as e:
+            # Search keeps working from Mongo (prefix_query) without the tries
+            logger.error(f"❌ Customer search index not loaded: {e}")
+
+    async def _prepare(self, db):
+        await db.customers.create_index("customer_id")
+        await db.customers.create_index("phone_digits")
+        await db.customers.create_index("name_tokens")
+        await db.customers.create_index("email_lower")
+        try:
+            await db.customers.create_index([("name", "text"), ("email", "text")], name="customer_text")
+        except Exception as e:
+            logger.warning(f"⚠️ Customer text index not created: {e}")
+
+        backfilled = 0
+        async for customer in db.customers.find({"phone_digits": {"$exists": False}}, SEARCH_PROJECTION):
+            await db.customers.update_one(
+                {"customer_id": customer["customer_id"]},
+                {"$set": search_fields(customer)}
+            )
+            backfilled += 1
+        if backfilled:
+            logger.info(f"🔄 Backfilled search fields on {backfilled} customers")
+
+    async def load(self):
+        self._customers.clear()
+        self._phones = PrefixTrie()
+        self._words = PrefixTrie()
+        async for customer in self.db.customers.find({"status": "active"}, SEARCH_PROJECTION):
+            self.upsert(customer)
+        self.loaded = True
+        logger.info(f"✅ Customer search index: {len(self._customers)} active customers")
+
+    # ==================== INDEX MAINTENANCE ====================
+    def _keys(self, customer: Dict[str, Any]):
+        fields = search_fields(customer)
+        words = set(fields["name_tokens"])
+        if fields["email_lower"]:
+            words.add(fields["email_lower"])
+        return fields["phone_digits"], words
+
+    def upsert(self, customer: Dict[str, Any]):
+        """Call after a customer is created or updated (with the stored document)"""
+        customer_id = customer.get("customer_id")
+        if not customer_id:
+            return
+        self.remove(customer_id)
+        if customer.get("status", "active") != "active":
+            return
+        phone, words = self._keys(customer)
+        self._customers[customer_id] = {
+            **{k: customer.get(k) for k in ("customer_id", "name", "phone", "email")},
+            "words": tuple(words)
+        }
+        if phone:
+            self._phones.insert(phone, customer_id)
+        for word in words:
+            self._words.insert(word, customer_id)
+
+    def remove(self, customer_id: str):
+        old = self._customers.pop(customer_id, None)
+        if old is None:
+            return
+        phone, words = self._keys(old)
+        if phone:
+            self._phones.remove(phone, customer_id)
+        for word in words:
+            self._words.remove(word, customer_id)
+
+    # ==================== LOOKUP ====================
+    def search(self, query: str, limit: int = 10) -> List[str]:
+        """customer_ids matching a phone prefix, or every name token as a prefix"""
+        query = (query or "").strip().lower()
+        if looks_like_phone(query):
+            digits = normalize_phone(query)
+            if len(digits) < MIN_QUERY_LENGTH:
+                return []
+            # Phone numbers are all ~10 digits: depth first finds `limit` of them without a level sweep
+            return list(islice(self._phones.iter_prefixed_deep(digits), limit))
+
+        tokens = name_tokens(query) if "@" not in query else [query]
+        if not tokens or len("".join(tokens)) < MIN_QUERY_LENGTH:
+            return []
+
+        # Walk the most selective (longest) token; the others must prefix one of the customer's words
+        lead = max(tokens, key=len)
+        others = [token for token in tokens if token is not lead]
+        found: List[Tuple[int, str, str]] = []
+        for customer_id in self._words.iter_prefixed(lead):
+            customer = self._customers[customer_id]
+            words = customer["words"]
+            if all(any(word.startswith(token) for word in words) for token in others):
+                exact = sum(token in words for token in tokens)
+                found.append((-exact, (customer.get("name") or "").lower(), customer_id))
+                if len(found) >= limit * 2:
+                    break
+
+        # Whole-word hits before prefix-only hits, then by name
+        return [customer_id for _, _, customer_id in sorted(found)[:limit]]
+
+
+def prefix_query(query: str) -> Dict[str, Any]:
+    """Index-backed Mongo filter for the same search (anchored regexes, escaped input)"""
+    query = (query or "").strip().lower()
+    if looks_like_phone(query):
+        return {"phone_digits": {"$regex": "^" + re.escape(normalize_phone(query))}}
+    if "@" in query:
+        return {"email_lower": {"$regex": "^" + re.escape(query)}}
+    return {"$and": [
+        {"name_tokens": {"$regex": "^" + re.escape(token)}}
+        for token in name_tokens(query)
+    ] or [{"name_tokens": None}]}
+
+
+customer_search = CustomerSearchIndex()
@@ -0,0 +1,78 @@
+# services/customer_search_benchmark.py
+"""
+Benchmark for the customer type-ahead index
+
+Builds 100,000 synthetic customers, checks a few lookups and times index
+build and per-keystroke search.
+
+Run:  python -m services.customer_search_benchmark [customers]
+"""
+
+import random
+import sys
+import time
+
+from services.customer_search import CustomerSearchIndex
+
+FIRST = ["Rahul", "Priya", "Amit", "Sneha", "Vikram", "Anjali", "Rohan", "Pooja", "Arjun", "Neha",
+         "Karan", "Divya", "Sanjay", "Meera", "Aditya", "Kavya", "Manish", "Ritu", "Nikhil", "Shreya"]
+LAST = ["Sharma", "Verma", "Gupta", "Singh", "Kumar", "Patel", "Reddy", "Iyer", "Nair", "Joshi",
+        "Mehta", "Chopra", "Malhotra", "Bansal", "Agarwal", "Kapoor", "Das", "Rao", "Pillai", "Saxena"]
+
+
+def make_customers(size: int, seed: int = 5):
+    rng = random.Random(seed)
+    customers = []
+    for i in range(size):
+        first, last = rng.choice(FIRST), rng.choice(LAST)
+        customers.append({
+            "customer_id": f"CUST-{i:06d}",
+            "name": f"{first} {last}",
+            "phone": f"+91 9{rng.randrange(10**9):09d}",
+            "email": f"{first.lower()}.{last.lower()}{i}@example.com" if i % 3 == 0 else "",
+            "status": "active"
+        })
+    customers.append({"customer_id": "CUST-TARGET", "name": "Zubin Wadia", "phone": "98765-43210",
+                      "email": "zubin@example.com", "status": "active"})
+    return customers
+
+
+def main(size: int = 100000, rounds: int = 2000):
+    customers = make_customers(size)
+    index = CustomerSearchIndex()
+
+    started = time.perf_counter()
+    for customer in customers:
+        index.upsert(customer)
+    build_s = time.perf_counter() - started
+
+    expected = {"9876543": "CUST-TARGET", "+91 98765 43210": "CUST-TARGET", "zub": "CUST-TARGET",
+                "wadia zu": "CUST-TARGET", "zubin@ex": "CUST-TARGET"}
+    failures = 0
+    for query, customer_id in expected.items():
+        got = index.search(query)
+        if not got or got[0] != customer_id:
+            failures += 1
+            print(f"❌ '{query}' → {got[:3]} (expected {customer_id})")
+
+    index.upsert({**customers[-1], "name": "Zubin Mehta"})
+    if index.search("wadia"):
+        failures += 1
+        print("❌ renamed customer still found under the old name")
+
+    queries = ["ra", "rah", "rahul", "rahul sh", "98", "9876", "priya v", "kapoor", "mee", "nikhil das"]
+    started = time.perf_counter()
+    for i in range(rounds):
+        index.search(queries[i % len(queries)])
+    per_query_ms = (time.perf_counter() - started) / rounds * 1000
+
+    print(f"📊 {len(index)} customers")
+    print(f"   index build: {build_s:8.2f} s")
+    print(f"   search:      {per_query_ms:8.3f} ms/query")
+    print("✅ All lookups as expected" if not failures else f"❌ {failures} lookups wrong")
+    return failures == 0
+
+
+if __name__ == "__main__":
+    ok = main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
+    sys.exit(0 if ok else 1)
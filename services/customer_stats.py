@@ -0,0 +1,327 @@
+# services/customer_stats.py
+"""
+Incrementally maintained customer lifetime stats
+
+customers.order_history is updated with one atomic $inc per order event
+instead of being recomputed from the customer's whole order history:
+
+    placed     total_orders +1, last_order_date
+    paid       paid_orders +1, total_spent + final_amount (amount at payment time)
+    cancelled  reverses whatever was counted for the order
+    deleted    same as cancelled
+
+Loyalty points follow the same events: paid orders accrue and cancelled
+paid orders reverse through services/loyalty.py.
+
+Placement also bumps per-customer item counters in customer_item_counts
+(quantity ordered, number of orders containing the dish, last ordered) and
+refreshes order_history.favorite_items from them, which backs the POS
+"favorites" and "usual order" lookups.
+
+Each order records how far it has been counted in `customer_stats_state`
+(placed → paid → cancelled). Events move that state with a conditional
+update first, so a replayed or repeated event (outbox replay, a second
+"mark paid") never counts twice.
+
+rebuild() and rebuild_items() recompute everything from the orders
+collection with aggregations - for orders whose lines were edited after
+placement. init() runs both once when it finds customer orders without a
+state (placed before this bookkeeping), so their later payment or
+cancellation is counted - and earns or reverses loyalty points - like any
+other order's.
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+import logging
+
+from services.loyalty import loyalty
+
+logger = logging.getLogger(__name__)
+
+STATE_FIELD = "customer_stats_state"
+ORDER_PROJECTION = {
+    "_id": 0, "id": 1, "customer_id": 1, "final_amount": 1, "created_at": 1, "items": 1, STATE_FIELD: 1
+}
+ITEM_PROJECTION = {"_id": 0, "menu_item_id": 1, "menu_item_name": 1, "quantity": 1, "orders": 1, "last_ordered_at": 1}
+FAVORITES_SIZE = 5
+# A dish is part of the "usual order" when it is in at least this share of the customer's orders
+USUAL_ORDER_SHARE = 0.5
+
+
+def order_item_counts(items: Optional[List[Dict[str, Any]]]) -> Dict[str, Dict[str, Any]]:
+    """menuitemid → {name, quantity} for one order; custom (off-menu) lines are skipped"""
+    counts: Dict[str, Dict[str, Any]] = {}
+    for line in items or []:
+        item_id = line.get("menuitemid")
+        if not item_id or line.get("iscustomitem"):
+            continue
+        entry = counts.setdefault(item_id, {"name": line.get("menuitemname") or "", "quantity": 0})
+        entry["quantity"] += int(line.get("quantity") or 0)
+    return counts
+
+
+def with_average(customer: Dict[str, Any]) -> Dict[str, Any]:
+    """Fill order_history.average_order_value (spend per paid order) from the counters"""
+    history = customer.get("order_history") or {}
+    paid = history.get("paid_orders") or 0
+    history["average_order_value"] = round((history.get("total_spent") or 0) / paid, 2) if paid else 0.0
+    history["total_spent"] = round(history.get("total_spent") or 0, 2)
+    customer["order_history"] = history
+    return customer
+
+
+class CustomerStatsService:
+    """Order events → $inc on the customer's order_history"""
+
+    def __init__(self):
+        self.db = None
+
+    def set_db(self, db):
+        self.db = db
+        loyalty.set_db(db)
+
+    async def init(self, db):
+        """Indexes behind the profile's recent-orders query and the favorites lookups"""
+        self.db = db
+        await db.orders.create_index([("customer_id", 1), ("created_at", -1)])
+        await db.customer_item_counts.create_index([("customer_id", 1), ("menu_item_id", 1)], unique=True)
+        await db.customer_item_counts.create_index([("customer_id", 1), ("orders", -1), ("quantity", -1)])
+        await loyalty.init(db)
+        await self._backfill_states()
+
+    async def _backfill_states(self):
+        """One-time migration: give orders placed before the bookkeeping a state and recount"""
+        untracked = await self.db.orders.find_one(
+            {"customer_id": {"$nin": [None, ""]}, STATE_FIELD: {"$exists": False}}, {"_id": 1}
+        )
+        if untracked is None:
+            return
+        logger.info("🔄 Orders without customer stats state found, rebuilding customer stats")
+        await self.rebuild()
+        await self.rebuild_items()
+
+    async def _inc(self, customer_id: str, orders: int = 0, paid: int = 0, spent: float = 0.0,
+                   last_order_date: Optional[datetime] = None, session=None):
+        update: Dict[str, Any] = {"$inc": {
+            "order_history.total_orders": orders,
+            "order_history.paid_orders": paid,
+            "order_history.total_spent": round(spent, 2)
+        }}
+        if last_order_date is not None:
+            update["$max"] = {"order_history.last_order_date": last_order_date}
+        await self.db.customers.update_one({"customer_id": customer_id}, update, session=session)
+
+    # ==================== ORDER EVENTS ====================
+    async def on_placed(self, order: Dict[str, Any], session=None):
+        """Part of the placement unit of work (order_placement._apply) - safe to replay"""
+        if not order.get("customer_id"):
+            return
+        claimed = await self.db.orders.update_one(
+            {"id": order["id"], STATE_FIELD: {"$exists": False}},
+            {"$set": {STATE_FIELD: "placed"}},
+            session=session
+        )
+        if claimed.modified_count:
+            await self._inc(
+                order["customer_id"], orders=1, last_order_date=order.get("created_at"), session=session
+            )
+            await self._count_items(order, 1, session=session)
+
+    async def on_paid(self, order_id: str):
+        order = await self.db.orders.find_one_and_update(
+            {"id": order_id, "customer_id": {"$nin": [None, ""]}, STATE_FIELD: "placed"},
+            {"$set": {STATE_FIELD: "paid"}},
+            projection=ORDER_PROJECTION
+        )
+        if order is not None:
+            amount = float(order.get("final_amount") or 0)
+            await self._inc(order["customer_id"], paid=1, spent=amount)
+            await loyalty.accrue(order["customer_id"], order["id"], amount)
+
+    async def on_cancelled(self, order_id: str):
+        # Pre-image: what had been counted for this order
+        order = await self.db.orders.find_one_and_update(
+            {"id": order_id, STATE_FIELD: {"$in": ["placed", "paid"]}},
+            {"$set": {STATE_FIELD: "cancelled"}},
+            projection=ORDER_PROJECTION
+        )
+        if order is not None:
+            await self._reverse(order)
+
+    async def on_deleted(self, order: Optional[Dict[str, Any]]):
+        """Call with the deleted document (find_one_and_delete)"""
+        if order and order.get(STATE_FIELD) in ("placed", "paid"):
+            await self._reverse(order)
+
+    async def _reverse(self, order: Dict[str, Any]):
+        was_paid = order.get(STATE_FIELD) == "paid"
+        await self._inc(
+            order["customer_id"],
+            orders=-1,
+            paid=-1 if was_paid else 0,
+            spent=-float(order.get("final_amount") or 0) if was_paid else 0.0
+        )
+        await self._count_items(order, -1)
+        if was_paid:
+            await loyalty.reverse(order["customer_id"], order["id"])
+
+    # ==================== ITEM COUNTERS ====================
+    async def _count_items(self, order: Dict[str, Any], sign: int, session=None):
+        from pymongo import UpdateOne
+
+        counts = order_item_counts(order.get("items"))
+        if not counts:
+            return
+        customer_id = order["customer_id"]
+        writes = []
+        for item_id, entry in counts.items():
+            update: Dict[str, Any] = {"$inc": {"quantity": sign * entry["quantity"], "orders": sign}}
+            if sign > 0:
+                update["$set"] = {"menu_item_name": entry["name"]}
+                if order.get("created_at") is not None:
+                    update["$max"] = {"last_ordered_at": order["created_at"]}
+            writes.append(UpdateOne(
+                {"customer_id": customer_id, "menu_item_id": item_id}, update, upsert=sign > 0
+            ))
+        await self.db.customer_item_counts.bulk_write(writes, ordered=False, session=session)
+        await self._refresh_favorites(customer_id, session=session)
+
+    async def _refresh_favorites(self, customer_id: str, session=None):
+        top = await self.favorites(customer_id, FAVORITES_SIZE, session=session)
+        await self.db.customers.update_one(
+            {"customer_id": customer_id},
+            {"$set": {"order_history.favorite_items": [item["menu_item_name"] for item in top]}},
+            session=session
+        )
+
+    async def favorites(self, customer_id: str, limit: int = 10, session=None) -> List[Dict[str, Any]]:
+        """Most frequently ordered dishes (by number of orders, then quantity)"""
+        return await self.db.customer_item_counts.find(
+            {"customer_id": customer_id, "orders": {"$gt": 0}}, ITEM_PROJECTION, session=session
+        ).sort([("orders", -1), ("quantity", -1)]).limit(limit).to_list(limit)
+
+    async def usual_order(self, customer_id: str, total_orders: int) -> List[Dict[str, Any]]:
+        """Dishes in at least USUAL_ORDER_SHARE of the customer's orders, with their typical quantity"""
+        if total_orders <= 0:
+            return []
+        usual = []
+        async for item in self.db.customer_item_counts.find(
+            {"customer_id": customer_id, "orders": {"$gte": max(1, USUAL_ORDER_SHARE * total_orders)}},
+            ITEM_PROJECTION
+        ).sort([("orders", -1), ("quantity", -1)]):
+            item["typical_quantity"] = max(1, round(item["quantity"] / item["orders"]))
+            usual.append(item)
+        return usual
+
+    # ==================== BULK REBUILD ====================
+    async def rebuild(self, customer_id: Optional[str] = None) -> int:
+        """Recompute order_history counters (and order states) from the orders collection"""
+        from pymongo import UpdateOne
+
+        scope: Dict[str, Any] = {"customer_id": customer_id} if customer_id else {"customer_id": {"$nin": [None, ""]}}
+        await self.db.orders.update_many({**scope, "status": "cancelled"}, {"$set": {STATE_FIELD: "cancelled"}})
+        await self.db.orders.update_many(
+            {**scope, "status": {"$ne": "cancelled"}, "payment_status": "paid"}, {"$set": {STATE_FIELD: "paid"}}
+        )
+        await self.db.orders.update_many(
+            {**scope, "status": {"$ne": "cancelled"}, "payment_status": {"$ne": "paid"}}, {"$set": {STATE_FIELD: "placed"}}
+        )
+
+        totals = await self.db.orders.aggregate([
+            {"$match": {**scope, "status": {"$ne": "cancelled"}}},
+            {"$group": {
+                "_id": "$customer_id",
+                "total_orders": {"$sum": 1},
+                "paid_orders": {"$sum": {"$cond": [{"$eq": ["$payment_status", "paid"]}, 1, 0]}},
+                "total_spent": {"$sum": {"$cond": [
+                    {"$eq": ["$payment_status", "paid"]}, {"$ifNull": ["$final_amount", 0]}, 0
+                ]}},
+                "last_order_date": {"$max": "$created_at"}
+            }}
+        ]).to_list(length=None)
+
+        writes = [
+            UpdateOne({"customer_id": row["_id"]}, {"$set": {
+                "order_history.total_orders": row["total_orders"],
+                "order_history.paid_orders": row["paid_orders"],
+                "order_history.total_spent": round(row["total_spent"], 2),
+                "order_history.last_order_date": row["last_order_date"]
+            }})
+            for row in totals
+        ]
+        if writes:
+            await self.db.customers.bulk_write(writes, ordered=False)
+
+        # Customers without any remaining orders
+        counted = [row["_id"] for row in totals]
+        await self.db.customers.update_many(
+            {"$and": [scope, {"customer_id": {"$nin": counted}}]},
+            {"$set": {
+                "order_history.total_orders": 0,
+                "order_history.paid_orders": 0,
+                "order_history.total_spent": 0.0
+            }}
+        )
+        logger.info(f"✅ Customer stats rebuilt for {len(totals)} customer(s)")
+        return len(totals)
+
+    async def rebuild_items(self, customer_id: Optional[str] = None) -> int:
+        """Recompute customer_item_counts and favorite_items from non-cancelled orders"""
+        from pymongo import UpdateOne
+
+        scope: Dict[str, Any] = {"customer_id": customer_id} if customer_id else {"customer_id": {"$nin": [None, ""]}}
+        await self.db.customer_item_counts.delete_many(scope)
+        await self.db.orders.aggregate([
+            {"$match": {**scope, "status": {"$ne": "cancelled"}}},
+            {"$unwind": "$items"},
+            {"$match": {"items.menuitemid": {"$nin": [None, ""]}, "items.iscustomitem": {"$ne": True}}},
+            # Per order first, so `orders` counts orders containing the dish
+            {"$group": {
+                "_id": {"customer_id": "$customer_id", "menu_item_id": "$items.menuitemid", "order": "$id"},
+                "menu_item_name": {"$last": "$items.menuitemname"},
+                "quantity": {"$sum": "$items.quantity"},
+                "created_at": {"$max": "$created_at"}
+            }},
+            {"$group": {
+                "_id": {"customer_id": "$_id.customer_id", "menu_item_id": "$_id.menu_item_id"},
+                "menu_item_name": {"$last": "$menu_item_name"},
+                "quantity": {"$sum": "$quantity"},
+                "orders": {"$sum": 1},
+                "last_ordered_at": {"$max": "$created_at"}
+            }},
+            {"$project": {
+                "_id": 0,
+                "customer_id": "$_id.customer_id",
+                "menu_item_id": "$_id.menu_item_id",
+                "menu_item_name": 1, "quantity": 1, "orders": 1, "last_ordered_at": 1
+            }},
+            {"$merge": {
+                "into": "customer_item_counts",
+                "on": ["customer_id", "menu_item_id"],
+                "whenMatched": "replace",
+                "whenNotMatched": "insert"
+            }}
+        ]).to_list(length=None)
+
+        top = await self.db.customer_item_counts.aggregate([
+            {"$match": scope},
+            {"$sort": {"customer_id": 1, "orders": -1, "quantity": -1}},
+            {"$group": {"_id": "$customer_id", "names": {"$push": "$menu_item_name"}}},
+            {"$project": {"names": {"$slice": ["$names", FAVORITES_SIZE]}}}
+        ]).to_list(length=None)
+        writes = [
+            UpdateOne({"customer_id": row["_id"]}, {"$set": {"order_history.favorite_items": row["names"]}})
+            for row in top
+        ]
+        if writes:
+            await self.db.customers.bulk_write(writes, ordered=False)
+        await self.db.customers.update_many(
+            {"$and": [scope, {"customer_id": {"$nin": [row["_id"] for row in top]}}]},
+            {"$set": {"order_history.favorite_items": []}}
+        )
+        logger.info(f"✅ Favorite items rebuilt for {len(top)} customer(s)")
+        return len(top)
+
+
+customer_stats = CustomerStatsService()
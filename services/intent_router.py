@@ -0,0 +1,160 @@
+# services/intent_router.py
+"""
+Precompiled intent classifier for chatbot messages
+
+All keyword phrases of all intents are compiled once, at import, into a
+single word-bounded regex (longest phrase first), so a message is scanned
+once no matter how many keywords there are. Each hit adds its weight to its
+intent; the caller can add evidence that the message names menu items
+(item_hint), which is what stops "show me 2 butter chicken" or "what about
+3 naan" from being routed to the menu. When the message also says "remove"
+or "delete", that evidence goes to remove_items instead of add_items, so
+"can you remove the naan" takes the dish out rather than adding it; without
+a dish the same words still mean cancel.
+
+Run the fixtures and a timing:  python -m services.intent_router
+"""
+
+import re
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+DEFAULT_INTENT = "help"
+
+# Ties are broken in this order (the order the old if/elif chain checked them)
+INTENT_PRIORITY = ["show_menu", "remove_items", "add_items", "confirm_order", "cancel", "show_cart"]
+
+INTENT_PHRASES = {
+    "show_menu": {
+        "menu": 2.0, "show menu": 3.0, "see menu": 3.0, "what do you have": 3.0, "what's available": 3.0,
+        "available": 1.0, "list": 1.0, "show": 0.6, "what": 0.3, "options": 1.0,
+    },
+    "add_items": {
+        "want": 1.5, "order": 1.0, "add": 2.0, "get": 1.0, "give": 1.5, "need": 1.5, "can i have": 2.5,
+        "like": 0.8, "i'll have": 2.5, "ill have": 2.5, "chahiye": 2.0, "dena": 1.5, "bring": 1.5,
+    },
+    "confirm_order": {
+        "confirm": 3.0, "done": 2.0, "finish": 2.0, "complete": 1.5, "place": 1.0, "place order": 3.0,
+        "place my order": 3.0, "submit": 2.0, "yes": 1.5, "correct": 1.5, "that's all": 2.5, "thats all": 2.5,
+    },
+    "cancel": {
+        "cancel": 3.0, "clear": 2.0, "remove": 1.5, "delete": 2.0, "start over": 3.0, "reset": 3.0,
+        "forget it": 3.0, "stop": 2.0,
+    },
+    "show_cart": {
+        "cart": 3.0, "current": 1.0, "summary": 2.0, "total": 2.0, "bill": 2.0, "my order": 2.5,
+    },
+}
+
+# Weight of "the message names menu items" evidence for add_items
+ITEM_HINT_WEIGHT = 2.0
+QUANTITY_WEIGHT = 0.5
+# Words that turn named menu items into a removal (their cancel weight counts towards remove_items)
+REMOVAL_PHRASES = {"remove", "delete"}
+
+_PHRASE_TABLE: Dict[str, List[tuple]] = {}
+for _intent, _phrases in INTENT_PHRASES.items():
+    for _phrase, _weight in _phrases.items():
+        _PHRASE_TABLE.setdefault(_phrase, []).append((_intent, _weight))
+
+_INTENT_RE = re.compile(
+    r"\b(?:" + "|".join(re.escape(p) for p in sorted(_PHRASE_TABLE, key=len, reverse=True)) + r")\b"
+)
+_QUANTITY_RE = re.compile(r"\b\d+\b")
+_SPACES_RE = re.compile(r"\s+")
+
+
+def normalize(message: str) -> str:
+    return _SPACES_RE.sub(" ", (message or "").lower().replace("’", "'")).strip()
+
+
+def classify(message: str, item_hint: float = 0.0) -> Dict[str, Any]:
+    """
+    Score every intent for one message.
+    item_hint: 0..1 evidence that the message names menu items (e.g. 1 if the
+    utterance parser resolved at least one item).
+    Returns {"intent", "score", "scores", "matches"}.
+    """
+    text = normalize(message)
+    scores: Dict[str, float] = {}
+    matches: List[str] = []
+
+    for hit in _INTENT_RE.finditer(text):
+        phrase = hit.group(0)
+        matches.append(phrase)
+        for intent, weight in _PHRASE_TABLE[phrase]:
+            scores[intent] = scores.get(intent, 0.0) + weight
+
+    if item_hint:
+        removal = [phrase for phrase in matches if phrase in REMOVAL_PHRASES]
+        target = "remove_items" if removal else "add_items"
+        scores[target] = scores.get(target, 0.0) + ITEM_HINT_WEIGHT * item_hint
+        if _QUANTITY_RE.search(text):
+            scores[target] += QUANTITY_WEIGHT
+        for phrase in removal:
+            scores[target] += INTENT_PHRASES["cancel"][phrase]
+
+    if not scores:
+        return {"intent": DEFAULT_INTENT, "score": 0.0, "scores": {}, "matches": matches}
+
+    best = max(INTENT_PRIORITY, key=lambda intent: (scores.get(intent, 0.0), -INTENT_PRIORITY.index(intent)))
+    return {"intent": best, "score": scores[best], "scores": scores, "matches": matches}
+
+
+def classify_many(messages: Iterable[str], item_hints: Optional[Iterable[float]] = None) -> List[Dict[str, Any]]:
+    """Batch classification, e.g. to re-score logged conversations offline"""
+    messages = list(messages)
+    hints = list(item_hints) if item_hints is not None else [0.0] * len(messages)
+    return [classify(message, hint) for message, hint in zip(messages, hints)]
+
+
+# ==================== FIXTURES ====================
+# (message, item_hint, expected intent)
+FIXTURES = [
+    ("show menu", 0, "show_menu"),
+    ("what do you have", 0, "show_menu"),
+    ("menu please", 0, "show_menu"),
+    ("I want 2 butter chicken", 1, "add_items"),
+    ("show me 2 butter chicken", 1, "add_items"),
+    ("what about 3 garlic naan", 1, "add_items"),
+    ("2 butter chicken and 3 naan", 1, "add_items"),
+    ("can i have a lassi", 1, "add_items"),
+    ("ek masala chai chahiye", 1, "add_items"),
+    ("confirm", 0, "confirm_order"),
+    ("yes place my order", 0, "confirm_order"),
+    ("that's all", 0, "confirm_order"),
+    ("cancel", 0, "cancel"),
+    ("i want to cancel", 0, "cancel"),
+    ("start over", 0, "cancel"),
+    ("remove everything", 0, "cancel"),
+    ("can you remove the naan", 1, "remove_items"),
+    ("delete 2 lassi", 1, "remove_items"),
+    ("what is in my cart", 0, "show_cart"),
+    ("show my order", 0, "show_cart"),
+    ("what's the total", 0, "show_cart"),
+    ("hello", 0, "help"),
+]
+
+
+def check_fixtures() -> List[str]:
+    """Messages whose intent differs from the fixture; empty when all pass"""
+    results = classify_many([m for m, _, _ in FIXTURES], [h for _, h, _ in FIXTURES])
+    return [
+        f"'{message}': got {result['intent']} {result['scores']}, expected {expected}"
+        for (message, _, expected), result in zip(FIXTURES, results)
+        if result["intent"] != expected
+    ]
+
+
+if __name__ == "__main__":
+    failures = check_fixtures()
+    for failure in failures:
+        print(f"❌ {failure}")
+
+    batch = [m for m, _, _ in FIXTURES] * 5000
+    started = time.perf_counter()
+    classify_many(batch)
+    elapsed = time.perf_counter() - started
+    print(f"📊 {len(batch)} messages in {elapsed * 1000:.1f} ms ({elapsed / len(batch) * 1e6:.2f} µs/message)")
+    print("✅ All fixtures pass" if not failures else f"❌ {len(failures)} fixtures failed")
+    raise SystemExit(1 if failures else 0)
@@ -0,0 +1,156 @@
+# services/inventory_snapshot.py
+"""
+In-memory inventory table for the read API
+
+The inventory screens, low-stock alerts and the dashboard used to load and
+format every inventory document on each request. The snapshot keeps the
+item table in memory - each item already formatted for the API - together
+with the indexes and totals those screens ask for:
+
+    by status / category   id sets   → filtered lists in O(k)
+    low stock              id set    → alerts in O(k)
+    stock value            running sum per status → O(1)
+
+It is loaded at startup and kept current by every inventory write: order
+deductions (after their transaction commits), Excel import, create / edit /
+delete. Until it is loaded, the routes answer from Mongo as before.
+
+Reads return items in _id order (creation order), the order the Mongo
+queries they replace returned them in; ObjectId hex strings sort the same
+way as the ObjectIds.
+"""
+
+from collections import defaultdict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def stock_value(item: Dict[str, Any]) -> float:
+    return (item.get("current_stock") or 0) * (item.get("unit_cost") or 0)
+
+
+def is_low_stock(item: Dict[str, Any]) -> bool:
+    return (item.get("current_stock") or 0) <= (item.get("reorder_level") or 0)
+
+
+class InventorySnapshot:
+    """Inventory items by id, with status / category / low-stock indexes and value totals"""
+
+    def __init__(self, format_item: Callable[[Dict[str, Any]], Dict[str, Any]]):
+        self.format_item = format_item
+        self.loaded = False
+        self._docs: Dict[str, Dict[str, Any]] = {}
+        self._rows: Dict[str, Dict[str, Any]] = {}
+        self._by_status: Dict[str, Set[str]] = defaultdict(set)
+        self._by_category: Dict[str, Set[str]] = defaultdict(set)
+        self._low_stock: Set[str] = set()
+        self._value: Dict[str, float] = defaultdict(float)
+
+    def __len__(self):
+        return len(self._docs)
+
+    async def load(self, db):
+        self._clear()
+        async for doc in db.inventory_items.find({}):
+            self.upsert(doc)
+        self.loaded = True
+        logger.info(f"✅ Inventory snapshot: {len(self._docs)} items, {len(self._low_stock)} low on stock")
+
+    def _clear(self):
+        self._docs.clear()
+        self._rows.clear()
+        self._by_status.clear()
+        self._by_category.clear()
+        self._low_stock.clear()
+        self._value.clear()
+
+    # ==================== MAINTENANCE ====================
+    def upsert(self, doc: Dict[str, Any]):
+        """Add or replace an item from its stored document (needs _id)"""
+        item_id = str(doc["_id"])
+        self.discard(item_id)
+        doc = dict(doc)
+        status = doc.get("status", "active")
+        self._docs[item_id] = doc
+        self._rows[item_id] = self.format_item(doc)
+        self._by_status[status].add(item_id)
+        self._by_category[doc.get("category") or ""].add(item_id)
+        if is_low_stock(doc):
+            self._low_stock.add(item_id)
+        self._value[status] += stock_value(doc)
+
+    def update(self, item_id: str, changes: Dict[str, Any]):
+        """Apply a $set that was just written to Mongo"""
+        doc = self._docs.get(item_id)
+        if doc is not None:
+            self.upsert({**doc, **changes})
+
+    def apply_stock_updates(self, stock: Dict[str, float], last_updated=None):
+        """item_id → new current_stock, e.g. the stock_updates of an inventory deduction"""
+        for item_id, new_stock in stock.items():
+            changes: Dict[str, Any] = {"current_stock": new_stock}
+            if last_updated is not None:
+                changes["last_updated"] = last_updated
+            self.update(item_id, changes)
+
+    def discard(self, item_id: str):
+        doc = self._docs.pop(item_id, None)
+        if doc is None:
+            return
+        status = doc.get("status", "active")
+        self._rows.pop(item_id, None)
+        self._by_status[status].discard(item_id)
+        self._by_category[doc.get("category") or ""].discard(item_id)
+        self._low_stock.discard(item_id)
+        self._value[status] -= stock_value(doc)
+
+    # ==================== READS ====================
+    def get(self, item_id: str) -> Optional[Dict[str, Any]]:
+        return self._rows.get(item_id)
+
+    def rows(
+        self,
+        status: Optional[str] = "active",
+        category: Optional[str] = None,
+        low_stock_only: bool = False
+    ) -> List[Dict[str, Any]]:
+        """Formatted items matching the filters; walks only the smallest matching id set"""
+        candidates: List[Iterable[str]] = []
+        if low_stock_only:
+            candidates.append(self._low_stock)
+        if category is not None:
+            candidates.append(self._by_category.get(category, ()))
+        if status:
+            candidates.append(self._by_status.get(status, ()))
+        if not candidates:
+            candidates.append(self._docs.keys())
+
+        smallest = min(candidates, key=len)
+        return [
+            self._rows[item_id]
+            for item_id in sorted(smallest)
+            if (not status or self._docs[item_id].get("status", "active") == status)
+            and (category is None or (self._docs[item_id].get("category") or "") == category)
+            and (not low_stock_only or item_id in self._low_stock)
+        ]
+
+    def docs(self, status: str = "active") -> List[Dict[str, Any]]:
+        return [self._docs[item_id] for item_id in sorted(self._by_status.get(status, ()))]
+
+    def low_stock_docs(self, status: str = "active") -> List[Dict[str, Any]]:
+        return [
+            self._docs[item_id]
+            for item_id in sorted(self._low_stock)
+            if self._docs[item_id].get("status", "active") == status
+        ]
+
+    def count(self, status: str = "active") -> int:
+        return len(self._by_status.get(status, ()))
+
+    def low_stock_count(self, status: str = "active") -> int:
+        return len(self._low_stock & self._by_status.get(status, set()))
+
+    def total_value(self, status: str = "active") -> float:
+        return round(self._value.get(status, 0.0), 2)
@@ -0,0 +1,160 @@
+# services/loyalty.py
+"""
+Loyalty points ledger
+
+Every change to a customer's points is an entry in the append-only
+loyalty_ledger collection; customers.loyalty_points is the running balance,
+moved with $inc alongside each entry.
+
+    accrual     on payment      +floor(final_amount / LOYALTY_RUPEES_PER_POINT)
+    reversal    on cancellation of a paid order, minus what it accrued
+    adjustment  manual correction by staff
+
+Accruals and reversals are keyed by (order_id, type) under a unique index,
+so a replayed payment or cancel event cannot post twice. reconcile() - run
+nightly - sums the ledger per customer in one $group, compares the sums
+with the balances and resets the ones that drifted (e.g. a crash between
+entry and $inc).
+
+Orders placed before the ledger get a customer_stats_state in the same
+startup backfill as the customer counters (customer_stats.init), so they
+accrue when paid after the upgrade. Points the old code granted at
+placement are already in the opening balances.
+"""
+
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+import logging
+import os
+import uuid
+
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+RUPEES_PER_POINT = float(os.getenv("LOYALTY_RUPEES_PER_POINT", "10"))
+LEDGER_PROJECTION = {"_id": 0, "id": 1, "order_id": 1, "type": 1, "points": 1, "reason": 1, "created_at": 1}
+
+
+def points_for(amount: float) -> int:
+    return int((amount or 0) // RUPEES_PER_POINT) if RUPEES_PER_POINT > 0 else 0
+
+
+class LoyaltyLedger:
+    """Append-only points ledger with an $inc-maintained balance on the customer"""
+
+    def __init__(self):
+        self.db = None
+
+    def set_db(self, db):
+        self.db = db
+
+    async def init(self, db):
+        self.db = db
+        await db.loyalty_ledger.create_index([("customer_id", 1), ("created_at", -1)])
+        await db.loyalty_ledger.create_index(
+            [("order_id", 1), ("type", 1)],
+            unique=True,
+            partialFilterExpression={"type": {"$in": ["accrual", "reversal"]}}
+        )
+        await self._open_balances()
+
+    async def _open_balances(self):
+        """First run: record balances earned before the ledger existed as opening entries"""
+        if await self.db.loyalty_ledger.estimated_document_count() > 0:
+            return
+        now = datetime.now(timezone.utc)
+        opening = [
+            {
+                "id": str(uuid.uuid4()),
+                "customer_id": customer["customer_id"],
+                "order_id": None,
+                "type": "adjustment",
+                "points": customer["loyalty_points"],
+                "reason": "Opening balance",
+                "created_at": now
+            }
+            async for customer in self.db.customers.find(
+                {"loyalty_points": {"$ne": 0, "$exists": True}}, {"_id": 0, "customer_id": 1, "loyalty_points": 1}
+            )
+        ]
+        if opening:
+            await self.db.loyalty_ledger.insert_many(opening, ordered=False)
+            logger.info(f"🔄 Loyalty ledger opened with {len(opening)} existing balance(s)")
+
+    async def _post(self, customer_id: str, points: int, entry_type: str,
+                    order_id: Optional[str] = None, reason: str = "") -> Optional[Dict[str, Any]]:
+        """Append one entry and move the balance; None if this order event was already posted"""
+        entry = {
+            "id": str(uuid.uuid4()),
+            "customer_id": customer_id,
+            "order_id": order_id,
+            "type": entry_type,
+            "points": points,
+            "reason": reason,
+            "created_at": datetime.now(timezone.utc)
+        }
+        try:
+            await self.db.loyalty_ledger.insert_one(entry)
+        except DuplicateKeyError:
+            return None
+        await self.db.customers.update_one({"customer_id": customer_id}, {"$inc": {"loyalty_points": points}})
+        entry.pop("_id", None)
+        return entry
+
+    # ==================== ORDER EVENTS ====================
+    async def accrue(self, customer_id: str, order_id: str, amount: float):
+        points = points_for(amount)
+        if points > 0:
+            await self._post(customer_id, points, "accrual", order_id, f"Payment of ₹{amount:.2f}")
+
+    async def reverse(self, customer_id: str, order_id: str):
+        """Take back what a (now cancelled) order accrued"""
+        accrual = await self.db.loyalty_ledger.find_one(
+            {"order_id": order_id, "type": "accrual"}, {"_id": 0, "points": 1}
+        )
+        if accrual and accrual.get("points"):
+            await self._post(customer_id, -accrual["points"], "reversal", order_id, "Order cancelled")
+
+    async def adjust(self, customer_id: str, points: int, reason: str) -> Dict[str, Any]:
+        return await self._post(customer_id, points, "adjustment", reason=reason)
+
+    async def history(self, customer_id: str, limit: int = 50) -> List[Dict[str, Any]]:
+        return await self.db.loyalty_ledger.find(
+            {"customer_id": customer_id}, LEDGER_PROJECTION
+        ).sort("created_at", -1).limit(limit).to_list(limit)
+
+    # ==================== NIGHTLY RECONCILE ====================
+    async def reconcile(self) -> int:
+        """
+        Reset every balance that differs from its ledger sum; returns how many
+        were fixed. One $group over the ledger (a single scan, no per-customer
+        lookup), then one pass over the customers' balances.
+        """
+        from pymongo import UpdateOne
+
+        ledger = {
+            row["_id"]: row["points"]
+            async for row in self.db.loyalty_ledger.aggregate([
+                {"$group": {"_id": "$customer_id", "points": {"$sum": "$points"}}}
+            ])
+        }
+        drifted = []
+        async for customer in self.db.customers.find(
+            {"customer_id": {"$nin": [None, ""]}}, {"_id": 0, "customer_id": 1, "loyalty_points": 1}
+        ):
+            ledger_points = ledger.get(customer["customer_id"], 0)
+            if (customer.get("loyalty_points") or 0) != ledger_points:
+                drifted.append({"customer_id": customer["customer_id"], "ledger_points": ledger_points})
+
+        if drifted:
+            await self.db.customers.bulk_write([
+                UpdateOne({"customer_id": row["customer_id"]}, {"$set": {"loyalty_points": row["ledger_points"]}})
+                for row in drifted
+            ], ordered=False)
+            logger.warning(f"⚠️ Loyalty reconcile corrected {len(drifted)} balance(s)")
+        else:
+            logger.info("✅ Loyalty balances match the ledger")
+        return len(drifted)
+
+loyalty = LoyaltyLedger()
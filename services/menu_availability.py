@@ -0,0 +1,209 @@
+# services/menu_availability.py
+"""
+Menu availability from ingredient stock
+
+Keeps each dish's recipe (in base units) and the reverse index
+
+    ingredient_id → {menu item ids that use it}
+
+so that after a batch of stock changes - an order deduction, a delivery,
+a manual edit - only the dishes touching those ingredients are recomputed:
+
+    portions = min over the recipe of floor(stock / quantity per portion)
+
+A dish that can no longer be made is switched off (is_available=False,
+unavailable_reason="out_of_stock"); it is switched back on once stock
+returns. Dishes staff turned off by hand have no such reason and are left
+alone. Flips are written in one bulk_write, invalidate the menu cache (so
+the chatbot stops offering the dish) and are broadcast to POS screens.
+
+Ingredients missing from inventory, inactive, or with a unit that does not
+match the recipe do not limit a dish - the deduction cannot take them
+either.
+"""
+
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+import logging
+import math
+
+from services.menu_cache import menu_cache
+
+logger = logging.getLogger(__name__)
+
+OUT_OF_STOCK = "out_of_stock"
+MENU_PROJECTION = {"_id": 1, "id": 1, "name": 1, "ingredients": 1, "is_available": 1, "unavailable_reason": 1}
+
+
+def menu_key(item: Dict[str, Any]) -> str:
+    """Menu items are addressed by 'id', older imports only by _id"""
+    return item.get("id") or str(item["_id"])
+
+
+class MenuAvailability:
+    """Ingredient → dishes index and per-dish portion counts"""
+
+    def __init__(self):
+        self.db = None
+        self.to_base: Optional[Callable[[float, str], Tuple[float, str]]] = None
+        self.broadcast: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None
+        self.loaded = False
+        self._recipes: Dict[str, List[Tuple[str, float, str]]] = {}
+        self._dishes_by_ingredient: Dict[str, Set[str]] = defaultdict(set)
+        self._stock: Dict[str, Tuple[float, str]] = {}
+        self._units: Dict[str, str] = {}
+        self._dishes: Dict[str, Dict[str, Any]] = {}
+        self._portions: Dict[str, Optional[int]] = {}
+
+    async def init(self, db, to_base: Callable[[float, str], Tuple[float, str]], broadcast=None):
+        """`to_base(quantity, unit)` → (quantity, base unit), e.g. the inventory module's normalize_to_base_unit"""
+        self.db = db
+        self.to_base = to_base
+        self.broadcast = broadcast
+        self._stock = {}
+        self._units = {}
+        async for item in db.inventory_items.find({"status": "active"}, {"unit": 1, "current_stock": 1}):
+            self._set_stock(str(item["_id"]), item.get("current_stock") or 0, item.get("unit") or "")
+        await self.reload_menu()
+        self.loaded = True
+
+    def _set_stock(self, item_id: str, current_stock: float, unit: str):
+        self._units[item_id] = unit
+        self._stock[item_id] = self.to_base(current_stock, unit)
+
+    async def reload_menu(self) -> List[Dict[str, Any]]:
+        """Rebuild recipes and the reverse index after menu writes; returns the flips applied"""
+        self._recipes.clear()
+        self._dishes_by_ingredient.clear()
+        self._dishes.clear()
+        self._portions.clear()
+        async for item in self.db.menu_items.find({}, MENU_PROJECTION):
+            key = menu_key(item)
+            recipe = []
+            for ingredient in item.get("ingredients") or []:
+                ingredient_id = ingredient.get("ingredient_id")
+                quantity = ingredient.get("quantity") or 0
+                if not ingredient_id or quantity <= 0:
+                    continue
+                required, base_unit = self.to_base(quantity, ingredient.get("unit") or "")
+                recipe.append((ingredient_id, required, base_unit))
+                self._dishes_by_ingredient[ingredient_id].add(key)
+            self._recipes[key] = recipe
+            self._dishes[key] = {
+                "filter": {"id": item["id"]} if item.get("id") else {"_id": item["_id"]},
+                "name": item.get("name"),
+                "is_available": item.get("is_available", True),
+                "unavailable_reason": item.get("unavailable_reason")
+            }
+        return await self._recompute(self._recipes.keys())
+
+    # ==================== STOCK EVENTS ====================
+    async def on_stock_change(self, stock: Dict[str, float], units: Optional[Dict[str, str]] = None) -> List[Dict[str, Any]]:
+        """
+        item_id → new current_stock (storage unit) for items whose stock just
+        changed; `units` only for items not seen before. Recomputes the dishes
+        using them.
+        """
+        if not self.loaded or not stock:
+            return []
+        affected: Set[str] = set()
+        for item_id, current_stock in stock.items():
+            unit = (units or {}).get(item_id) or self._units.get(item_id)
+            if unit is None:
+                continue
+            self._set_stock(item_id, current_stock, unit)
+            affected |= self._dishes_by_ingredient.get(item_id, set())
+        return await self._recompute(affected)
+
+    async def on_item_removed(self, item_id: str) -> List[Dict[str, Any]]:
+        """An inventory item was deactivated - it no longer limits any dish"""
+        if not self.loaded:
+            return []
+        self._stock.pop(item_id, None)
+        self._units.pop(item_id, None)
+        return await self._recompute(self._dishes_by_ingredient.get(item_id, set()))
+
+    # ==================== PORTIONS ====================
+    def portions(self, key: str) -> Optional[int]:
+        """Portions the current stock allows (None: nothing in the recipe is tracked)"""
+        limit = None
+        for ingredient_id, required, base_unit in self._recipes.get(key, ()):
+            stock = self._stock.get(ingredient_id)
+            if stock is None or stock[1] != base_unit:
+                continue
+            possible = max(math.floor(stock[0] / required + 1e-9), 0)
+            limit = possible if limit is None else min(limit, possible)
+        return limit
+
+    async def _recompute(self, keys: Iterable[str]) -> List[Dict[str, Any]]:
+        flips = []
+        for key in list(keys):
+            portions = self.portions(key)
+            self._portions[key] = portions
+            dish = self._dishes.get(key)
+            if dish is None:
+                continue
+            if dish["is_available"] and portions == 0:
+                flips.append((key, False, OUT_OF_STOCK))
+            elif not dish["is_available"] and dish["unavailable_reason"] == OUT_OF_STOCK and portions != 0:
+                flips.append((key, True, None))
+        if not flips:
+            return []
+        return await self._apply(flips)
+
+    async def _apply(self, flips: List[Tuple[str, bool, Optional[str]]]) -> List[Dict[str, Any]]:
+        from pymongo import UpdateOne
+
+        now = datetime.now(timezone.utc)
+        await self.db.menu_items.bulk_write([
+            UpdateOne(self._dishes[key]["filter"], {"$set": {
+                "is_available": available,
+                "unavailable_reason": reason,
+                "availability_changed_at": now
+            }})
+            for key, available, reason in flips
+        ], ordered=False)
+
+        changes = []
+        for key, available, reason in flips:
+            dish = self._dishes[key]
+            dish["is_available"] = available
+            dish["unavailable_reason"] = reason
+            changes.append({
+                "menu_item_id": key,
+                "name": dish["name"],
+                "is_available": available,
+                "portions_available": self._portions.get(key)
+            })
+
+        menu_cache.invalidate("stock availability changed")
+        names = ", ".join(f"{c['name']} {'on' if c['is_available'] else 'off'}" for c in changes)
+        logger.info(f"🍽️ Menu availability: {names}")
+        if self.broadcast:
+            try:
+                await self.broadcast({
+                    "type": "menu_availability",
+                    "changes": changes,
+                    "timestamp": now.isoformat()
+                })
+            except Exception as e:
+                logger.error(f"❌ Menu availability broadcast failed: {e}")
+        return changes
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """Every dish with its portion count, fewest first (untracked dishes last)"""
+        rows = [
+            {
+                "menu_item_id": key,
+                "name": dish["name"],
+                "is_available": dish["is_available"],
+                "unavailable_reason": dish["unavailable_reason"],
+                "portions_available": self._portions.get(key)
+            }
+            for key, dish in self._dishes.items()
+        ]
+        return sorted(rows, key=lambda r: (r["portions_available"] is None, r["portions_available"] or 0))
+
+
+menu_availability = MenuAvailability()
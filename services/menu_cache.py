@@ -0,0 +1,185 @@
+# services/menu_cache.py
+"""
+Versioned in-memory menu cache
+
+Every menu write calls invalidate(), which bumps the version. Readers get
+the cached item list, the fuzzy matcher and the rendered chatbot menu for
+the current version; all are rebuilt lazily, once per version, instead of
+on every chatbot message.
+"""
+
+import asyncio
+import math
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+
+from services.menu_matcher import MenuMatcher, tokenize
+
+logger = logging.getLogger(__name__)
+
+MENU_PROJECTION = {
+    "id": 1, "name": 1, "price": 1, "category": 1, "description": 1,
+    "food_type": 1, "foodtype": 1, "is_available": 1, "preparation_time": 1
+}
+
+
+MENU_FOOTER = "💬 Type what you'd like to order!\nExample: 'I want 2 butter chicken' or 'add paneer tikka'"
+RENDER_CACHE_SIZE = 256
+
+
+def orderable(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Items the chatbot may offer - switched-off dishes (e.g. out of stock) are left out"""
+    return [item for item in items if item.get("is_available", True) is not False]
+
+
+def chat_menu_item(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Menu item in the shape the chatbot UI expects"""
+    return {
+        'name': item.get('name', ''),
+        'price': float(item.get('price', 0)) if item.get('price') else 0,
+        'id': item['_id'],
+        'category': item.get('category') or 'General',
+        'foodtype': item.get('foodtype') or item.get('food_type', 'veg')
+    }
+
+
+def _category_key(token: str) -> str:
+    # "starters" / "starter", "curries" / "curry"
+    if token.endswith("ies") and len(token) > 4:
+        return token[:-3] + "y"
+    if token.endswith("s") and len(token) > 3:
+        return token[:-1]
+    return token
+
+
+class MenuRendering:
+    """Chatbot menu text and item list for one menu version, grouped by category"""
+
+    def __init__(self, items: List[Dict[str, Any]]):
+        self.items = [chat_menu_item(item) for item in items]
+
+        self.categories: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+        for item in self.items:
+            self.categories.setdefault(item['category'], []).append(item)
+
+        # Item lines and category headers are rendered once; variants only join them
+        self._lines = {
+            id(item): f"  {'🌱' if item.get('foodtype') == 'veg' else '🍖'} {item['name']}  - ₹{item['price']:.1f}\n"
+            for item in self.items
+        }
+        self._ordered = [item for group in self.categories.values() for item in group]
+
+        self._category_tokens: Dict[str, str] = {}
+        for category in self.categories:
+            for token in tokenize(category, drop_stopwords=False):
+                self._category_tokens.setdefault(_category_key(token), category)
+
+        self._variants: "OrderedDict[Tuple, Tuple[str, List[Dict[str, Any]]]]" = OrderedDict()
+
+    def find_category(self, message: str) -> Optional[str]:
+        """Category named in a message ("show starters" → "Starters"), if any"""
+        for token in tokenize(message):
+            category = self._category_tokens.get(_category_key(token))
+            if category:
+                return category
+        return None
+
+    def render(self, category: Optional[str] = None, page: int = 1, page_size: int = 0):
+        """
+        (menu text, items) for the whole menu or one category, optionally one page
+        of page_size items. Variants are memoized for this version.
+        """
+        key = (category, page, page_size)
+        cached = self._variants.get(key)
+        if cached is not None:
+            self._variants.move_to_end(key)
+            return cached
+
+        items = self.categories.get(category, []) if category else self._ordered
+        pages = max(math.ceil(len(items) / page_size), 1) if page_size else 1
+        page = min(max(page, 1), pages)
+        if page_size:
+            items = items[(page - 1) * page_size:page * page_size]
+
+        parts = ["📋 **Our Menu:**\n\n" if not category else f"📋 **{category}:**\n\n"]
+        current = None
+        for item in items:
+            if not category and item['category'] != current:
+                if current is not None:
+                    parts.append("\n")
+                current = item['category']
+                parts.append(f"**{current}:**\n")
+            parts.append(self._lines[id(item)])
+        parts.append("\n")
+        if pages > 1:
+            parts.append(f"📄 Page {page} of {pages}")
+            if page < pages:
+                parts.append(f" - say 'menu page {page + 1}' for more")
+            parts.append("\n\n")
+        parts.append(MENU_FOOTER)
+
+        rendered = ("".join(parts), items)
+        self._variants[key] = rendered
+        if len(self._variants) > RENDER_CACHE_SIZE:
+            self._variants.popitem(last=False)
+        return rendered
+
+
+class MenuCache:
+    """Menu items and their matcher, rebuilt only when the menu version changes"""
+
+    def __init__(self):
+        self.db = None
+        self.version = 0
+        self._items: Optional[List[Dict[str, Any]]] = None
+        self._items_version = -1
+        self._matcher: Optional[MenuMatcher] = None
+        self._matcher_version = -1
+        self._rendering: Optional[MenuRendering] = None
+        self._rendering_version = -1
+        self._lock = asyncio.Lock()
+
+    def set_db(self, db):
+        self.db = db
+        self.invalidate("database connected")
+
+    def invalidate(self, reason: str = ""):
+        """Call after any write to menu_items"""
+        self.version += 1
+        logger.info(f"🔄 Menu cache invalidated (v{self.version}){' - ' + reason if reason else ''}")
+
+    async def items(self) -> List[Dict[str, Any]]:
+        """Menu items as plain dicts ('_id' as a string) for the current version"""
+        if self._items is not None and self._items_version == self.version:
+            return self._items
+        async with self._lock:
+            if self._items is None or self._items_version != self.version:
+                version = self.version
+                items = []
+                async for item in self.db.menu_items.find({}, MENU_PROJECTION):
+                    item["_id"] = str(item.get("_id", ""))
+                    items.append(item)
+                self._items = items
+                self._items_version = version
+                logger.info(f"✅ Menu cache loaded: {len(items)} items (v{version})")
+        return self._items
+
+    async def matcher(self) -> MenuMatcher:
+        """Fuzzy matcher over the cached menu, built once per version"""
+        items = await self.items()
+        if self._matcher is None or self._matcher_version != self._items_version:
+            self._matcher = MenuMatcher(orderable(items))
+            self._matcher_version = self._items_version
+        return self._matcher
+
+    async def rendering(self) -> MenuRendering:
+        """Precomputed chatbot menu for the current version"""
+        items = await self.items()
+        if self._rendering is None or self._rendering_version != self._items_version:
+            self._rendering = MenuRendering(orderable(items))
+            self._rendering_version = self._items_version
+        return self._rendering
+
+
+menu_cache = MenuCache()
@@ -0,0 +1,211 @@
+# services/menu_matcher.py
+"""
+Indexed fuzzy matcher for menu item names
+
+Built once per menu version (see services/menu_cache.py) and then queried
+for every chatbot message:
+- Names and queries are normalized the same way: lowercase, punctuation
+  stripped, Hinglish spellings and synonyms folded onto one canonical token
+  (panir → paneer, murgh → chicken, chawal → rice ...)
+- A token inverted index finds the candidate items
+- Misspelt tokens ("panner", "biriyani") are mapped onto menu vocabulary by
+  character-trigram similarity
+- Candidates are ranked by IDF-weighted coverage of the query and of the
+  item name, so "paneer butter masala" ranks Paneer Butter Masala far above
+  Butter Naan
+"""
+
+import math
+import re
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+# Spelling variants / synonyms → canonical token (applied to menu names and queries)
+ALIASES = {
+    # dairy & protein
+    "panir": "paneer", "paner": "paneer", "panner": "paneer", "cottage": "paneer",
+    "murgh": "chicken", "murg": "chicken", "chiken": "chicken", "chikken": "chicken",
+    "gosht": "mutton", "lamb": "mutton", "goat": "mutton",
+    "machli": "fish", "machhli": "fish", "macchi": "fish",
+    "anda": "egg", "ande": "egg", "eggs": "egg",
+    "dahi": "curd", "yogurt": "curd", "yoghurt": "curd",
+    # vegetables
+    "aaloo": "aloo", "alu": "aloo", "potato": "aloo", "potatoes": "aloo",
+    "gobhi": "gobi", "cauliflower": "gobi",
+    "matar": "mutter", "mattar": "mutter", "peas": "mutter",
+    "spinach": "palak", "saag": "palak",
+    "okra": "bhindi", "brinjal": "baingan", "eggplant": "baingan",
+    "khumb": "mushroom", "mushrooms": "mushroom",
+    "pyaz": "onion", "pyaaz": "onion", "onions": "onion",
+    "chana": "chole", "channa": "chole", "chhole": "chole", "chickpea": "chole", "chickpeas": "chole",
+    # dishes & breads
+    "daal": "dal", "dhal": "dal", "dall": "dal",
+    "biriyani": "biryani", "briyani": "biryani", "biryaani": "biryani", "biriani": "biryani",
+    "pulav": "pulao", "pilaf": "pulao",
+    "nan": "naan", "naans": "naan",
+    "chapati": "roti", "chapatti": "roti", "phulka": "roti", "rotis": "roti",
+    "parantha": "paratha", "parotta": "paratha", "prantha": "paratha",
+    "chawal": "rice", "chaawal": "rice",
+    "makhni": "makhani", "makhanwala": "makhani",
+    "kadai": "kadhai", "karahi": "kadhai", "kadahi": "kadhai",
+    "cumin": "jeera", "zeera": "jeera",
+    "tika": "tikka",
+    "chai": "tea", "chaay": "tea",
+    "lasi": "lassi",
+    "coke": "cola", "pepsi": "cola",
+}
+
+# Words that carry no dish meaning in an order utterance
+STOPWORDS = {
+    "a", "an", "the", "and", "with", "of", "in", "for", "to", "me", "my", "i", "we", "us",
+    "please", "pls", "plz", "want", "wants", "add", "order", "get", "give", "need", "can",
+    "could", "would", "have", "like", "ll", "some", "also", "more", "one", "bhai", "bhaiya",
+    "chahiye", "dena", "do", "de", "aur", "ek", "plate", "plates", "x",
+}
+
+MIN_TOKEN_SIMILARITY = 0.45
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def canonical(token: str) -> str:
+    return ALIASES.get(token, token)
+
+
+def tokenize(text: str, drop_stopwords: bool = True) -> List[str]:
+    """Normalized, alias-folded tokens of a name or utterance"""
+    tokens = [canonical(t) for t in _TOKEN_RE.findall((text or "").lower())]
+    if drop_stopwords:
+        tokens = [t for t in tokens if t not in STOPWORDS and not t.isdigit()]
+    return tokens
+
+
+def trigrams(token: str) -> Set[str]:
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class MenuMatcher:
+    """Token + trigram index over a list of menu item dicts"""
+
+    def __init__(self, items: Iterable[Dict[str, Any]], name_key: str = "name"):
+        self.items: List[Dict[str, Any]] = list(items)
+        self.name_key = name_key
+
+        self._item_tokens: List[Set[str]] = []
+        self._item_names: List[str] = []
+        self._postings: Dict[str, List[int]] = {}
+        self._by_name: Dict[str, int] = {}
+
+        for index, item in enumerate(self.items):
+            name = str(item.get(name_key, "") or "")
+            tokens = set(tokenize(name, drop_stopwords=False)) - {"and", "with", "of", "the"}
+            self._item_tokens.append(tokens)
+            self._item_names.append(" ".join(tokenize(name, drop_stopwords=False)))
+            self._by_name.setdefault(self._item_names[-1], index)
+            for token in tokens:
+                self._postings.setdefault(token, []).append(index)
+
+        count = max(len(self.items), 1)
+        self._idf = {token: math.log(1 + count / len(posting)) for token, posting in self._postings.items()}
+        self._item_weight = [sum(self._idf[t] for t in tokens) or 1.0 for tokens in self._item_tokens]
+
+        # Trigram index over the vocabulary, for misspelt tokens
+        self._vocab_trigrams: Dict[str, Set[str]] = {token: trigrams(token) for token in self._postings}
+        self._trigram_vocab: Dict[str, List[str]] = {}
+        for token, grams in self._vocab_trigrams.items():
+            for gram in grams:
+                self._trigram_vocab.setdefault(gram, []).append(token)
+        self._fuzzy_cache: Dict[str, List[Tuple[str, float]]] = {}
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def vocabulary(self) -> Set[str]:
+        return set(self._postings)
+
+    # ==================== TOKEN RESOLUTION ====================
+    def resolve_token(self, token: str) -> List[Tuple[str, float]]:
+        """Menu vocabulary tokens a query token stands for, with similarity 0..1"""
+        if token in self._postings:
+            return [(token, 1.0)]
+        cached = self._fuzzy_cache.get(token)
+        if cached is not None:
+            return cached
+
+        grams = trigrams(token)
+        shared: Dict[str, int] = {}
+        for gram in grams:
+            for candidate in self._trigram_vocab.get(gram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+
+        matches = []
+        for candidate, common in shared.items():
+            similarity = common / (len(grams) + len(self._vocab_trigrams[candidate]) - common)
+            if similarity >= MIN_TOKEN_SIMILARITY:
+                matches.append((candidate, similarity))
+        matches.sort(key=lambda m: -m[1])
+        matches = matches[:3]
+
+        if len(self._fuzzy_cache) > 10000:
+            self._fuzzy_cache.clear()
+        self._fuzzy_cache[token] = matches
+        return matches
+
+    # ==================== SEARCH ====================
+    def search(self, query: str, limit: int = 5, min_score: float = 0.35) -> List[Tuple[float, Dict[str, Any]]]:
+        """Ranked (score, item) candidates for a free-text query, best first"""
+        return [(score, self.items[index]) for score, index in self._rank(tokenize(query), limit, min_score)]
+
+    def best(self, query: str, min_score: float = 0.5) -> Optional[Dict[str, Any]]:
+        ranked = self.search(query, limit=1, min_score=min_score)
+        return ranked[0][1] if ranked else None
+
+    def score_tokens(self, tokens: List[str], limit: int = 5, min_score: float = 0.35) -> List[Tuple[float, int]]:
+        """Like search() but on pre-tokenized input; returns (score, item index)"""
+        return self._rank(tokens, limit, min_score)
+
+    def _rank(self, tokens: List[str], limit: int, min_score: float) -> List[Tuple[float, int]]:
+        if not tokens or not self.items:
+            return []
+
+        # Exact full-name hit wins outright
+        exact = self._by_name.get(" ".join(tokens))
+        if exact is not None:
+            return [(1.1, exact)]
+
+        # query token → [(vocab token, similarity)], unknown tokens are ignored
+        resolved = []
+        for token in dict.fromkeys(tokens):
+            matches = self.resolve_token(token)
+            if matches:
+                resolved.append(matches)
+        if not resolved:
+            return []
+
+        query_weight = sum(max(self._idf[v] * s for v, s in matches) for matches in resolved)
+
+        # item → (covered query weight, covered item weight)
+        hits: Dict[int, List[float]] = {}
+        for matches in resolved:
+            best_for_item: Dict[int, Tuple[float, float]] = {}
+            for vocab_token, similarity in matches:
+                weight = self._idf[vocab_token]
+                for index in self._postings[vocab_token]:
+                    current = best_for_item.get(index)
+                    if current is None or weight * similarity > current[0]:
+                        best_for_item[index] = (weight * similarity, weight)
+            for index, (query_part, item_part) in best_for_item.items():
+                acc = hits.setdefault(index, [0.0, 0.0])
+                acc[0] += query_part
+                acc[1] += item_part
+
+        scored = []
+        for index, (covered_query, covered_item) in hits.items():
+            recall = covered_query / query_weight
+            precision = min(covered_item / self._item_weight[index], 1.0)
+            score = 0.6 * recall + 0.4 * precision
+            if score >= min_score:
+                scored.append((round(score, 4), index))
+
+        scored.sort(key=lambda s: (-s[0], len(self._item_tokens[s[1]]), s[1]))
+        return scored[:limit]
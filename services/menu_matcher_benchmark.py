@@ -0,0 +1,87 @@
+# services/menu_matcher_benchmark.py
+"""
+Micro-benchmark for the chatbot menu matcher
+
+Builds a synthetic 1,000-item menu, checks a few rankings that the old
+substring scan got wrong and times index build and per-query search.
+
+Run:  python -m services.menu_matcher_benchmark [items]
+"""
+
+import itertools
+import random
+import sys
+import time
+
+from services.menu_matcher import MenuMatcher
+
+BASES = ["Paneer", "Chicken", "Mutton", "Fish", "Egg", "Aloo", "Gobi", "Mushroom", "Dal", "Chole",
+         "Veg", "Prawn", "Soya", "Palak", "Bhindi", "Baingan", "Rajma", "Kadhi", "Malai", "Keema"]
+STYLES = ["Butter", "Tikka", "Kadhai", "Masala", "Makhani", "Do Pyaza", "Lababdar", "Handi", "Korma",
+          "Chettinad", "Afghani", "Achari", "Reshmi", "Tandoori", "Hyderabadi", "Lucknowi", "Jeera",
+          "Methi", "Kolhapuri", "Amritsari"]
+FORMS = ["Masala", "Curry", "Biryani", "Roll", "Fry", "Tikka", "Pulao", "Kebab"]
+FIXED = ["Paneer Butter Masala", "Butter Naan", "Butter Chicken", "Garlic Naan", "Jeera Rice", "Dal Makhani",
+         "Mutter Paneer", "Sweet Lassi", "Masala Chai", "Chicken Biryani", "Tandoori Roti", "Aloo Paratha"]
+
+# query → expected item name
+EXPECTED = {
+    "paneer butter masala": "Paneer Butter Masala",
+    "2 butter naan please": "Butter Naan",
+    "i want butter chicken": "Butter Chicken",
+    "murgh biriyani": "Chicken Biryani",
+    "daal makhni": "Dal Makhani",
+    "matar panir": "Mutter Paneer",
+    "ek masala chai": "Masala Chai",
+    "panner butter masla": "Paneer Butter Masala",
+}
+
+
+def make_menu(size: int, seed: int = 11):
+    rng = random.Random(seed)
+    names = list(FIXED)
+    seen = set(names)
+    for base, style, form in itertools.product(BASES, STYLES, FORMS):
+        name = f"{style} {base} {form}" if rng.random() < 0.5 else f"{base} {style} {form}"
+        if name not in seen and style != form:
+            seen.add(name)
+            names.append(name)
+    rng.shuffle(names)
+    names = names[:size]
+    for fixed in FIXED:
+        if fixed not in names:
+            names[rng.randrange(len(names))] = fixed
+    return [{"id": str(i), "name": name, "price": 100 + i % 300} for i, name in enumerate(names)]
+
+
+def main(size: int = 1000, rounds: int = 2000):
+    menu = make_menu(size)
+
+    started = time.perf_counter()
+    matcher = MenuMatcher(menu)
+    build_ms = (time.perf_counter() - started) * 1000
+
+    failures = 0
+    for query, expected in EXPECTED.items():
+        best = matcher.best(query)
+        got = best["name"] if best else None
+        if got != expected:
+            failures += 1
+            print(f"❌ '{query}' → {got} (expected {expected})")
+
+    queries = list(EXPECTED) + ["chicken tikka", "veg biryani", "achari paneer", "something not on menu"]
+    started = time.perf_counter()
+    for i in range(rounds):
+        matcher.search(queries[i % len(queries)])
+    per_query_us = (time.perf_counter() - started) / rounds * 1e6
+
+    print(f"📊 {len(menu)} menu items, {len(matcher.vocabulary)} distinct tokens")
+    print(f"   index build: {build_ms:8.2f} ms")
+    print(f"   search:      {per_query_us:8.1f} µs/query")
+    print("✅ All rankings as expected" if not failures else f"❌ {failures} rankings wrong")
+    return failures == 0
+
+
+if __name__ == "__main__":
+    ok = main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
+    sys.exit(0 if ok else 1)
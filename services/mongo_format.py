@@ -0,0 +1,63 @@
+# services/mongo_format.py
+"""
+Document conversion shared by main.py and the route modules
+
+prepare_for_mongo keeps datetimes as (IST-aware) datetimes so Mongo sorts
+them properly; parse_from_mongo turns a stored document into the shape the
+Pydantic response models expect (string id, ISO datetimes in IST).
+"""
+
+from datetime import datetime
+from typing import Any, Dict
+
+import pytz
+
+IST = pytz.timezone('Asia/Kolkata')
+
+
+def prepare_for_mongo(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert Pydantic models to MongoDB format.
+    IMPORTANT: Keep datetime objects as datetime for proper MongoDB sorting!
+    """
+    for k, v in data.items():
+        if isinstance(v, datetime):
+            # ✅ KEEP as datetime object, DON'T convert to string!
+            if v.tzinfo is None:
+                v = v.replace(tzinfo=IST)
+            data[k] = v  # ✅ Store as datetime, not ISO string
+        elif isinstance(v, list):
+            data[k] = [prepare_for_mongo(i) if isinstance(i, dict) else i for i in v]
+    return data
+
+
+def parse_from_mongo(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Parse MongoDB document for Pydantic models."""
+    from bson import ObjectId
+    
+    if "_id" in data:
+        if "id" not in data:
+            data["id"] = str(data["_id"]) if isinstance(data["_id"], ObjectId) else data["_id"]
+            del data["_id"]
+    
+    for k, v in data.items():
+        if isinstance(v, datetime):
+            # ✅ FIX: Convert to IST before converting to ISO string
+            if v.tzinfo is None:
+                v = v.replace(tzinfo=IST)
+            else:
+                v = v.astimezone(IST)
+            data[k] = v.isoformat()
+        elif isinstance(v, str) and k.endswith(("at", "completion")):
+            try:
+                dt = datetime.fromisoformat(v.replace("Z", "+00:00"))
+                # ✅ FIX: Convert to IST
+                dt = dt.astimezone(IST)
+                data[k] = dt.isoformat()
+            except:
+                data[k] = v
+        elif isinstance(v, list):
+            data[k] = [parse_from_mongo(i) if isinstance(i, dict) else i for i in v]
+        elif isinstance(v, dict):
+            data[k] = parse_from_mongo(v)
+    
+    return data
@@ -0,0 +1,194 @@
+# services/order_placement.py
+"""
+Order placement unit of work - order + KOT + table + inventory in one go
+
+When the local mongod runs as a replica set (a single-node one is enough:
+start it with --replSet rs0 and run rs.initiate() once) every write of a
+placement happens in one multi-document transaction.
+
+On a standalone mongod the placement is first recorded in the order_outbox
+collection and then applied step by step. Every step is idempotent (upserts
+keyed by id, inventory deductions keyed per ingredient), so a placement cut
+short by a crash is simply finished by replay_outbox() at the next startup.
+"""
+
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional
+import logging
+
+from pymongo.errors import OperationFailure
+
+from services.customer_stats import customer_stats
+from services.payment_matcher import payment_matcher
+from services.table_state import table_state
+
+logger = logging.getLogger(__name__)
+
+# Server error codes meaning "no transactions here" (standalone mongod)
+NO_TRANSACTION_CODES = {20, 263}
+
+PLACEMENT_COLLECTIONS = (
+    "orders", "kots", "tables", "customers", "customer_item_counts",
+    "inventory_items", "stock_transactions", "order_outbox"
+)
+
+
+class OrderPlacementService:
+    """Writes a new order and everything that goes with it as one unit"""
+
+    def __init__(self):
+        self.db = None
+        self.client = None
+        self.deduct_inventory: Optional[Callable[..., Awaitable[Dict[str, Any]]]] = None
+        self.after_deduction: Optional[Callable[[Optional[Dict[str, Any]]], Awaitable[None]]] = None
+        self.transactions_supported = False
+
+    async def init(self, db, client, deduct_inventory=None, after_deduction=None):
+        """
+        Detect transaction support and finish placements left in the outbox.
+        `deduct_inventory(order_id, items, session=None)` is the inventory
+        module's deduction routine; `after_deduction(result)` is awaited with
+        its result once the placement's writes are durable.
+        """
+        self.db = db
+        self.client = client
+        self.deduct_inventory = deduct_inventory
+        self.after_deduction = after_deduction
+        customer_stats.set_db(db)
+
+        # Collections cannot always be created implicitly inside a transaction
+        existing = await db.list_collection_names()
+        for name in PLACEMENT_COLLECTIONS:
+            if name not in existing:
+                await db.create_collection(name)
+
+        self.transactions_supported = await self._detect_replica_set()
+        if self.transactions_supported:
+            logger.info("✅ Order placement: replica set detected - using multi-document transactions")
+        else:
+            logger.info("ℹ️ Order placement: standalone mongod - using the order outbox")
+
+        await self.replay_outbox()
+
+    async def _detect_replica_set(self) -> bool:
+        try:
+            hello = await self.client.admin.command("hello")
+        except OperationFailure:
+            hello = await self.client.admin.command("isMaster")  # mongod < 4.4
+        return bool(hello.get("setName"))
+
+    # ==================== PLACEMENT ====================
+    async def place(
+        self,
+        order: Dict[str, Any],
+        kot: Optional[Dict[str, Any]] = None,
+        deduct_inventory: bool = True
+    ) -> Dict[str, Any]:
+        """
+        Write the order (already prepared for Mongo), its KOT if any, the table
+        occupancy and the inventory deduction.
+
+        Returns {"mode": "transaction"|"outbox", "inventory": deduction result or None}
+        """
+        if kot:
+            order["kot_generated"] = True
+        order.setdefault("version", 0)
+
+        job = {
+            "_id": order["id"],
+            "order": order,
+            "kot": kot,
+            "deduct_inventory": deduct_inventory,
+            "created_at": datetime.now(timezone.utc)
+        }
+
+        if self.transactions_supported:
+            try:
+                return await self._place_in_transaction(job)
+            except OperationFailure as e:
+                if e.code not in NO_TRANSACTION_CODES:
+                    raise
+                logger.warning(f"⚠️ Transactions unavailable ({e}) - switching to the order outbox")
+                self.transactions_supported = False
+
+        await self.db.order_outbox.insert_one(job)
+        return await self._run_outbox_job(job)
+
+    async def _apply(self, job: Dict[str, Any], session=None) -> Optional[Dict[str, Any]]:
+        """All writes of one placement; idempotent so transactions and replays can repeat it"""
+        order = job["order"]
+        kot = job.get("kot")
+
+        await self.db.orders.update_one(
+            {"id": order["id"]},
+            {"$setOnInsert": order},
+            upsert=True,
+            session=session
+        )
+
+        if kot:
+            await self.db.kots.update_one(
+                {"id": kot["id"]},
+                {"$setOnInsert": kot},
+                upsert=True,
+                session=session
+            )
+
+        if order.get("table_number"):
+            await table_state.write_occupied(order["table_number"], order["id"], session=session)
+
+        if order.get("customer_id"):
+            await customer_stats.on_placed(order, session=session)
+
+        inventory_result = None
+        if job.get("deduct_inventory") and self.deduct_inventory and order.get("items"):
+            inventory_result = await self.deduct_inventory(order["order_id"], order["items"], session=session)
+
+        return inventory_result
+
+    async def _place_in_transaction(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        outcome: Dict[str, Any] = {}
+
+        async def unit_of_work(session):
+            outcome["inventory"] = await self._apply(job, session)
+
+        async with await self.client.start_session() as session:
+            await session.with_transaction(unit_of_work)
+
+        await self._after_commit(job, outcome.get("inventory"))
+        return {"mode": "transaction", "inventory": outcome.get("inventory")}
+
+    async def _run_outbox_job(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        inventory_result = await self._apply(job)
+        await self._after_commit(job, inventory_result)
+        await self.db.order_outbox.delete_one({"_id": job["_id"]})
+        return {"mode": "outbox", "inventory": inventory_result}
+
+    async def _after_commit(self, job: Dict[str, Any], inventory_result: Optional[Dict[str, Any]] = None):
+        """In-memory state changes that must only happen once the writes are durable"""
+        order = job["order"]
+        if order.get("table_number"):
+            await table_state.mark_occupied(order["table_number"], order["id"])
+        payment_matcher.track(order)
+        if inventory_result and self.after_deduction:
+            try:
+                await self.after_deduction(inventory_result)
+            except Exception as e:
+                logger.error(f"❌ After-deduction hook failed for order {order.get('id')}: {e}")
+
+    # ==================== RECOVERY ====================
+    async def replay_outbox(self) -> int:
+        """Finish placements interrupted by a crash (standalone mode)"""
+        replayed = 0
+        async for job in self.db.order_outbox.find({}).sort("created_at", 1):
+            try:
+                await self._run_outbox_job(job)
+                replayed += 1
+            except Exception as e:
+                logger.error(f"❌ Could not replay placement of order {job.get('_id')}: {e}")
+        if replayed:
+            logger.info(f"🔁 Replayed {replayed} interrupted order placement(s) from the outbox")
+        return replayed
+
+
+order_placement = OrderPlacementService()
@@ -0,0 +1,151 @@
+# services/orders.py
+"""
+Order construction shared by the POS endpoint and the chatbot
+
+Both entry points used to build orders their own way (a per-item
+find_one for menu details on the POS path, a hand-rolled order + KOT dict
+in the chatbot). Line building, the menu lookup (one $in query per order)
+and the chatbot's order/KOT documents live here; writing them is always
+order_placement.place().
+"""
+
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import logging
+import uuid
+
+from services import pricing
+from services.mongo_format import IST
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PREP_MINUTES = 30
+MENU_DETAIL_PROJECTION = {
+    "_id": 0, "id": 1, "name": 1, "tax_rate": 1, "food_type": 1, "category": 1, "preparation_time": 1
+}
+
+
+async def menu_details(db, menu_item_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """Menu documents for the given ids, in one query"""
+    ids = list({item_id for item_id in menu_item_ids if item_id})
+    if not ids:
+        return {}
+    return {
+        item["id"]: item
+        async for item in db.menu_items.find({"id": {"$in": ids}}, MENU_DETAIL_PROJECTION)
+    }
+
+
+def pos_line(item: Dict[str, Any], menu_item: Optional[Dict[str, Any]], added_by: str = "POS") -> Dict[str, Any]:
+    """Order line from a POS cart item, filled in from the menu document when there is one"""
+    item_name = item.get("menuitemname") or item.get("name") or "Unknown Item"
+    line = {
+        "line_id": str(uuid.uuid4()),
+        "menuitemid": item.get("menuitemid"),
+        "menuitemname": item_name,
+        "price": float(item.get("price") or 0),
+        "quantity": int(item.get("quantity") or 1),
+        "tax_rate": item.get("tax_rate"),
+        "specialinstructions": item.get("specialinstructions") or "",
+        "iscustomitem": False,
+        "addedby": added_by,
+        "addedat": datetime.now(IST)
+    }
+    if menu_item:
+        line.update({
+            "menuitemid": str(menu_item.get("id", item.get("menuitemid"))),
+            "menuitemname": item_name if item_name != "Unknown Item" else menu_item.get("name", item_name),
+            "tax_rate": menu_item.get("tax_rate", item.get("tax_rate")),
+            "foodtype": menu_item.get("food_type", "veg"),
+            "category": menu_item.get("category", "")
+        })
+    return line
+
+
+def preparation_minutes(menu_items: Iterable[Dict[str, Any]]) -> int:
+    return max([DEFAULT_PREP_MINUTES] + [item.get("preparation_time", 15) for item in menu_items])
+
+
+# ==================== CHATBOT ====================
+def chatbot_line(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Order line from a chatbot cart item"""
+    return {
+        'line_id': str(uuid.uuid4()),
+        'menuitemid': str(item.get('menuitemid', '')),
+        'menuitemname': str(item.get('menuitemname', '')),
+        'price': float(item.get('price', 0)),
+        'quantity': int(item.get('quantity', 1)),
+        'foodtype': item.get('foodtype', 'veg'),
+        'category': item.get('category', ''),
+        'specialinstructions': item.get('specialinstructions', ''),
+        'iscustomitem': False,
+        'addedby': 'Chatbot',
+        'addedat': datetime.now(IST).isoformat()
+    }
+
+
+async def build_chatbot_order(db, session: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Order and KOT documents for a confirmed chatbot cart (chatbot orders always carry GST)"""
+    totals = pricing.order_totals(session['items'], gst_applicable=True)
+
+    order_counter = await db.orders.count_documents({}) + 1
+    order_number = f"ORD-{datetime.now().strftime('%Y%m%d')}-{order_counter:04d}"
+    kot_counter = await db.kots.count_documents({}) + 1
+    kot_number = f"KOT-{kot_counter:04d}"
+
+    lines: List[Dict[str, Any]] = [chatbot_line(item) for item in session['items']]
+    table_number = str(session.get('table_number', '0'))
+    now = datetime.now(IST)
+
+    order = {
+        'id': order_number,
+        'order_id': order_number,
+        'customer_name': session.get('customer_name', 'Walk-in'),
+        'table_number': table_number,
+        'items': lines,
+        'total_amount': totals['total_amount'],
+        'gst_amount': totals['gst_amount'],
+        'final_amount': totals['final_amount'],
+        'gst_applicable': True,
+        'status': 'pending',
+        'payment_status': 'pending',
+        'order_type': 'Dine-in',
+        'kot_generated': False,
+        'created_at': now,
+        'updated_at': now
+    }
+    kot = {
+        'id': kot_number,
+        'order_id': order_number,
+        'order_number': kot_number,
+        'table_number': table_number,
+        'items': lines,
+        'status': 'pending',
+        'created_at': now
+    }
+    return order, kot
+
+
+# ==================== MIGRATION ====================
+async def backfill_line_ids(db) -> int:
+    """
+    Give every stored order line without a line_id its own one, so the
+    line endpoints can address lines written before line ids existed.
+    Each update is guarded on the line still lacking an id.
+    """
+    from pymongo import UpdateOne
+
+    updates = []
+    async for order in db.orders.find(
+        {"items": {"$elemMatch": {"line_id": {"$exists": False}}}}, {"_id": 1, "items.line_id": 1}
+    ):
+        for index, item in enumerate(order.get("items") or []):
+            if "line_id" not in item:
+                updates.append(UpdateOne(
+                    {"_id": order["_id"], f"items.{index}.line_id": {"$exists": False}},
+                    {"$set": {f"items.{index}.line_id": str(uuid.uuid4())}}
+                ))
+    if updates:
+        await db.orders.bulk_write(updates, ordered=False)
+        logger.info(f"🔧 Assigned line ids to {len(updates)} stored order line(s)")
+    return len(updates)
@@ -0,0 +1,98 @@
+# services/pagination.py
+"""
+Keyset (cursor) pagination for Mongo list endpoints
+
+Instead of skip/limit - which walks and discards every earlier row, so each
+page is slower than the last - a page asks for rows strictly after the last
+row it returned, on an indexed (sort field, _id) order. The position is
+handed to the client as an opaque cursor string.
+
+    sort = SortKey("created_at", descending=True)
+    query = {**filters, **keyset_filter(sort, decode_cursor(cursor))}
+    rows = await coll.find(query).sort(sort.mongo_sort()).limit(limit + 1).to_list(limit + 1)
+    page, next_cursor = split_page(rows, sort, limit)
+"""
+
+import base64
+import json
+from datetime import datetime
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from bson import ObjectId
+
+
+class SortKey(NamedTuple):
+    field: str
+    descending: bool = False
+
+    def mongo_sort(self) -> List[Tuple[str, int]]:
+        direction = -1 if self.descending else 1
+        return [(self.field, direction), ("_id", direction)]
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _field_value(doc: Dict[str, Any], field: str) -> Any:
+    value: Any = doc
+    for part in field.split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def encode_cursor(doc: Dict[str, Any], sort: SortKey) -> str:
+    value = _field_value(doc, sort.field)
+    key_id = doc["_id"]
+    payload = {
+        "f": sort.field,
+        "v": value.isoformat() if isinstance(value, datetime) else value,
+        "d": isinstance(value, datetime),
+        "i": str(key_id),
+        "o": isinstance(key_id, ObjectId)
+    }
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str], sort: SortKey) -> Optional[Tuple[Any, Any]]:
+    """(last sort value, last _id) or None for the first page"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if payload["f"] != sort.field:
+            raise InvalidCursor("cursor belongs to a different sort order")
+        value = datetime.fromisoformat(payload["v"]) if payload["d"] else payload["v"]
+        key_id = ObjectId(payload["i"]) if payload["o"] else payload["i"]
+        return value, key_id
+    except InvalidCursor:
+        raise
+    except Exception as e:
+        raise InvalidCursor(f"malformed cursor: {e}")
+
+
+def keyset_filter(sort: SortKey, position: Optional[Tuple[Any, Any]]) -> Dict[str, Any]:
+    """Rows after `position` in (field, _id) order; nulls sort first ascending, last descending"""
+    if position is None:
+        return {}
+    value, key_id = position
+    after = "$lt" if sort.descending else "$gt"
+    same_value = {sort.field: value, "_id": {after: key_id}}
+    if value is None:
+        if sort.descending:
+            return same_value
+        return {"$or": [same_value, {sort.field: {"$ne": None}}]}
+    beyond = {sort.field: {after: value}}
+    if sort.descending:
+        # Missing / null values come after every real value
+        return {"$or": [beyond, same_value, {sort.field: None}]}
+    return {"$or": [beyond, same_value]}
+
+
+def split_page(rows: List[Dict[str, Any]], sort: SortKey, limit: int) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Rows fetched with limit + 1 → (page, cursor of the next page or None)"""
+    if len(rows) <= limit:
+        return rows, None
+    page = rows[:limit]
+    return page, encode_cursor(page[-1], sort)
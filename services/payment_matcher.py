@@ -1,100 +1,307 @@
 # services/payment_matcher.py
-from datetime import datetime, timezone, timedelta
-from typing import Optional, Dict, Any
+"""
+Payment auto-matching engine
+
+Pending orders are kept in memory in a list sorted by
+(amount in paise, created time, order id). A webhook amount is resolved by
+bisecting to the ±tolerance amount window - O(log n) plus the few orders in
+that window - instead of querying the orders collection.
+
+The index is loaded once at startup and then refreshed from order events:
+placement, edits, payment, cancellation and deletion call track()/forget().
+It is only a candidate list - the final "mark paid" write re-checks
+payment_status and amount in its filter, so a stale entry can never pay the
+wrong order; it is refreshed from the database and the next candidate tried.
+
+Strategies:
+  fifo          oldest pending order within tolerance
+  nearest_time  order created closest to the payment
+  exact_first   oldest order with exactly the paid amount, else the closest amount
+"""
+
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, List, Tuple
 import logging
+import math
+import os
+
+from services import pricing
+from services.customer_stats import customer_stats
+from services.table_state import table_state
 
 logger = logging.getLogger(__name__)
 
+STRATEGIES = ("fifo", "nearest_time", "exact_first")
+STRATEGY_ALIASES = {"amount_time": "nearest_time"}
+
+DEFAULT_TOLERANCE = float(os.getenv("PAYMENT_MATCH_TOLERANCE", "2"))
+DEFAULT_STRATEGY = os.getenv("PAYMENT_MATCH_STRATEGY", "fifo")
+
+# Tries before giving up when candidates turn out to be stale
+CLAIM_ATTEMPTS = 5
+
+PENDING_PROJECTION = {
+    "_id": 0, "id": 1, "order_id": 1, "final_amount": 1, "table_number": 1,
+    "created_at": 1, "payment_status": 1, "status": 1
+}
+
+IndexKey = Tuple[int, float, str]
+
+
+def epoch_seconds(value: Any) -> float:
+    """Epoch seconds of a stored created_at (datetime, naive UTC from Mongo, or ISO string)"""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return 0.0
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    return 0.0
+
+
+def is_pending(order: Dict[str, Any]) -> bool:
+    return order.get("payment_status", "pending") != "paid" and order.get("status") != "cancelled"
+
+
+class PendingOrderIndex:
+    """Pending orders sorted by (amount_paise, created_ts, id)"""
+
+    def __init__(self):
+        self._keys: List[IndexKey] = []
+        self._by_id: Dict[str, IndexKey] = {}
+        self._orders: Dict[str, Dict[str, Any]] = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, order_id: str) -> bool:
+        return order_id in self._by_id
+
+    def clear(self):
+        self._keys.clear()
+        self._by_id.clear()
+        self._orders.clear()
+
+    def get(self, order_id: str) -> Optional[Dict[str, Any]]:
+        return self._orders.get(order_id)
+
+    def upsert(self, order: Dict[str, Any]):
+        """Add, move or drop one order according to its current amount and state"""
+        order_id = order.get("id")
+        if not order_id:
+            return
+        if not is_pending(order):
+            self.discard(order_id)
+            return
+
+        key = (pricing.to_paise(order.get("final_amount") or 0), epoch_seconds(order.get("created_at")), order_id)
+        if self._by_id.get(order_id) != key:
+            self.discard(order_id)
+            insort(self._keys, key)
+            self._by_id[order_id] = key
+        self._orders[order_id] = {
+            "id": order_id,
+            "order_id": order.get("order_id"),
+            "final_amount": order.get("final_amount") or 0,
+            "table_number": order.get("table_number"),
+            "created_at": order.get("created_at")
+        }
+
+    def discard(self, order_id: str):
+        key = self._by_id.pop(order_id, None)
+        self._orders.pop(order_id, None)
+        if key is not None:
+            position = bisect_left(self._keys, key)
+            if position < len(self._keys) and self._keys[position] == key:
+                del self._keys[position]
+
+    def window(self, low_paise: int, high_paise: int) -> List[IndexKey]:
+        """Keys with low <= amount <= high, in (amount, created) order"""
+        return self._keys[bisect_left(self._keys, (low_paise,)):bisect_right(self._keys, (high_paise, math.inf))]
+
+    def pick(
+        self,
+        amount_paise: int,
+        tolerance_paise: int,
+        strategy: str = "fifo",
+        not_before: float = 0.0,
+        at: Optional[float] = None,
+        exclude: Tuple[str, ...] = ()
+    ) -> Optional[str]:
+        """Order id chosen by `strategy` for a payment of amount_paise made at `at`"""
+        if strategy == "exact_first":
+            for _, created, order_id in self.window(amount_paise, amount_paise):
+                if created >= not_before and order_id not in exclude:
+                    return order_id
+
+        candidates = [
+            key for key in self.window(amount_paise - tolerance_paise, amount_paise + tolerance_paise)
+            if key[1] >= not_before and key[2] not in exclude
+        ]
+        if not candidates:
+            return None
+
+        if strategy == "nearest_time":
+            at = at if at is not None else datetime.now(timezone.utc).timestamp()
+            best = min(candidates, key=lambda key: (abs(at - key[1]), abs(key[0] - amount_paise)))
+        elif strategy == "exact_first":
+            best = min(candidates, key=lambda key: (abs(key[0] - amount_paise), key[1]))
+        else:
+            best = min(candidates, key=lambda key: (key[1], abs(key[0] - amount_paise)))
+        return best[2]
+
+
 class PaymentMatcher:
     """Service to handle payment matching logic"""
-    
-    def __init__(self, db):
+
+    def __init__(self, db=None):
         self.db = db
-    
-    async def find_matching_order(
-        self, 
-        amount: float, 
-        timeout_minutes: int = 15,
-        algorithm: str = "fifo"
+        self.index = PendingOrderIndex()
+
+    async def init(self, db):
+        """Index the pending orders; call once the database is connected"""
+        self.db = db
+        await db.orders.create_index([("payment_status", 1), ("final_amount", 1)])
+        await self.load()
+
+    async def load(self):
+        """Rebuild the in-memory index from the orders collection"""
+        self.index.clear()
+        cursor = self.db.orders.find(
+            {"payment_status": {"$ne": "paid"}, "status": {"$ne": "cancelled"}},
+            PENDING_PROJECTION
+        )
+        async for order in cursor:
+            self.index.upsert(order)
+        logger.info(f"✅ Payment matcher: {len(self.index)} pending orders indexed")
+
+    # ==================== ORDER EVENTS ====================
+    def track(self, order: Dict[str, Any]):
+        """Call with the stored order after any write that can change its amount or payment state"""
+        self.index.upsert(order)
+
+    def forget(self, order_id: str):
+        self.index.discard(order_id)
+
+    async def refresh(self, order_id: str):
+        order = await self.db.orders.find_one({"id": order_id}, PENDING_PROJECTION)
+        if order is None:
+            self.forget(order_id)
+        else:
+            self.track(order)
+
+    # ==================== MATCHING ====================
+    def find_matching_order(
+        self,
+        amount: float,
+        timeout_minutes: Optional[int] = None,
+        algorithm: str = DEFAULT_STRATEGY,
+        tolerance: float = DEFAULT_TOLERANCE,
+        paid_at: Optional[datetime] = None,
+        exclude: Tuple[str, ...] = ()
     ) -> Optional[Dict[str, Any]]:
         """
         Find a pending order that matches the payment amount
-        
+
         Args:
             amount: Payment amount to match
-            timeout_minutes: Time window to search for pending orders
-            algorithm: Matching algorithm (fifo, amount_time, manual)
-        
+            timeout_minutes: Only orders created this recently (None = any age)
+            algorithm: fifo, nearest_time or exact_first
+            tolerance: Accepted difference in rupees
+            paid_at: When the payment was made (defaults to now)
+
         Returns:
-            Matched order dict or None
+            Index entry of the matched order or None
         """
-        try:
-            # Calculate cutoff time
-            cutoff_time = datetime.now(timezone.utc) - timedelta(minutes=timeout_minutes)
-            
-            # Build query
-            query = {
-                "payment_status": "pending",
-                "total": amount,
-                "created_at": {"$gte": cutoff_time.isoformat()},
-                "status": {"$ne": "cancelled"}
-            }
-            
-            # Apply matching algorithm
-            if algorithm == "fifo":
-                # First In First Out - oldest order first
-                sort_order = [("created_at", 1)]
-            elif algorithm == "amount_time":
-                # Closest to current time
-                sort_order = [("created_at", -1)]
-            else:
-                # Manual - just return first match
-                sort_order = [("created_at", 1)]
-            
-            # Find matching order
-            matching_order = await self.db.orders.find_one(query, sort=sort_order)
-            
-            if matching_order:
-                logger.info(f"Match found: Order {matching_order.get('orderid')} for ₹{amount}")
-            else:
+        strategy = STRATEGY_ALIASES.get(algorithm, algorithm)
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown matching strategy '{algorithm}'")
+
+        at = (paid_at or datetime.now(timezone.utc)).timestamp()
+        not_before = at - timeout_minutes * 60 if timeout_minutes else 0.0
+        order_id = self.index.pick(
+            pricing.to_paise(amount), pricing.to_paise(tolerance), strategy,
+            not_before=not_before, at=at, exclude=exclude
+        )
+        return self.index.get(order_id) if order_id else None
+
+    async def claim(
+        self,
+        amount: float,
+        transaction_id: str,
+        payer_vpa: Optional[str] = None,
+        algorithm: str = DEFAULT_STRATEGY,
+        tolerance: float = DEFAULT_TOLERANCE,
+        timeout_minutes: Optional[int] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Match a payment and mark the chosen order paid; returns the order's index entry or None"""
+        tried: Tuple[str, ...] = ()
+        for _ in range(CLAIM_ATTEMPTS):
+            candidate = self.find_matching_order(
+                amount, timeout_minutes, algorithm, tolerance, exclude=tried
+            )
+            if candidate is None:
                 logger.warning(f"No match found for amount ₹{amount}")
-            
-            return matching_order
-            
-        except Exception as e:
-            logger.error(f"Error in payment matching: {str(e)}")
-            return None
-    
+                return None
+
+            if await self.mark_order_as_paid(
+                candidate["id"], transaction_id, payer_vpa, expected_amount=amount, tolerance=tolerance
+            ):
+                logger.info(f"Match found: Order {candidate.get('order_id')} for ₹{amount}")
+                return candidate
+
+            # Paid, cancelled or repriced since it was indexed
+            tried += (candidate["id"],)
+            await self.refresh(candidate["id"])
+        return None
+
     async def mark_order_as_paid(
         self,
         order_id: str,
         transaction_id: str,
-        payer_vpa: Optional[str] = None
+        payer_vpa: Optional[str] = None,
+        expected_amount: Optional[float] = None,
+        tolerance: float = DEFAULT_TOLERANCE
     ) -> bool:
-        """Mark an order as paid with transaction details"""
+        """Mark an order as paid with transaction details, only if it is still unpaid"""
         try:
+            now = datetime.now(timezone.utc).isoformat()
             update_data = {
                 "payment_status": "paid",
                 "payment_method": "online",
                 "status": "served",
-                "updated_at": datetime.now(timezone.utc).isoformat(),
+                "paid_at": now,
+                "updated_at": now,
                 "transaction_id": transaction_id
             }
-            
+
             if payer_vpa:
                 update_data["payer_vpa"] = payer_vpa
-            
+
+            query = {"id": order_id, "payment_status": {"$ne": "paid"}, "status": {"$ne": "cancelled"}}
+            if expected_amount is not None:
+                query["final_amount"] = {"$gte": expected_amount - tolerance, "$lte": expected_amount + tolerance}
+
             result = await self.db.orders.update_one(
-                {"_id": order_id},
-                {"$set": update_data}
+                query,
+                {"$set": update_data, "$inc": {"version": 1}}
             )
-            
-            return result.modified_count > 0
-            
+            if result.modified_count == 0:
+                return False
+
+            self.forget(order_id)
+            await table_state.release(order_id)
+            await customer_stats.on_paid(order_id)
+            return True
+
         except Exception as e:
             logger.error(f"Error marking order as paid: {str(e)}")
             return False
-    
+
     async def store_unmatched_payment(
         self,
         transaction_id: str,
@@ -105,25 +312,28 @@ class PaymentMatcher:
         """Store an unmatched payment for later resolution"""
         try:
             from models.soundbox_models import UnmatchedPaymentModel
-            
+
             unmatched = UnmatchedPaymentModel(
                 transaction_id=transaction_id,
                 amount=amount,
                 payer_vpa=payer_vpa,
                 provider=provider
             )
-            
+
             # Convert to dict and handle datetime serialization
             payment_dict = unmatched.model_dump()
             for key, value in payment_dict.items():
                 if isinstance(value, datetime):
                     payment_dict[key] = value.isoformat()
-            
+
             result = await self.db.unmatched_payments.insert_one(payment_dict)
-            
+
             logger.info(f"Stored unmatched payment: {transaction_id}")
             return str(result.inserted_id)
-            
+
         except Exception as e:
             logger.error(f"Error storing unmatched payment: {str(e)}")
             raise
+
+
+payment_matcher = PaymentMatcher()
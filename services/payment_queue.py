@@ -0,0 +1,191 @@
+# services/payment_queue.py
+"""
+Background matching of soundbox payments
+
+The webhook only records the payment (one upsert keyed on the unique
+transaction_id index created in start()) and enqueues its transaction id;
+workers here match it to an order through the payment matcher, retrying
+with exponential backoff, and push the outcome to POS screens over the
+WebSocket.
+
+Payments still marked "queued" in the database (e.g. the process stopped
+with work in the queue) are picked up again by start(). Claiming marks the
+order paid before the payment is marked matched, so a payment is first
+looked up on the orders by its transaction_id: if a claim already went
+through, the match is rolled forward instead of claiming a second order.
+"""
+
+import asyncio
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+import logging
+import os
+
+from services.payment_matcher import payment_matcher
+from services.table_state import table_state
+from services.customer_stats import customer_stats
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = int(os.getenv("PAYMENT_MATCH_ATTEMPTS", "5"))
+BASE_DELAY_SECONDS = float(os.getenv("PAYMENT_MATCH_RETRY_SECONDS", "2"))
+MAX_DELAY_SECONDS = 60.0
+WORKERS = int(os.getenv("PAYMENT_MATCH_WORKERS", "2"))
+
+
+class PaymentMatchQueue:
+    """asyncio worker queue that matches recorded payments to pending orders"""
+
+    def __init__(self):
+        self.db = None
+        self.broadcast: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._retry_handles: Set[asyncio.TimerHandle] = set()
+
+    @property
+    def running(self) -> bool:
+        return bool(self._workers)
+
+    async def start(self, db, broadcast=None):
+        """Start the workers and requeue payments left unmatched in the queue"""
+        self.db = db
+        self.broadcast = broadcast
+        if self.running:
+            return
+        # Webhook ingestion relies on this to make provider retries no-ops
+        try:
+            await db.payments.create_index("transaction_id", unique=True)
+        except Exception as e:
+            logger.error(f"❌ Could not create unique transaction_id index on payments (duplicates?): {e}")
+        await db.orders.create_index("transaction_id", sparse=True)
+
+        self._queue = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(WORKERS)]
+
+        requeued = 0
+        async for payment in db.payments.find({"match_status": "queued"}, {"transaction_id": 1}):
+            self.enqueue(payment["transaction_id"])
+            requeued += 1
+        logger.info(f"✅ Payment match queue started ({WORKERS} workers, {requeued} requeued)")
+
+    async def stop(self):
+        for handle in self._retry_handles:
+            handle.cancel()
+        self._retry_handles.clear()
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def enqueue(self, transaction_id: str, attempt: int = 1):
+        if self._queue is None:
+            logger.warning(f"⚠️ Payment queue not started - {transaction_id} stays queued until next start")
+            return
+        self._queue.put_nowait((transaction_id, attempt))
+
+    def _retry_later(self, transaction_id: str, attempt: int):
+        delay = min(BASE_DELAY_SECONDS * 2 ** (attempt - 1), MAX_DELAY_SECONDS)
+        handle = None
+
+        def fire():
+            self._retry_handles.discard(handle)
+            self.enqueue(transaction_id, attempt + 1)
+
+        handle = asyncio.get_running_loop().call_later(delay, fire)
+        self._retry_handles.add(handle)
+        logger.info(f"🔁 Payment {transaction_id}: retry {attempt + 1}/{MAX_ATTEMPTS} in {delay:.0f}s")
+
+    # ==================== WORKER ====================
+    async def _worker(self, number: int):
+        while True:
+            transaction_id, attempt = await self._queue.get()
+            try:
+                await self._process(transaction_id, attempt)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Payment worker {number}: matching {transaction_id} failed: {e}")
+                await self._after_miss(transaction_id, attempt, error=str(e))
+            finally:
+                self._queue.task_done()
+
+    async def _process(self, transaction_id: str, attempt: int):
+        payment = await self.db.payments.find_one({"transaction_id": transaction_id})
+        if payment is None or payment.get("matched"):
+            return
+
+        # A claim interrupted before the payment was marked matched - finish it
+        order = await self.db.orders.find_one(
+            {"transaction_id": transaction_id},
+            {"_id": 0, "id": 1, "order_id": 1, "table_number": 1}
+        )
+        if order is not None:
+            logger.info(f"🔁 Payment {transaction_id} already claimed order {order.get('order_id')} - rolling forward")
+            payment_matcher.forget(order["id"])
+            await table_state.release(order["id"])
+            await customer_stats.on_paid(order["id"])
+        else:
+            order = await payment_matcher.claim(
+                float(payment.get("amount", 0)), transaction_id, payment.get("upi_id") or None
+            )
+        if order is None:
+            await self._after_miss(transaction_id, attempt)
+            return
+
+        now = datetime.now(timezone.utc).isoformat()
+        await self.db.payments.update_one(
+            {"transaction_id": transaction_id},
+            {"$set": {
+                "matched": True,
+                "order_id": order.get("order_id"),
+                "matched_at": now,
+                "match_status": "matched",
+                "match_attempts": attempt
+            }}
+        )
+        logger.info(f"✅ Payment {transaction_id} matched to order {order.get('order_id')}")
+        await self._notify({
+            "type": "payment_matched",
+            "transaction_id": transaction_id,
+            "order_id": order.get("id"),
+            "order_number": order.get("order_id"),
+            "table_number": order.get("table_number"),
+            "amount": payment.get("amount"),
+            "timestamp": now
+        })
+
+    async def _after_miss(self, transaction_id: str, attempt: int, error: Optional[str] = None):
+        """No order (yet) or a failure - retry with backoff, then leave it for manual matching"""
+        if attempt < MAX_ATTEMPTS:
+            await self.db.payments.update_one(
+                {"transaction_id": transaction_id},
+                {"$set": {"match_attempts": attempt, "match_error": error}}
+            )
+            self._retry_later(transaction_id, attempt)
+            return
+
+        payment = await self.db.payments.find_one_and_update(
+            {"transaction_id": transaction_id, "matched": False},
+            {"$set": {"match_status": "unmatched", "match_attempts": attempt, "match_error": error}},
+            return_document=True
+        )
+        logger.warning(f"⚠️ Payment {transaction_id} left unmatched after {attempt} attempts")
+        if payment is not None:
+            await self._notify({
+                "type": "payment_unmatched",
+                "transaction_id": transaction_id,
+                "amount": payment.get("amount"),
+                "timestamp": datetime.now(timezone.utc).isoformat()
+            })
+
+    async def _notify(self, message: Dict[str, Any]):
+        if self.broadcast is None:
+            return
+        try:
+            await self.broadcast(message)
+        except Exception as e:
+            logger.warning(f"Could not broadcast {message.get('type')}: {e}")
+
+
+payment_queue = PaymentMatchQueue()
@@ -0,0 +1,321 @@
+# services/pricing.py
+"""
+Pricing engine - the single place where order money is calculated
+
+All arithmetic is done on integers: amounts in paise, rates in basis points
+(5% GST = 500 bp). Rounding is always half-up to the paisa, so the per-order
+path and the vectorized (pandas) path produce identical results.
+
+Rules:
+- Line gross = quantity × price
+- Percentage discounts are applied per line; fixed discounts are spread over
+  the lines in proportion to their gross (largest remainder, so paise add up)
+- GST is charged on (gross - discount), per line, at the line's tax_rate
+  in percent (5 = 5%; falls back to the order default)
+- Exclusive GST: final = taxable + GST
+  Inclusive GST: prices already contain GST, final = taxable, GST is the part of it
+- Optional "rupee" rounding rounds the final bill to the nearest rupee and
+  reports the difference as round_off
+"""
+
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Any, Dict, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GST_RATE = 5  # percent
+BP = 10000  # basis points in 1.0
+
+
+# ==================== CONVERSIONS ====================
+def to_paise(amount: Any) -> int:
+    """Rupees (float/str/Decimal) → integer paise, rounded half-up"""
+    if amount is None:
+        return 0
+    return int((Decimal(str(amount)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_paise(paise: int) -> float:
+    """Integer paise → rupees as a float with at most 2 decimals"""
+    return round(paise / 100, 2)
+
+
+def rate_to_bp(rate: Any, default: float = DEFAULT_GST_RATE) -> int:
+    """Tax rate in percent (5 = 5%, 12.5 = 12.5%) → basis points"""
+    if rate is None or rate == "":
+        rate = default
+    return int((Decimal(str(rate)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def _div_half_up(numerator: int, denominator: int) -> int:
+    """Integer division rounded half-up (non-negative operands)"""
+    return (2 * numerator + denominator) // (2 * denominator)
+
+
+def _discount_fields(discount: Any):
+    """(type, value) from a Discount model, a dict or None"""
+    if not discount:
+        return None, 0
+    if isinstance(discount, dict):
+        return discount.get("type"), discount.get("value", 0) or 0
+    return getattr(discount, "type", None), getattr(discount, "value", 0) or 0
+
+
+def is_line_additive(discount: Any) -> bool:
+    """
+    True when every line can be priced on its own, so order totals can be
+    maintained line by line with $inc. A fixed discount is shared across all
+    lines, so adding a line changes every other line's share.
+    """
+    discount_type, _ = _discount_fields(discount)
+    return discount_type != "fixed"
+
+
+# ==================== LINE PRICING ====================
+def _price_line_paise(
+    gross: int,
+    discount_paise: int,
+    rate_bp: int,
+    gst_applicable: bool,
+    gst_inclusive: bool
+) -> Dict[str, int]:
+    taxable = gross - discount_paise
+    if not gst_applicable or rate_bp == 0:
+        gst = 0
+        final = taxable
+    elif gst_inclusive:
+        base = _div_half_up(taxable * BP, BP + rate_bp)
+        gst = taxable - base
+        final = taxable
+    else:
+        gst = _div_half_up(taxable * rate_bp, BP)
+        final = taxable + gst
+    return {"gross": gross, "discount": discount_paise, "taxable": taxable, "gst": gst, "final": final}
+
+
+def _line_gross(item: Dict[str, Any]) -> int:
+    return int(item.get("quantity", 0) or 0) * to_paise(item.get("price", 0))
+
+
+def percent_to_bp(percent: Any) -> int:
+    """Discount percent (10 = 10%) → basis points, clamped to 0..100%"""
+    value = int((Decimal(str(percent or 0)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+    return min(max(value, 0), BP)
+
+
+def _percentage_discount_paise(gross: int, percent: Any) -> int:
+    return _div_half_up(gross * percent_to_bp(percent), BP)
+
+
+def _allocate(total: int, weights: List[int]) -> List[int]:
+    """Split total paise over weights proportionally; remainders go to the largest fractions"""
+    weight_sum = sum(weights)
+    if total <= 0 or weight_sum <= 0:
+        return [0] * len(weights)
+    shares = [total * w // weight_sum for w in weights]
+    fractions = [total * w % weight_sum for w in weights]
+    remainder = total - sum(shares)
+    for index in sorted(range(len(weights)), key=lambda i: (-fractions[i], i))[:remainder]:
+        shares[index] += 1
+    return shares
+
+
+def lines_paise(
+    items: List[Dict[str, Any]],
+    gst_applicable: bool,
+    discount: Any = None,
+    gst_inclusive: bool = False,
+    default_rate: float = DEFAULT_GST_RATE
+) -> Dict[str, int]:
+    """
+    Integer paise (gross / discount / gst / final) that these lines add to an
+    order - the exact $inc deltas for line edits. Only valid for line-additive
+    discounts - see is_line_additive().
+    """
+    discount_type, discount_value = _discount_fields(discount)
+    totals = {"gross": 0, "discount": 0, "gst": 0, "final": 0}
+    for item in items:
+        gross = _line_gross(item)
+        discount_paise = _percentage_discount_paise(gross, discount_value) if discount_type == "percentage" else 0
+        priced = _price_line_paise(
+            gross,
+            discount_paise,
+            rate_to_bp(item.get("tax_rate"), default_rate),
+            gst_applicable,
+            gst_inclusive
+        )
+        for key in totals:
+            totals[key] += priced[key]
+    return totals
+
+
+# ==================== ORDER PRICING ====================
+def price_order(
+    items: List[Dict[str, Any]],
+    gst_applicable: bool,
+    discount: Any = None,
+    gst_inclusive: bool = False,
+    rounding: str = "paise",
+    default_rate: float = DEFAULT_GST_RATE
+) -> Dict[str, Any]:
+    """
+    Price a whole order.
+
+    Returns rupee amounts:
+        total_amount     - gross before discount
+        discount_amount  - discount actually applied (never more than gross)
+        gst_amount       - GST charged (or contained, when inclusive)
+        final_amount     - amount payable
+        round_off        - adjustment made by rupee rounding (0 for "paise")
+        lines            - per-line breakdown in the same order as items
+    """
+    grosses = [_line_gross(item) for item in items]
+    discount_type, discount_value = _discount_fields(discount)
+
+    if discount_type == "percentage":
+        discounts = [_percentage_discount_paise(g, discount_value) for g in grosses]
+    elif discount_type == "fixed":
+        discounts = _allocate(min(to_paise(discount_value), sum(grosses)), grosses)
+    else:
+        discounts = [0] * len(grosses)
+
+    lines = [
+        _price_line_paise(gross, line_discount, rate_to_bp(item.get("tax_rate"), default_rate), gst_applicable, gst_inclusive)
+        for item, gross, line_discount in zip(items, grosses, discounts)
+    ]
+
+    final = sum(line["final"] for line in lines)
+    round_off = 0
+    if rounding == "rupee":
+        round_off = _div_half_up(final, 100) * 100 - final
+
+    return {
+        "total_amount": from_paise(sum(grosses)),
+        "discount_amount": from_paise(sum(discounts)),
+        "gst_amount": from_paise(sum(line["gst"] for line in lines)),
+        "final_amount": from_paise(final + round_off),
+        "round_off": from_paise(round_off),
+        "lines": [{key: from_paise(value) for key, value in line.items()} for line in lines]
+    }
+
+
+def order_totals(
+    items: List[Dict[str, Any]],
+    gst_applicable: bool,
+    discount: Any = None,
+    gst_inclusive: bool = False
+) -> Dict[str, float]:
+    """Just the three stored order fields (total_amount, gst_amount, final_amount)"""
+    priced = price_order(items, gst_applicable, discount, gst_inclusive)
+    return {
+        "total_amount": priced["total_amount"],
+        "gst_amount": priced["gst_amount"],
+        "final_amount": priced["final_amount"]
+    }
+
+
+def discount_record(discount: Any, items: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Discount dict as stored on the order, with the amount the engine applied"""
+    discount_type, discount_value = _discount_fields(discount)
+    if not discount_type:
+        return None
+    reason = discount.get("reason", "") if isinstance(discount, dict) else getattr(discount, "reason", "")
+    return {
+        "type": discount_type,
+        "value": discount_value,
+        "reason": reason or "",
+        "amount": price_order(items, False, discount)["discount_amount"]
+    }
+
+
+# ==================== VECTORIZED PATH ====================
+def price_orders_frame(lines, default_rate: float = DEFAULT_GST_RATE):
+    """
+    Price many orders at once - for migrations, reports and bulk re-checks.
+
+    `lines` is a pandas DataFrame with one row per order line and columns:
+        order_id, quantity, price,
+        gst_applicable (bool), gst_inclusive (bool, optional),
+        tax_rate (optional, percent, NaN = default),
+        discount_type ("percentage"/"fixed"/None, optional), discount_value (optional)
+
+    Returns a DataFrame indexed by order_id with total_amount, discount_amount,
+    gst_amount and final_amount in rupees - identical to price_order() per order.
+    """
+    import numpy as np
+    import pandas as pd
+
+    df = pd.DataFrame({
+        "order_id": lines["order_id"].to_numpy(),
+        "quantity": lines["quantity"].fillna(0).astype("int64").to_numpy(),
+        "price": lines["price"].fillna(0).to_numpy(dtype=object),
+    })
+    n = len(df)
+
+    def column(name, default):
+        if name in lines:
+            return lines[name].to_numpy()
+        return np.full(n, default, dtype=object)
+
+    # Decimal-exact paise for prices (floats like 0.1 must not drift)
+    price_paise = np.fromiter((to_paise(p) for p in df["price"]), dtype=np.int64, count=n)
+    gross = df["quantity"].to_numpy(dtype=np.int64) * price_paise
+
+    rates = column("tax_rate", None)
+    rate_bp = np.fromiter(
+        (rate_to_bp(None if (r is None or (isinstance(r, float) and np.isnan(r))) else r, default_rate) for r in rates),
+        dtype=np.int64,
+        count=n
+    )
+    gst_applicable = column("gst_applicable", False).astype(bool)
+    gst_inclusive = column("gst_inclusive", False).astype(bool)
+    discount_type = column("discount_type", None)
+    discount_value = column("discount_value", 0)
+
+    # --- Percentage discounts: per line ---
+    is_percentage = discount_type == "percentage"
+    percent_bp = np.zeros(n, dtype=np.int64)
+    if is_percentage.any():
+        percent_bp[is_percentage] = [percent_to_bp(v) for v in discount_value[is_percentage]]
+    discounts = (2 * gross * percent_bp + BP) // (2 * BP)
+
+    # --- Fixed discounts: largest-remainder allocation inside each order ---
+    is_fixed = discount_type == "fixed"
+    if is_fixed.any():
+        fixed = pd.DataFrame({
+            "order_id": df["order_id"].to_numpy()[is_fixed],
+            "gross": gross[is_fixed],
+            "value": [to_paise(v) for v in discount_value[is_fixed]],
+            "position": np.arange(n)[is_fixed],
+        })
+        group = fixed.groupby("order_id", sort=False)
+        gross_sum = group["gross"].transform("sum").to_numpy(dtype=np.int64)
+        total = np.minimum(group["value"].transform("first").to_numpy(dtype=np.int64), gross_sum)
+        safe_sum = np.where(gross_sum > 0, gross_sum, 1)
+        share = total * fixed["gross"].to_numpy(dtype=np.int64) // safe_sum
+        fraction = total * fixed["gross"].to_numpy(dtype=np.int64) % safe_sum
+        fixed["share"] = np.where(gross_sum > 0, share, 0)
+        fixed["fraction"] = fraction
+        fixed["remainder"] = total - fixed.groupby("order_id", sort=False)["share"].transform("sum").to_numpy()
+        # Largest fraction first, ties by original position - same rule as _allocate()
+        fixed = fixed.sort_values(["order_id", "fraction", "position"], ascending=[True, False, True], kind="mergesort")
+        rank = fixed.groupby("order_id", sort=False).cumcount().to_numpy()
+        fixed["share"] = fixed["share"].to_numpy() + (rank < fixed["remainder"].to_numpy())
+        discounts[fixed["position"].to_numpy()] = fixed["share"].to_numpy()
+
+    # --- GST per line ---
+    taxable = gross - discounts
+    exclusive_gst = (2 * taxable * rate_bp + BP) // (2 * BP)
+    inclusive_base = (2 * taxable * BP + (BP + rate_bp)) // (2 * (BP + rate_bp))
+    gst = np.where(gst_applicable & (rate_bp > 0), np.where(gst_inclusive, taxable - inclusive_base, exclusive_gst), 0)
+    final = np.where(gst_applicable & ~gst_inclusive, taxable + gst, taxable)
+
+    totals = pd.DataFrame({
+        "order_id": df["order_id"].to_numpy(),
+        "total_amount": gross,
+        "discount_amount": discounts,
+        "gst_amount": gst,
+        "final_amount": final,
+    }).groupby("order_id", sort=False).sum()
+    return (totals / 100).round(2)
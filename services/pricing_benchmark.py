@@ -0,0 +1,98 @@
+# services/pricing_benchmark.py
+"""
+Micro-benchmark for the pricing engine
+
+Prices the same batch of random orders through price_order() (one order at
+a time, as the API does) and price_orders_frame() (vectorized), checks that
+both paths agree to the paisa and prints the timings.
+
+Run:  python -m services.pricing_benchmark [orders]
+"""
+
+import random
+import sys
+import time
+
+from services.pricing import price_order, price_orders_frame
+
+PRICES = [49, 99, 120, 149.5, 180, 199, 249.99, 320, 450, 0.1]
+DISCOUNTS = [None, None, {"type": "percentage", "value": 10}, {"type": "percentage", "value": 12.5},
+             {"type": "fixed", "value": 50}, {"type": "fixed", "value": 33.33}]
+
+
+def make_orders(count: int, seed: int = 7):
+    rng = random.Random(seed)
+    orders = []
+    for index in range(count):
+        items = [
+            {
+                "quantity": rng.randint(1, 4),
+                "price": rng.choice(PRICES),
+                "tax_rate": rng.choice([None, None, 1, 12, 18])
+            }
+            for _ in range(rng.randint(1, 6))
+        ]
+        orders.append({
+            "order_id": f"O{index}",
+            "items": items,
+            "gst_applicable": rng.random() < 0.7,
+            "gst_inclusive": rng.random() < 0.2,
+            "discount": rng.choice(DISCOUNTS)
+        })
+    return orders
+
+
+def to_frame(orders):
+    import pandas as pd
+
+    rows = []
+    for order in orders:
+        discount = order["discount"] or {}
+        for item in order["items"]:
+            rows.append({
+                "order_id": order["order_id"],
+                "quantity": item["quantity"],
+                "price": item["price"],
+                "tax_rate": item["tax_rate"],
+                "gst_applicable": order["gst_applicable"],
+                "gst_inclusive": order["gst_inclusive"],
+                "discount_type": discount.get("type"),
+                "discount_value": discount.get("value", 0)
+            })
+    return pd.DataFrame(rows)
+
+
+def main(count: int = 20000):
+    orders = make_orders(count)
+    frame = to_frame(orders)
+
+    started = time.perf_counter()
+    scalar = {
+        order["order_id"]: price_order(order["items"], order["gst_applicable"], order["discount"], order["gst_inclusive"])
+        for order in orders
+    }
+    scalar_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    vector = price_orders_frame(frame)
+    vector_seconds = time.perf_counter() - started
+
+    mismatches = 0
+    for order_id, row in vector.iterrows():
+        expected = scalar[order_id]
+        for field in ("total_amount", "discount_amount", "gst_amount", "final_amount"):
+            if round(row[field], 2) != expected[field]:
+                mismatches += 1
+                print(f"❌ {order_id} {field}: vectorized={row[field]} scalar={expected[field]}")
+                break
+
+    print(f"📊 {count} orders, {len(frame)} lines")
+    print(f"   price_order():        {scalar_seconds * 1000:8.1f} ms ({scalar_seconds / count * 1e6:.1f} µs/order)")
+    print(f"   price_orders_frame(): {vector_seconds * 1000:8.1f} ms ({vector_seconds / count * 1e6:.1f} µs/order)")
+    print("✅ Both paths agree" if not mismatches else f"❌ {mismatches} orders differ")
+    return mismatches == 0
+
+
+if __name__ == "__main__":
+    ok = main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,359 @@
+# services/procurement.py
+"""
+Purchase orders from low-stock items
+
+generate() turns everything that needs restocking into draft purchase
+orders, one per supplier, written with a single insert_many:
+
+    quantity = max(shortfall to the reorder level, forecast reorder suggestion)
+               (no forecast yet: back up to RESTOCK_MULTIPLIER × reorder level)
+             → at least the item's min_order_qty
+             → rounded up to whole packs of pack_size
+
+Items already on an open (draft / ordered) purchase order are skipped, so
+generating twice does not order twice.
+
+receive() books a delivery - in a transaction when the deployment supports
+it. The purchase_receipt stock_transactions are logged first (one
+insert_many, pending, under a unique receipt_key per PO line), then each
+item's stock is written as a compare-and-set on the level read, then the
+entries are marked applied. A retry skips lines already logged and finishes
+entries left pending, so an interrupted receipt never books a line twice -
+the same order of writes as the order deductions.
+
+    draft → ordered → received        draft / ordered → cancelled
+"""
+
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+import logging
+import math
+import os
+import uuid
+
+from services.order_placement import order_placement
+
+logger = logging.getLogger(__name__)
+
+RESTOCK_MULTIPLIER = float(os.getenv("RESTOCK_MULTIPLIER", "2"))
+# Compare-and-set attempts per item when a deduction moves the stock in between
+STOCK_WRITE_RETRIES = 5
+OPEN_STATUSES = ["draft", "ordered", "receiving"]
+STATUS_CHANGES = {
+    "draft": {"ordered", "cancelled"},
+    "ordered": {"cancelled"},
+}
+UNASSIGNED_SUPPLIER = "Unassigned"
+
+
+class PurchaseOrderError(ValueError):
+    pass
+
+
+def order_quantity(item: Dict[str, Any], forecast: Optional[Dict[str, Any]] = None) -> float:
+    """Quantity to order in the item's storage unit, after minimum-order and pack rounding"""
+    stock = item.get("current_stock") or 0
+    reorder_level = item.get("reorder_level") or 0
+    if forecast:
+        quantity = max(reorder_level - stock, forecast.get("suggested_reorder_qty") or 0)
+    else:
+        quantity = reorder_level * RESTOCK_MULTIPLIER - stock
+    if quantity <= 0:
+        return 0.0
+
+    quantity = max(quantity, item.get("min_order_qty") or 0)
+    pack_size = item.get("pack_size") or 0
+    if pack_size > 0:
+        # Tolerance keeps 2.0000000001 packs from becoming 3
+        quantity = math.ceil(quantity / pack_size - 1e-9) * pack_size
+    return round(quantity, 2)
+
+
+def build_purchase_orders(items: Iterable[Dict[str, Any]], forecasts: Dict[str, Dict[str, Any]],
+                          skip_item_ids: Iterable[str] = ()) -> List[Dict[str, Any]]:
+    """Draft purchase orders (one per supplier) for the given inventory documents"""
+    skip = set(skip_item_ids)
+    now = datetime.now(timezone.utc)
+    by_supplier: Dict[str, Dict[str, Any]] = {}
+
+    for item in items:
+        item_id = str(item["_id"])
+        if item_id in skip:
+            continue
+        quantity = order_quantity(item, forecasts.get(item_id))
+        if quantity <= 0:
+            continue
+
+        supplier = (item.get("supplier") or "").strip() or UNASSIGNED_SUPPLIER
+        po = by_supplier.get(supplier)
+        if po is None:
+            po = by_supplier[supplier] = {
+                "id": str(uuid.uuid4()),
+                "po_number": f"PO-{now:%Y%m%d}-{uuid.uuid4().hex[:6].upper()}",
+                "supplier": supplier,
+                "supplier_contact": item.get("supplier_contact"),
+                "status": "draft",
+                "lines": [],
+                "total_cost": 0.0,
+                "created_at": now,
+                "updated_at": now
+            }
+        unit_cost = item.get("unit_cost") or 0
+        pack_size = item.get("pack_size") or 0
+        po["lines"].append({
+            "item_id": item_id,
+            "item_name": item.get("name"),
+            "unit": item.get("unit"),
+            "current_stock": round(item.get("current_stock") or 0, 2),
+            "reorder_level": round(item.get("reorder_level") or 0, 2),
+            "quantity": quantity,
+            "pack_size": pack_size or None,
+            "packs": round(quantity / pack_size) if pack_size > 0 else None,
+            "unit_cost": unit_cost,
+            "line_total": round(quantity * unit_cost, 2)
+        })
+        po["total_cost"] = round(po["total_cost"] + quantity * unit_cost, 2)
+
+    for po in by_supplier.values():
+        po["lines"].sort(key=lambda line: line["item_name"] or "")
+    return sorted(by_supplier.values(), key=lambda po: po["supplier"])
+
+
+class ProcurementService:
+    """purchase_orders collection: generation, status changes and receipts"""
+
+    def __init__(self):
+        self.db = None
+
+    async def init(self, db):
+        self.db = db
+        await db.purchase_orders.create_index("id", unique=True)
+        await db.purchase_orders.create_index([("status", 1), ("created_at", -1)])
+        await db.stock_transactions.create_index([("purchase_order_id", 1)], sparse=True)
+        # One receipt per PO line - the guard that makes retries and concurrent receives safe
+        await db.stock_transactions.create_index(
+            "receipt_key", unique=True, partialFilterExpression={"receipt_key": {"$exists": True}}
+        )
+
+    async def open_item_ids(self) -> List[str]:
+        return await self.db.purchase_orders.distinct("lines.item_id", {"status": {"$in": OPEN_STATUSES}})
+
+    async def generate(self, items: Iterable[Dict[str, Any]], forecasts: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Write draft purchase orders for `items` (inventory documents) in one insert_many"""
+        drafts = build_purchase_orders(items, forecasts, await self.open_item_ids())
+        if drafts:
+            await self.db.purchase_orders.insert_many(drafts)
+            for po in drafts:
+                po.pop("_id", None)
+            lines = sum(len(po["lines"]) for po in drafts)
+            logger.info(f"🧾 Drafted {len(drafts)} purchase order(s) covering {lines} item(s)")
+        return drafts
+
+    async def list_orders(self, status: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        query = {"status": status} if status else {}
+        return await self.db.purchase_orders.find(query, {"_id": 0}).sort("created_at", -1).limit(limit).to_list(limit)
+
+    async def get(self, po_id: str) -> Optional[Dict[str, Any]]:
+        return await self.db.purchase_orders.find_one({"id": po_id}, {"_id": 0})
+
+    async def set_status(self, po_id: str, status: str) -> Dict[str, Any]:
+        allowed_from = [current for current, targets in STATUS_CHANGES.items() if status in targets]
+        if not allowed_from:
+            raise PurchaseOrderError(f"Cannot set status to '{status}'")
+        from pymongo import ReturnDocument
+
+        po = await self.db.purchase_orders.find_one_and_update(
+            {"id": po_id, "status": {"$in": allowed_from}},
+            {"$set": {"status": status, "updated_at": datetime.now(timezone.utc)}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+        if po is None:
+            current = await self.get(po_id)
+            if current is None:
+                raise LookupError(po_id)
+            raise PurchaseOrderError(f"Purchase order is {current['status']}")
+        return po
+
+    # ==================== RECEIVING ====================
+    async def receive(self, po_id: str, received: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+        """
+        Book a delivery. `received` maps item_id → quantity actually delivered
+        (default: the ordered quantities). Returns the purchase order and
+        {"stock_updates": {item_id: new_stock}} for the inventory snapshot.
+        """
+        from pymongo import ReturnDocument
+
+        po = await self.db.purchase_orders.find_one_and_update(
+            {"id": po_id, "status": {"$in": OPEN_STATUSES}},
+            {"$set": {"status": "receiving", "updated_at": datetime.now(timezone.utc)}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+        if po is None:
+            current = await self.get(po_id)
+            if current is None:
+                raise LookupError(po_id)
+            raise PurchaseOrderError(f"Purchase order is {current['status']}")
+
+        quantities = {
+            line["item_id"]: round(float(received.get(line["item_id"], 0) if received is not None else line["quantity"]), 2)
+            for line in po["lines"]
+        }
+
+        outcome: Dict[str, Any] = {}
+        if order_placement.transactions_supported:
+            async def unit_of_work(session):
+                outcome.update(await self._book(po, quantities, session))
+
+            async with await order_placement.client.start_session() as session:
+                await session.with_transaction(unit_of_work)
+        else:
+            outcome.update(await self._book(po, quantities))
+
+        logger.info(f"📦 Received {po['po_number']}: {len(outcome['stock_updates'])} item(s) restocked")
+        return outcome
+
+    async def _finish_pending(self, txn: Dict[str, Any], session=None):
+        """
+        A receipt logged but interrupted before it was marked applied: write
+        its stock level if the item still holds the level it was computed
+        from, otherwise it already went through.
+        """
+        from bson import ObjectId
+
+        result = await self.db.inventory_items.update_one(
+            {"_id": ObjectId(txn["item_id"]), "current_stock": txn["previous_stock"]},
+            {"$set": {"current_stock": txn["new_stock"], "last_updated": datetime.now(timezone.utc)}},
+            session=session
+        )
+        if not result.matched_count:
+            item = await self.db.inventory_items.find_one({"_id": ObjectId(txn["item_id"])}, {"current_stock": 1}, session=session)
+            if item is None or item.get("current_stock") != txn["new_stock"]:
+                logger.warning(f"⚠️ Pending receipt {txn['receipt_key']}: stock moved since, treating it as applied")
+        await self.db.stock_transactions.update_one({"_id": txn["_id"]}, {"$set": {"applied": True}}, session=session)
+        logger.info(f"🔁 Finished interrupted receipt {txn['receipt_key']}")
+
+    async def _apply_receipt(self, txn: Dict[str, Any], session=None) -> bool:
+        """
+        Stock write for a logged receipt: compare-and-set against the level
+        the entry was computed from, re-reading when a deduction moved it.
+        False (and the entry removed) if the item was deleted; if the stock
+        never settles the entry is removed and the receipt left open for a retry.
+        """
+        from bson import ObjectId
+
+        for _ in range(STOCK_WRITE_RETRIES):
+            result = await self.db.inventory_items.update_one(
+                {"_id": ObjectId(txn["item_id"]), "current_stock": txn["previous_stock"]},
+                {"$set": {"current_stock": txn["new_stock"], "last_updated": txn["transaction_date"]}},
+                session=session
+            )
+            if result.matched_count:
+                return True
+            item = await self.db.inventory_items.find_one({"_id": ObjectId(txn["item_id"])}, {"current_stock": 1}, session=session)
+            if item is None:
+                await self.db.stock_transactions.delete_one({"receipt_key": txn["receipt_key"]}, session=session)
+                return False
+            txn["previous_stock"] = item.get("current_stock") or 0
+            txn["new_stock"] = round(txn["previous_stock"] + txn["quantity_added"], 2)
+            await self.db.stock_transactions.update_one(
+                {"receipt_key": txn["receipt_key"]},
+                {"$set": {"previous_stock": txn["previous_stock"], "new_stock": txn["new_stock"]}},
+                session=session
+            )
+        await self.db.stock_transactions.delete_one({"receipt_key": txn["receipt_key"]}, session=session)
+        raise PurchaseOrderError(f"Stock of {txn['item_name']} kept changing while receiving, please retry")
+
+    async def _book(self, po: Dict[str, Any], quantities: Dict[str, float], session=None) -> Dict[str, Any]:
+        """Log pending receipts, then write the stock, then mark them applied; skips lines booked by an earlier attempt"""
+        from bson import ObjectId
+        from pymongo import ReturnDocument
+        from pymongo.errors import BulkWriteError
+
+        now = datetime.now(timezone.utc)
+        touched = set()
+        booked = set()
+        async for txn in self.db.stock_transactions.find(
+            {"purchase_order_id": po["id"], "transaction_type": "purchase_receipt"},
+            {"item_id": 1, "receipt_key": 1, "applied": 1, "previous_stock": 1, "new_stock": 1},
+            session=session
+        ):
+            booked.add(txn["item_id"])
+            if txn.get("applied") is False:
+                await self._finish_pending(txn, session)
+                touched.add(txn["item_id"])
+        pending = {item_id: qty for item_id, qty in quantities.items() if qty > 0 and item_id not in booked}
+
+        if pending:
+            items = {
+                str(item["_id"]): item
+                async for item in self.db.inventory_items.find(
+                    {"_id": {"$in": [ObjectId(item_id) for item_id in pending]}},
+                    {"name": 1, "unit": 1, "current_stock": 1},
+                    session=session
+                )
+            }
+            transactions = []
+            for item_id, qty in pending.items():
+                item = items.get(item_id)
+                if item is None:
+                    continue  # item deleted since the order was drafted
+                previous = item.get("current_stock") or 0
+                transactions.append({
+                    "item_id": item_id,
+                    "item_name": item.get("name"),
+                    "transaction_type": "purchase_receipt",
+                    "quantity_added": qty,
+                    "unit": item.get("unit"),
+                    "previous_stock": previous,
+                    "new_stock": round(previous + qty, 2),
+                    "storage_unit": item.get("unit"),
+                    "purchase_order_id": po["id"],
+                    "po_number": po["po_number"],
+                    "receipt_key": f"{po['id']}:{item_id}",
+                    "applied": False,
+                    "transaction_date": now,
+                    "created_by": "procurement"
+                })
+
+            if transactions:
+                try:
+                    await self.db.stock_transactions.insert_many(transactions, ordered=False, session=session)
+                except BulkWriteError as e:
+                    errors = e.details.get("writeErrors", [])
+                    if any(error.get("code") != 11000 for error in errors):
+                        raise
+                    # A concurrent receive of this purchase order owns these lines
+                    taken = {transactions[error["index"]]["receipt_key"] for error in errors}
+                    transactions = [txn for txn in transactions if txn["receipt_key"] not in taken]
+
+            applied = []
+            for txn in transactions:
+                if await self._apply_receipt(txn, session):
+                    applied.append(txn["receipt_key"])
+                    touched.add(txn["item_id"])
+            if applied:
+                await self.db.stock_transactions.update_many(
+                    {"receipt_key": {"$in": applied}}, {"$set": {"applied": True}}, session=session
+                )
+
+        # Exact levels for the snapshot - deductions may have run in between
+        stock_updates: Dict[str, float] = {}
+        if touched:
+            async for item in self.db.inventory_items.find(
+                {"_id": {"$in": [ObjectId(item_id) for item_id in touched]}}, {"current_stock": 1}, session=session
+            ):
+                stock_updates[str(item["_id"])] = round(item.get("current_stock") or 0, 2)
+
+        lines = [{**line, "received_quantity": quantities.get(line["item_id"], 0)} for line in po["lines"]]
+        po = await self.db.purchase_orders.find_one_and_update(
+            {"id": po["id"]},
+            {"$set": {"status": "received", "lines": lines, "received_at": now, "updated_at": now}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+        return {"purchase_order": po, "stock_updates": stock_updates}
+
+procurement = ProcurementService()
@@ -0,0 +1,346 @@
+# services/reconciliation.py
+"""
+End-of-day reconciliation of soundbox payments against unpaid orders
+
+1. Candidate pairs: a payment can settle an order whose final_amount is
+   within the tolerance and that was created in the time window before the
+   payment (plus a little clock skew). Orders are sorted by amount, so each
+   payment bisects to its amount window instead of scanning every order.
+2. Union-find splits the candidate graph into independent clusters - in
+   practice one per price point - so the assignment below runs on small
+   matrices instead of one payments x orders matrix.
+3. Per cluster, a Hungarian (shortest augmenting path) assignment picks the
+   set of pairs that matches as many payments as possible and, among those,
+   minimises amount difference first and time gap second.
+
+apply_matches() writes the accepted pairs with two bulk_write calls and only
+marks a payment matched if its order was still unpaid.
+
+Run the benchmark:  python -m services.reconciliation_benchmark
+"""
+
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import logging
+
+import numpy as np
+
+from services import pricing
+from services.customer_stats import customer_stats
+from services.payment_matcher import payment_matcher, epoch_seconds
+from services.table_state import table_state
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOLERANCE = 2.0
+DEFAULT_WINDOW_MINUTES = 180
+CLOCK_SKEW_SECONDS = 5 * 60
+
+# One paisa of difference weighs as much as ten minutes of time gap
+AMOUNT_WEIGHT = 600
+
+
+# ==================== UNION-FIND ====================
+class DisjointSet:
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+        self.rank = [0] * size
+
+    def find(self, x: int) -> int:
+        root = x
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[x] != root:
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def union(self, a: int, b: int):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return
+        if self.rank[a] < self.rank[b]:
+            a, b = b, a
+        self.parent[b] = a
+        if self.rank[a] == self.rank[b]:
+            self.rank[a] += 1
+
+
+# ==================== ASSIGNMENT ====================
+def linear_assignment(cost: np.ndarray) -> List[Tuple[int, int]]:
+    """
+    Minimum-cost assignment of every row of an n x m cost matrix (n <= m) to
+    a distinct column - Hungarian algorithm with potentials, O(n^2 m),
+    inner loop vectorised over the columns.
+    """
+    n, m = cost.shape
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    p = np.zeros(m + 1, dtype=np.int64)      # p[j]: row (1-based) assigned to column j
+    way = np.zeros(m + 1, dtype=np.int64)
+
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used[1:]
+            reduced = cost[i0 - 1] - u[i0] - v[1:]
+            better = free & (reduced < minv[1:])
+            minv[1:][better] = reduced[better]
+            way[1:][better] = j0
+
+            candidates = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(candidates)) + 1
+            delta = candidates[j1 - 1]
+
+            u[p[used]] += delta
+            v[used] -= delta
+            minv[~used] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    return [(int(p[j]) - 1, j - 1) for j in range(1, m + 1) if p[j]]
+
+
+# ==================== PROPOSALS ====================
+def candidate_pairs(
+    payments: List[Dict[str, Any]],
+    orders: List[Dict[str, Any]],
+    tolerance: float = DEFAULT_TOLERANCE,
+    window_minutes: int = DEFAULT_WINDOW_MINUTES
+) -> List[Tuple[int, int, int]]:
+    """(payment index, order index, cost) for every compatible pair"""
+    tolerance_paise = pricing.to_paise(tolerance)
+    window = window_minutes * 60
+
+    order_keys = sorted(
+        (pricing.to_paise(order.get("final_amount") or 0), epoch_seconds(order.get("created_at")), index)
+        for index, order in enumerate(orders)
+    )
+    amounts = [key[0] for key in order_keys]
+
+    pairs = []
+    for p_index, payment in enumerate(payments):
+        amount = pricing.to_paise(payment.get("amount") or 0)
+        paid_at = epoch_seconds(payment.get("timestamp") or payment.get("created_at"))
+        low = bisect_left(amounts, amount - tolerance_paise)
+        high = bisect_right(amounts, amount + tolerance_paise)
+        for order_amount, created, o_index in order_keys[low:high]:
+            gap = paid_at - created
+            if -CLOCK_SKEW_SECONDS <= gap <= window:
+                pairs.append((p_index, o_index, abs(order_amount - amount) * AMOUNT_WEIGHT + int(abs(gap))))
+    return pairs
+
+
+def propose_matches(
+    payments: List[Dict[str, Any]],
+    orders: List[Dict[str, Any]],
+    tolerance: float = DEFAULT_TOLERANCE,
+    window_minutes: int = DEFAULT_WINDOW_MINUTES
+) -> List[Dict[str, Any]]:
+    """Optimal payment → order pairs, one order per payment and vice versa"""
+    pairs = candidate_pairs(payments, orders, tolerance, window_minutes)
+    if not pairs:
+        return []
+
+    # Payments are nodes 0..P-1, orders P..P+O-1
+    offset = len(payments)
+    clusters = DisjointSet(offset + len(orders))
+    for p_index, o_index, _ in pairs:
+        clusters.union(p_index, offset + o_index)
+
+    grouped: Dict[int, List[Tuple[int, int, int]]] = {}
+    for pair in pairs:
+        grouped.setdefault(clusters.find(pair[0]), []).append(pair)
+
+    proposals = []
+    for cluster_pairs in grouped.values():
+        rows = sorted({p for p, _, _ in cluster_pairs})
+        cols = sorted({o for _, o, _ in cluster_pairs})
+
+        if len(cluster_pairs) == 1:
+            assigned = [cluster_pairs[0]]
+        else:
+            row_of = {p: r for r, p in enumerate(rows)}
+            col_of = {o: c for c, o in enumerate(cols)}
+            max_cost = max(cost for _, _, cost in cluster_pairs)
+            # Forbidden pairs cost more than any full set of real ones,
+            # so the assignment maximises real matches before cost
+            forbidden = (max_cost + 1) * (min(len(rows), len(cols)) + 1)
+            matrix = np.full((len(rows), len(cols)), float(forbidden))
+            for p_index, o_index, cost in cluster_pairs:
+                matrix[row_of[p_index], col_of[o_index]] = cost
+
+            transpose = len(rows) > len(cols)
+            solved = linear_assignment(matrix.T if transpose else matrix)
+            assigned = []
+            for a, b in solved:
+                r, c = (b, a) if transpose else (a, b)
+                if matrix[r, c] < forbidden:
+                    assigned.append((rows[r], cols[c], int(matrix[r, c])))
+
+        for p_index, o_index, cost in assigned:
+            payment, order = payments[p_index], orders[o_index]
+            proposals.append({
+                "transaction_id": payment["transaction_id"],
+                "amount": payment.get("amount"),
+                "paid_at": payment.get("timestamp"),
+                "order_id": order.get("id"),
+                "order_number": order.get("order_id"),
+                "final_amount": order.get("final_amount"),
+                "table_number": order.get("table_number"),
+                "created_at": order.get("created_at"),
+                "amount_difference": round(float(payment.get("amount") or 0) - float(order.get("final_amount") or 0), 2),
+                "cost": cost
+            })
+
+    proposals.sort(key=lambda proposal: proposal["paid_at"] or "")
+    return proposals
+
+
+# ==================== DATABASE ====================
+def day_bounds(date: Optional[str]) -> Tuple[datetime, datetime]:
+    if date:
+        day = datetime.fromisoformat(date.replace("Z", "+00:00"))
+        if day.tzinfo is None:
+            day = day.replace(tzinfo=timezone.utc)
+    else:
+        day = datetime.now(timezone.utc)
+    start = day.replace(hour=0, minute=0, second=0, microsecond=0)
+    return start, start + timedelta(days=1) - timedelta(microseconds=1)
+
+
+def day_range_filter(field: str, start: datetime, end: datetime) -> Dict[str, Any]:
+    """Match a day whether the field is stored as a datetime or (older rows) an ISO string"""
+    return {"$or": [
+        {field: {"$gte": start, "$lte": end}},
+        {field: {"$gte": start.isoformat(), "$lte": end.isoformat()}}
+    ]}
+
+
+async def load_day(db, date: Optional[str], window_minutes: int = DEFAULT_WINDOW_MINUTES):
+    """Unmatched payments of the day and the unpaid orders they could belong to"""
+    start, end = day_bounds(date)
+    payments = await db.payments.find(
+        {"matched": {"$ne": True}, **day_range_filter("timestamp", start, end)},
+        {"_id": 0, "transaction_id": 1, "amount": 1, "timestamp": 1, "created_at": 1, "upi_id": 1}
+    ).to_list(length=None)
+    orders = await db.orders.find(
+        {
+            "payment_status": {"$ne": "paid"},
+            "status": {"$ne": "cancelled"},
+            **day_range_filter("created_at", start - timedelta(minutes=window_minutes), end)
+        },
+        {"_id": 0, "id": 1, "order_id": 1, "final_amount": 1, "created_at": 1, "table_number": 1}
+    ).to_list(length=None)
+    return start, payments, orders
+
+
+async def apply_matches(db, proposals: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Mark the proposed orders paid and their payments matched; returns the pairs actually applied"""
+    from pymongo import UpdateOne
+
+    proposals = list(proposals)
+    if not proposals:
+        return []
+    now = datetime.now(timezone.utc).isoformat()
+
+    await db.orders.bulk_write([
+        UpdateOne(
+            {"id": proposal["order_id"], "payment_status": {"$ne": "paid"}, "status": {"$ne": "cancelled"}},
+            {"$set": {
+                "payment_status": "paid",
+                "payment_method": "online",
+                "status": "served",
+                "transaction_id": proposal["transaction_id"],
+                "paid_at": proposal.get("paid_at") or now,
+                "updated_at": now
+            }, "$inc": {"version": 1}}
+        )
+        for proposal in proposals
+    ], ordered=False)
+
+    # Only pairs whose order really took this transaction (not paid in between)
+    paid = set()
+    async for order in db.orders.find(
+        {"id": {"$in": [p["order_id"] for p in proposals]}},
+        {"_id": 0, "id": 1, "transaction_id": 1}
+    ):
+        paid.add((order["id"], order.get("transaction_id")))
+    applied = [p for p in proposals if (p["order_id"], p["transaction_id"]) in paid]
+
+    if applied:
+        await db.payments.bulk_write([
+            UpdateOne(
+                {"transaction_id": proposal["transaction_id"], "matched": {"$ne": True}},
+                {"$set": {
+                    "matched": True,
+                    "order_id": proposal["order_number"],
+                    "matched_at": now,
+                    "match_status": "reconciled"
+                }}
+            )
+            for proposal in applied
+        ], ordered=False)
+
+    for proposal in applied:
+        payment_matcher.forget(proposal["order_id"])
+        await table_state.release(proposal["order_id"])
+        await customer_stats.on_paid(proposal["order_id"])
+
+    logger.info(f"✅ Reconciliation applied {len(applied)}/{len(proposals)} matches")
+    return applied
+
+
+def _money(rows: Iterable[Dict[str, Any]], field: str) -> Dict[str, Any]:
+    rows = list(rows)
+    return {"count": len(rows), "amount": pricing.from_paise(sum(pricing.to_paise(r.get(field) or 0) for r in rows))}
+
+
+async def settlement_summary(db, start: datetime, applied: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Day totals after reconciliation, by payment method and by match state"""
+    end = start + timedelta(days=1) - timedelta(microseconds=1)
+    payments = await db.payments.find(
+        day_range_filter("timestamp", start, end),
+        {"_id": 0, "transaction_id": 1, "amount": 1, "matched": 1, "match_status": 1}
+    ).to_list(length=None)
+    by_method = await db.orders.aggregate([
+        {"$match": {"payment_status": "paid", **day_range_filter("created_at", start, end)}},
+        {"$group": {
+            "_id": {"$ifNull": ["$payment_method", "unknown"]},
+            "amount": {"$sum": {"$ifNull": ["$final_amount", 0]}},
+            "count": {"$sum": 1}
+        }}
+    ]).to_list(length=None)
+    unpaid = await db.orders.find(
+        {"payment_status": {"$ne": "paid"}, "status": {"$ne": "cancelled"}, **day_range_filter("created_at", start, end)},
+        {"_id": 0, "final_amount": 1}
+    ).to_list(length=None)
+
+    matched = [p for p in payments if p.get("matched")]
+    unmatched = [p for p in payments if not p.get("matched")]
+    return {
+        "date": start.date().isoformat(),
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "webhook_payments": _money(payments, "amount"),
+        "matched_payments": _money(matched, "amount"),
+        "reconciled_now": _money(applied, "amount"),
+        "unmatched_payments": {
+            **_money(unmatched, "amount"),
+            "transaction_ids": [p["transaction_id"] for p in unmatched]
+        },
+        "unpaid_orders": _money(unpaid, "final_amount"),
+        "paid_by_method": {
+            (row["_id"] or "unknown"): {"count": row["count"], "amount": round(float(row["amount"]), 2)}
+            for row in by_method
+        }
+    }
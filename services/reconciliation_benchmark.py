@@ -0,0 +1,76 @@
+# services/reconciliation_benchmark.py
+"""
+Benchmark for the payment reconciliation engine
+
+Builds a synthetic day - orders with realistic bill amounts spread over
+service hours, most of them paid by UPI a few minutes to an hour later -
+checks the proposals against a brute-force optimum on a small day and times
+the full day.
+
+Run:  python -m services.reconciliation_benchmark [payments]
+"""
+
+from datetime import datetime, timedelta, timezone
+from itertools import permutations
+import random
+import sys
+import time
+
+from services.reconciliation import propose_matches
+
+PRICES = [40, 60, 90, 120, 150, 180, 220, 250, 280, 320, 350, 420]
+
+
+def make_day(payments: int, seed: int = 7):
+    rng = random.Random(seed)
+    opening = datetime(2025, 1, 1, 11, 0, tzinfo=timezone.utc)
+    orders, paid = [], []
+    for i in range(int(payments * 1.1)):
+        created = opening + timedelta(seconds=rng.randrange(11 * 3600))
+        amount = round(sum(rng.choice(PRICES) for _ in range(rng.randint(1, 4))) * 1.05, 2)
+        orders.append({"id": f"o{i}", "order_id": f"TP{i:05d}", "final_amount": amount, "created_at": created})
+        if len(paid) < payments:
+            paid_at = created + timedelta(seconds=rng.randrange(120, 3600))
+            paid.append({"transaction_id": f"T{i:05d}", "amount": amount, "timestamp": paid_at.isoformat()})
+    return paid, orders
+
+
+def brute_force_matches(payments, orders):
+    """Best possible number of matches on a tiny instance (tolerance ±2, 3h window)"""
+    def compatible(p, o):
+        gap = datetime.fromisoformat(p["timestamp"]).timestamp() - o["created_at"].timestamp()
+        return abs(p["amount"] - o["final_amount"]) <= 2 and -300 <= gap <= 3 * 3600
+
+    best = 0
+    for chosen in permutations(range(len(orders)), len(payments)):
+        best = max(best, sum(compatible(payments[i], orders[j]) for i, j in enumerate(chosen)))
+    return best
+
+
+def main(size: int = 3000):
+    # Correctness: maximum matching on a small, deliberately ambiguous day
+    small_payments, small_orders = make_day(6, seed=3)
+    for order in small_orders:
+        order["final_amount"] = 252.0 if order["final_amount"] > 300 else 250.0
+    for payment, order in zip(small_payments, small_orders):
+        payment["amount"] = order["final_amount"]
+    proposals = propose_matches(small_payments, small_orders)
+    optimum = brute_force_matches(small_payments, small_orders)
+    ok = len(proposals) == optimum
+    print(("✅" if ok else "❌") + f" small day: {len(proposals)} matches, optimum {optimum}")
+
+    payments, orders = make_day(size)
+    started = time.perf_counter()
+    proposals = propose_matches(payments, orders)
+    elapsed = time.perf_counter() - started
+
+    correct = sum(1 for p in proposals if p["amount"] == p["final_amount"])
+    print(f"📊 {len(payments)} payments, {len(orders)} unpaid orders")
+    print(f"   proposals:  {len(proposals)} ({correct} exact-amount)")
+    print(f"   time:       {elapsed:8.2f} s")
+    return ok
+
+
+if __name__ == "__main__":
+    ok = main(int(sys.argv[1]) if len(sys.argv) > 1 else 3000)
+    sys.exit(0 if ok else 1)
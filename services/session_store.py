@@ -0,0 +1,120 @@
+# services/session_store.py
+"""
+Bounded, expiring session store for the chatbot
+
+- Sliding TTL: a session expires ttl_seconds after it was last used
+- LRU bound: at most max_sessions are kept in memory, least recently used
+  sessions are evicted first
+- Optional persistence: sessions are mirrored to a Mongo collection with a
+  TTL index on expires_at, so carts survive a restart and evicted sessions
+  are reloaded on their next message
+
+The in-memory part is an OrderedDict kept in access order, so both TTL and
+LRU eviction only ever look at the front of it.
+"""
+
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Optional
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore:
+    """TTL + LRU session map with an optional Mongo backend"""
+
+    def __init__(self, ttl_seconds: int = 2 * 60 * 60, max_sessions: int = 5000):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.collection = None
+        self._sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._expires: Dict[str, float] = {}
+
+    async def enable_persistence(self, collection):
+        """Mirror sessions to `collection`; Mongo drops them itself once expires_at passes"""
+        await collection.create_index("expires_at", expireAfterSeconds=0)
+        self.collection = collection
+        logger.info(f"✅ Chatbot sessions persisted to '{collection.name}' (TTL {self.ttl_seconds // 60} min)")
+
+    def __len__(self):
+        self._purge_expired()
+        return len(self._sessions)
+
+    def __contains__(self, session_id: str) -> bool:
+        return self._get_memory(session_id) is not None
+
+    # ==================== MEMORY ====================
+    def _purge_expired(self):
+        now = time.monotonic()
+        while self._sessions:
+            oldest = next(iter(self._sessions))
+            if self._expires[oldest] > now:
+                break
+            self._sessions.popitem(last=False)
+            del self._expires[oldest]
+
+    def _get_memory(self, session_id: str) -> Optional[Dict[str, Any]]:
+        self._purge_expired()
+        session = self._sessions.get(session_id)
+        if session is not None:
+            self._touch(session_id)
+        return session
+
+    def _touch(self, session_id: str):
+        self._sessions.move_to_end(session_id)
+        self._expires[session_id] = time.monotonic() + self.ttl_seconds
+
+    def _put_memory(self, session_id: str, session: Dict[str, Any]):
+        self._sessions[session_id] = session
+        self._touch(session_id)
+        while len(self._sessions) > self.max_sessions:
+            evicted, _ = self._sessions.popitem(last=False)
+            del self._expires[evicted]
+
+    # ==================== PUBLIC API ====================
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Session from memory, else from the backend; None if unknown or expired"""
+        session = self._get_memory(session_id)
+        if session is not None or self.collection is None:
+            return session
+
+        doc = await self.collection.find_one({"_id": session_id})
+        if doc is None or doc["expires_at"].replace(tzinfo=timezone.utc) <= datetime.now(timezone.utc):
+            return None
+        session = doc["data"]
+        self._put_memory(session_id, session)
+        return session
+
+    async def get_or_create(self, session_id: str, factory: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        session = await self.get(session_id)
+        if session is None:
+            session = factory()
+            self._put_memory(session_id, session)
+        return session
+
+    async def save(self, session_id: str):
+        """Write a (mutated) session back to the backend and refresh its expiry"""
+        session = self._get_memory(session_id)
+        if session is None or self.collection is None:
+            return
+        try:
+            await self.collection.update_one(
+                {"_id": session_id},
+                {"$set": {
+                    "data": session,
+                    "expires_at": datetime.now(timezone.utc) + timedelta(seconds=self.ttl_seconds)
+                }},
+                upsert=True
+            )
+        except Exception as e:
+            # The in-memory copy is still good - persistence is best effort
+            logger.warning(f"Could not persist chatbot session {session_id}: {e}")
+
+    async def pop(self, session_id: str) -> Optional[Dict[str, Any]]:
+        session = self._sessions.pop(session_id, None)
+        self._expires.pop(session_id, None)
+        if self.collection is not None:
+            await self.collection.delete_one({"_id": session_id})
+        return session
@@ -0,0 +1,205 @@
+# services/table_state.py
+"""
+Table state index - in-memory map of table number → status / seats / active orders
+
+The tables collection stays the source of truth. Every change goes through
+this service, which writes Mongo first and then updates the map under a lock,
+so lookups (which table is this order on, what is on table 5) never hit the
+database and the floor plan is served without joining tables and orders.
+"""
+
+import asyncio
+from typing import Any, Dict, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# An order keeps its table until it is paid or cancelled
+INACTIVE_ORDER_QUERY = {"$or": [{"payment_status": "paid"}, {"status": "cancelled"}]}
+
+TABLE_FIELDS = ("id", "table_number", "capacity", "status", "current_order_id", "position_x", "position_y", "created_at")
+
+
+class TableStateService:
+    """Keeps the tables collection and the in-memory table map in step"""
+
+    def __init__(self):
+        self.db = None
+        self._tables: Dict[str, Dict[str, Any]] = {}      # table_number → table dict (+ order_ids)
+        self._order_tables: Dict[str, str] = {}           # order id → table_number
+        self._lock = asyncio.Lock()
+
+    # ==================== LOADING ====================
+    async def load(self, db):
+        """Build the map from the tables collection and the currently open orders"""
+        self.db = db
+        tables: Dict[str, Dict[str, Any]] = {}
+        async for table in db.tables.find({}, {"_id": 0}):
+            table["table_number"] = str(table.get("table_number"))
+            table["order_ids"] = []
+            tables[table["table_number"]] = table
+
+        order_tables: Dict[str, str] = {}
+        open_orders = db.orders.find(
+            {"table_number": {"$in": list(tables)}, "$nor": [INACTIVE_ORDER_QUERY]},
+            {"_id": 0, "id": 1, "table_number": 1}
+        ).sort("created_at", 1)
+        async for order in open_orders:
+            table_number = str(order["table_number"])
+            tables[table_number]["order_ids"].append(order["id"])
+            order_tables[order["id"]] = table_number
+
+        # Repair tables left occupied by orders that were paid/cancelled before this index existed
+        stale = [
+            number for number, table in tables.items()
+            if table.get("status") == "occupied" and not table["order_ids"]
+        ]
+        if stale:
+            await db.tables.update_many(
+                {"table_number": {"$in": stale}},
+                {"$set": {"status": "available", "current_order_id": None}}
+            )
+            for number in stale:
+                tables[number].update(status="available", current_order_id=None)
+            logger.info(f"🧹 Freed {len(stale)} stale occupied table(s): {', '.join(stale)}")
+
+        async with self._lock:
+            self._tables = tables
+            self._order_tables = order_tables
+        logger.info(f"✅ Table state loaded: {len(tables)} tables, {len(order_tables)} open orders")
+
+    # ==================== LOOKUPS ====================
+    def get(self, table_number: Any) -> Optional[Dict[str, Any]]:
+        table = self._tables.get(str(table_number))
+        return self._public(table) if table else None
+
+    def active_order(self, table_number: Any) -> Optional[str]:
+        table = self._tables.get(str(table_number))
+        return table["order_ids"][-1] if table and table["order_ids"] else None
+
+    def table_for_order(self, order_id: str) -> Optional[str]:
+        return self._order_tables.get(order_id)
+
+    def all(self) -> List[Dict[str, Any]]:
+        return [self._public(table) for table in self._tables.values()]
+
+    def floor_plan(self) -> List[Dict[str, Any]]:
+        """Compact view of every table for the floor screen"""
+        return [
+            {
+                "id": table.get("id"),
+                "table_number": number,
+                "capacity": table.get("capacity", 4),
+                "status": table.get("status", "available"),
+                "order_ids": list(table["order_ids"]),
+                "x": table.get("position_x", 0),
+                "y": table.get("position_y", 0)
+            }
+            for number, table in self._tables.items()
+        ]
+
+    # ==================== ORDER EVENTS ====================
+    async def occupy(self, table_number: Any, order_id: str):
+        """An order was placed on (or moved to) a table"""
+        await self._occupy(table_number, order_id, write=True)
+
+    async def mark_occupied(self, table_number: Any, order_id: str):
+        """
+        Map-only variant of occupy() for callers that already wrote the table
+        document inside their own transaction (see write_occupied)
+        """
+        await self._occupy(table_number, order_id, write=False)
+
+    async def write_occupied(self, table_number: Any, order_id: str, session=None) -> bool:
+        """Mongo-only part of occupy(); safe to repeat when a transaction is retried"""
+        if str(table_number) not in self._tables:
+            return False
+        await self.db.tables.update_one(
+            {"table_number": str(table_number)},
+            {"$set": {"status": "occupied", "current_order_id": order_id}},
+            session=session
+        )
+        return True
+
+    async def _occupy(self, table_number: Any, order_id: str, write: bool):
+        table_number = str(table_number) if table_number is not None else None
+        async with self._lock:
+            table = self._tables.get(table_number)
+            if table is None:
+                return  # Takeaway / delivery / unknown table number
+            previous = self._order_tables.get(order_id)
+            if previous == table_number:
+                return
+            if previous is not None:
+                await self._detach(order_id, previous)
+            if write:
+                await self.write_occupied(table_number, order_id)
+            table["order_ids"].append(order_id)
+            table.update(status="occupied", current_order_id=order_id)
+            self._order_tables[order_id] = table_number
+
+    async def release(self, order_id: str):
+        """An order was paid, cancelled or deleted - free its table if nothing else is open on it"""
+        async with self._lock:
+            table_number = self._order_tables.get(order_id)
+            if table_number is not None:
+                await self._detach(order_id, table_number)
+
+    async def _detach(self, order_id: str, table_number: str):
+        """Caller holds the lock"""
+        table = self._tables.get(table_number)
+        self._order_tables.pop(order_id, None)
+        if table is None or order_id not in table["order_ids"]:
+            return
+        remaining = [oid for oid in table["order_ids"] if oid != order_id]
+        if remaining:
+            fields = {"current_order_id": remaining[-1]}
+        else:
+            # Keep reserved/cleaning if staff set it meanwhile; only an occupied table becomes free
+            status = "available" if table.get("status") == "occupied" else table.get("status")
+            fields = {"status": status, "current_order_id": None}
+        await self.db.tables.update_one({"table_number": table_number}, {"$set": fields})
+        table["order_ids"] = remaining
+        table.update(fields)
+
+    # ==================== TABLE ENDPOINTS ====================
+    async def add_table(self, table_dict: Dict[str, Any]):
+        await self.db.tables.insert_one(dict(table_dict))
+        async with self._lock:
+            table = {key: table_dict.get(key) for key in TABLE_FIELDS}
+            table["table_number"] = str(table["table_number"])
+            table["order_ids"] = []
+            self._tables[table["table_number"]] = table
+
+    async def update_table(self, table_id: str, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Manual status change from the floor screen; returns the updated table or None"""
+        async with self._lock:
+            updated = await self.db.tables.find_one_and_update(
+                {"id": table_id},
+                {"$set": fields},
+                return_document=True
+            )
+            if updated is None:
+                return None
+            table_number = str(updated.get("table_number"))
+            table = self._tables.setdefault(table_number, {"order_ids": []})
+            table.update({key: updated.get(key) for key in TABLE_FIELDS})
+            table["table_number"] = table_number
+            return updated
+
+    async def remove_table(self, table_id: str) -> bool:
+        async with self._lock:
+            removed = await self.db.tables.find_one_and_delete({"id": table_id})
+            if removed is None:
+                return False
+            table = self._tables.pop(str(removed.get("table_number")), None)
+            for order_id in (table or {}).get("order_ids", []):
+                self._order_tables.pop(order_id, None)
+            return True
+
+    @staticmethod
+    def _public(table: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: table.get(key) for key in TABLE_FIELDS}
+
+
+table_state = TableStateService()
@@ -0,0 +1,293 @@
+"""
+Tests for services/ai_client.py against an in-process stub of the AI service
+
+The upstream is an httpx.MockTransport, so nothing listens on a port:
+timeouts, the concurrency cap, the circuit breaker and the prompt cache are
+exercised through AIChatClient exactly as /api/ai-chat uses it.
+
+Run:  python -m pytest test_ai_client.py   (or: python test_ai_client.py)
+"""
+
+import asyncio
+import time
+
+import httpx
+
+from services import ai_client as ai
+from services.ai_client import AIChatClient, AIServiceUnavailable, CircuitBreaker
+
+
+class StubUpstream:
+    """Stand-in for the AI service: records requests, answers with `behaviour(request)`"""
+
+    def __init__(self, behaviour=None):
+        self.behaviour = behaviour
+        self.requests = []
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            if self.behaviour is not None:
+                response = await self.behaviour(request)
+                if response is not None:
+                    return response
+            return httpx.Response(200, json={"response": "ok", "intent": "test"})
+        finally:
+            self.in_flight -= 1
+
+
+def make_client(upstream: StubUpstream, **kwargs) -> AIChatClient:
+    return AIChatClient(base_url="http://ai.test", transport=httpx.MockTransport(upstream), **kwargs)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+# ==================== TIMEOUTS ====================
+def test_chat_uses_route_timeout():
+    upstream = StubUpstream()
+
+    async def scenario():
+        client = make_client(upstream)
+        await client.chat("hello")
+        await client.close()
+
+    run(scenario())
+    timeout = upstream.requests[0].extensions["timeout"]
+    assert timeout["read"] == ai.ROUTE_TIMEOUTS["/chat"].read
+    assert timeout["connect"] == ai.ROUTE_TIMEOUTS["/chat"].connect
+
+
+def test_upstream_timeout_is_unavailable_and_counts_as_failure():
+    async def hang(request):
+        raise httpx.ReadTimeout("read timed out", request=request)
+
+    upstream = StubUpstream(hang)
+
+    async def scenario():
+        client = make_client(upstream)
+        try:
+            await client.chat("slow question")
+            raise AssertionError("expected AIServiceUnavailable")
+        except AIServiceUnavailable:
+            pass
+        assert client.breaker.failures == 1
+        assert len(client.cache) == 0
+        await client.close()
+
+    run(scenario())
+
+
+# ==================== CONCURRENCY CAP ====================
+def test_in_flight_calls_never_exceed_the_cap():
+    async def scenario():
+        gate = asyncio.Event()
+
+        async def wait_for_gate(request):
+            await gate.wait()
+
+        upstream = StubUpstream(wait_for_gate)
+        client = make_client(upstream, max_concurrency=2)
+        calls = [asyncio.create_task(client.chat(f"question {i}")) for i in range(5)]
+        await asyncio.sleep(0.05)
+        assert upstream.in_flight == 2
+        gate.set()
+        results = await asyncio.gather(*calls)
+        await client.close()
+        return upstream, results
+
+    upstream, results = run(scenario())
+    assert upstream.peak_in_flight == 2
+    assert len(upstream.requests) == 5
+    assert all(result["response"] == "ok" for result in results)
+
+
+def test_waiting_longer_than_pool_timeout_is_rejected():
+    original = ai.ROUTE_TIMEOUTS["/chat"]
+    ai.ROUTE_TIMEOUTS["/chat"] = httpx.Timeout(connect=2.0, read=30.0, write=5.0, pool=0.05)
+
+    async def scenario():
+        gate = asyncio.Event()
+
+        async def wait_for_gate(request):
+            await gate.wait()
+
+        upstream = StubUpstream(wait_for_gate)
+        client = make_client(upstream, max_concurrency=1)
+        first = asyncio.create_task(client.chat("first"))
+        await asyncio.sleep(0.01)
+        try:
+            await client.chat("second")
+            raise AssertionError("expected AIServiceUnavailable")
+        except AIServiceUnavailable as e:
+            assert "in flight" in str(e)
+        gate.set()
+        await first
+        # A full queue is not an upstream failure
+        assert client.breaker.failures == 0
+        await client.close()
+        return upstream
+
+    try:
+        upstream = run(scenario())
+    finally:
+        ai.ROUTE_TIMEOUTS["/chat"] = original
+    assert len(upstream.requests) == 1
+
+
+# ==================== CIRCUIT BREAKER ====================
+def test_breaker_opens_then_half_open_trial_closes_it():
+    healthy = {"up": False}
+
+    async def flaky(request):
+        if not healthy["up"]:
+            return httpx.Response(503, json={"detail": "down"})
+
+    upstream = StubUpstream(flaky)
+
+    async def scenario():
+        client = make_client(upstream, breaker=CircuitBreaker(failure_threshold=2, reset_seconds=0.1))
+        for i in range(2):
+            try:
+                await client.chat(f"failing {i}")
+            except AIServiceUnavailable:
+                pass
+        assert client.breaker.state == "open"
+
+        # Open: rejected without reaching the upstream
+        try:
+            await client.chat("while open")
+            raise AssertionError("expected AIServiceUnavailable")
+        except AIServiceUnavailable as e:
+            assert "circuit open" in str(e)
+        assert len(upstream.requests) == 2
+
+        await asyncio.sleep(0.12)
+        assert client.breaker.state == "half_open"
+        healthy["up"] = True
+        result = await client.chat("trial")
+        assert result["response"] == "ok"
+        assert client.breaker.state == "closed"
+        await client.close()
+
+    run(scenario())
+    assert len(upstream.requests) == 3
+
+
+def test_failed_half_open_trial_reopens_the_circuit():
+    async def down(request):
+        return httpx.Response(502)
+
+    upstream = StubUpstream(down)
+
+    async def scenario():
+        client = make_client(upstream, breaker=CircuitBreaker(failure_threshold=1, reset_seconds=0.1))
+        try:
+            await client.chat("first")
+        except AIServiceUnavailable:
+            pass
+        await asyncio.sleep(0.12)
+        assert client.breaker.state == "half_open"
+        try:
+            await client.chat("trial")
+        except AIServiceUnavailable:
+            pass
+        assert client.breaker.state == "open"
+        await client.close()
+
+    run(scenario())
+    assert len(upstream.requests) == 2
+
+
+def test_half_open_allows_a_single_trial_call():
+    async def scenario():
+        gate = asyncio.Event()
+
+        async def wait_for_gate(request):
+            await gate.wait()
+
+        upstream = StubUpstream(wait_for_gate)
+        breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0.05)
+        breaker.record_failure()
+        await asyncio.sleep(0.06)
+        client = make_client(upstream, breaker=breaker)
+        trial = asyncio.create_task(client.chat("trial"))
+        await asyncio.sleep(0.01)
+        try:
+            await client.chat("second")
+            raise AssertionError("expected AIServiceUnavailable")
+        except AIServiceUnavailable:
+            pass
+        gate.set()
+        await trial
+        assert breaker.state == "closed"
+        await client.close()
+        return upstream
+
+    upstream = run(scenario())
+    assert len(upstream.requests) == 1
+
+
+def test_client_errors_do_not_trip_the_breaker():
+    async def bad_request(request):
+        return httpx.Response(422, json={"detail": "bad"})
+
+    upstream = StubUpstream(bad_request)
+
+    async def scenario():
+        client = make_client(upstream, breaker=CircuitBreaker(failure_threshold=1))
+        try:
+            await client.chat("malformed")
+            raise AssertionError("expected HTTPStatusError")
+        except httpx.HTTPStatusError:
+            pass
+        assert client.breaker.state == "closed"
+        await client.close()
+
+    run(scenario())
+
+
+# ==================== PROMPT CACHE ====================
+def test_repeated_prompt_is_served_from_cache():
+    upstream = StubUpstream()
+
+    async def scenario():
+        client = make_client(upstream)
+        first = await client.chat("What are your timings?")
+        second = await client.chat("what are your   timings")
+        stats = client.stats()
+        await client.close()
+        return first, second, stats
+
+    first, second, stats = run(scenario())
+    assert first == second
+    assert len(upstream.requests) == 1
+    assert stats["cache_hits"] == 1
+    assert stats["cache_misses"] == 1
+
+
+def test_expired_cache_entry_goes_upstream_again():
+    upstream = StubUpstream()
+
+    async def scenario():
+        client = make_client(upstream, cache=ai.ResponseCache(ttl_seconds=0.05))
+        await client.chat("menu please")
+        time.sleep(0.06)
+        await client.chat("menu please")
+        await client.close()
+
+    run(scenario())
+    assert len(upstream.requests) == 2
+
+
+if __name__ == "__main__":
+    tests = [(name, fn) for name, fn in sorted(globals().items()) if name.startswith("test_") and callable(fn)]
+    for name, fn in tests:
+        fn()
+        print(f"✅ {name}")
+    print(f"{len(tests)} passed")
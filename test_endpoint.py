@@ -18,6 +18,14 @@ async def test_chatbot(chat: ChatMessage):
         intent="test"
     )
 
+# Stand-in for the AI service behind /api/ai-chat (AI_SERVICE_URL=http://127.0.0.1:8003)
+class AIChatMessage(BaseModel):
+    message: str
+
+@app.post("/chat")
+async def test_ai_chat(chat: AIChatMessage):
+    return {"response": f"AI got: {chat.message}", "intent": "test"}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="127.0.0.1", port=8003)